@@ -0,0 +1,171 @@
+import json
+import time
+from abc import abstractmethod
+
+import redis
+from simplekiq import KiqQueue
+
+# moves up to ARGV[1] events from the head of the queue to the processing list, in one step
+TAKE = """
+local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #events > 0 then
+    redis.call('LTRIM', KEYS[1], #events, -1)
+    redis.call('RPUSH', KEYS[2], unpack(events))
+end
+return events
+"""
+
+# puts the processing list back at the head of the queue, in order
+RESTORE = """
+local n = 0
+while redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) do
+    n = n + 1
+end
+return n
+"""
+
+MAX_BATCH_SIZE = 1000
+RECONNECT_SECONDS = 1
+
+
+class BatchWorker:
+    """
+    Handles the events of a simplekiq queue by batches of up to `batch_size`, waiting up to `batch_wait_ms` for a
+    batch to fill. An empty queue is waited on with BRPOPLPUSH, up to `block_ms` at a time, rather than polled.
+
+    The events are moved from the queue to a processing list of this worker and removed from it only once
+    `on_events` returned, so a worker which dies loses nothing: it puts its processing list back in the queue when
+    it starts again. An event can then be handled twice. The list is named after `consumer`, which must stay the
+    same for the worker which replaces a dead one, and after `index`. The same is done when the connection to
+    Redis is lost, once it is opened again.
+
+    When a batch fails, its events are handled one by one, and those which fail again are retried or moved to the
+    failed queue as simplekiq's Worker does. A message which is not an event goes to the failed queue as it is.
+    """
+    def __init__(self, queue: KiqQueue, failed_queue: KiqQueue, conf, index: int = 0):
+        self.queue = queue
+        self.failed_queue = failed_queue
+        self.batch_size = min(conf.getint("batch_size", fallback=100), MAX_BATCH_SIZE)
+        self.batch_wait = conf.getint("batch_wait_ms", fallback=50) / 1000
+        self.poll_interval = conf.getint("poll_ms", fallback=10) / 1000
+        self.block_timeout = conf.getint("block_ms", fallback=1000) / 1000
+
+        consumer = conf.get("consumer", fallback=None)
+        if not consumer:
+            raise Exception("consumer should be set, the processing lists of a dead worker are named after it")
+        self.processing_name = f"{queue.queue_name}:processing:{consumer}:{index}"
+        self.register_scripts()
+
+    def register_scripts(self):
+        self.take_script = self.queue.conn.register_script(TAKE)
+        self.restore_script = self.queue.conn.register_script(RESTORE)
+
+    def reconnect(self):
+        self.queue.conn = self.queue.connect_to_redis(self.queue.addr)
+        self.failed_queue.conn = self.failed_queue.connect_to_redis(self.failed_queue.addr)
+        self.register_scripts()
+
+    @abstractmethod
+    def on_events(self, events):
+        """`events` is a list of (event_type, value). Returns once they are committed."""
+        pass
+
+    def restore(self):
+        n = self.restore_script(keys=[self.processing_name, self.queue.queue_name])
+        if n:
+            print(f"Put {n} events of {self.processing_name} back in {self.queue.queue_name}")
+
+    def take(self, count: int):
+        return self.take_script(keys=[self.queue.queue_name, self.processing_name], args=[count])
+
+    def fetch(self):
+        events = self.take(self.batch_size)
+        if not events:
+            # BLMOVE would keep the order but needs Redis 6.2, only the first event of a wake up is the newest one
+            event = self.queue.conn.brpoplpush(self.queue.queue_name, self.processing_name, self.block_timeout)
+            if event is None:
+                return []
+            events = [event]
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(events) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, self.poll_interval))
+            events += self.take(self.batch_size - len(events))
+        return events
+
+    def process(self) -> int:
+        raw = self.fetch()
+        if not raw:
+            return 0
+
+        events = []
+        malformed = []
+        for v in raw:
+            event = self.parse(v)
+            if event is None:
+                malformed.append(v)
+            else:
+                events.append(event)
+
+        retries = []
+        try:
+            if events:
+                self.on_events([(e["class"], e["args"]) for e in events])
+        except Exception as e:
+            print(f"Batch of {len(events)} failed: {str(e)}")
+            for event in events:
+                try:
+                    self.on_events([(event["class"], event["args"])])
+                except Exception as e:
+                    print(e)
+                    retries.append(event)
+
+        # the ack, and the failed events back in a queue, at once
+        pipe = self.queue.conn.pipeline()
+        for v in malformed:
+            pipe.rpush(self.failed_queue.queue_name, v)
+        for event in retries:
+            queue = self.queue if self.retry(event) else self.failed_queue
+            pipe.rpush(queue.queue_name, json.dumps(event))
+        pipe.delete(self.processing_name)
+        pipe.execute()
+        return len(raw)
+
+    @staticmethod
+    def parse(value):
+        """The event of a message, or None when it is not one. Left in the queue, it would stop every worker."""
+        try:
+            event = json.loads(value.decode('utf-8'))
+        except ValueError as e:
+            print(f"Malformed event: {str(e)}")
+            return None
+
+        if not isinstance(event, dict) or "class" not in event or "args" not in event:
+            print(f"Malformed event: {value[:100]}")
+            return None
+        return event
+
+    @staticmethod
+    def retry(event) -> bool:
+        """Whether a failed event is retried, with the rules of simplekiq's Worker."""
+        if event.get("retry") == "true":
+            event["retry"] = 0
+            return True
+        if isinstance(event.get("retry"), int) and event["retry"] > 0:
+            event["retry"] -= 1
+            return True
+        return False
+
+    def run(self):
+        while True:
+            try:
+                self.restore()
+                while True:
+                    self.process()
+            except redis.exceptions.ConnectionError as e:
+                print(f"Lost Redis: {str(e)}")
+                time.sleep(RECONNECT_SECONDS)
+                self.reconnect()
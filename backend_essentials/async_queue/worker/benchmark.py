@@ -0,0 +1,104 @@
+"""
+Events/sec of the event worker, and of the batch worker by batch size, against a local Redis and SQLite.
+
+    python benchmark.py [events] [concurrency]
+
+Starts redis-server on port 6420 and writes to bench.db, which is deleted before every run. `concurrency` batch
+worker processes drain the queue together. SQLite commits with an fsync like MySQL does, so one commit per event
+is what the event worker pays.
+"""
+import os
+import sys
+import time
+import json
+import contextlib
+import subprocess
+import configparser
+import multiprocessing
+
+from sqlalchemy import func
+
+from simplekiq import KiqQueue
+from simplekiq import EventBuilder
+
+import database
+import models
+from worker import MyEventWorker, MyBatchWorker
+
+HOST = "127.0.0.1:6420"
+DB_PATH = "bench.db"
+BATCH_SIZES = [1, 10, 100, 500]
+
+
+def reset(events):
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    database.init_database(f"sqlite:///{DB_PATH}")
+
+    queue = KiqQueue(HOST, "bench", True)
+    queue.conn.delete(queue.queue_name, "bench_failed")
+    builder = EventBuilder(queue)
+    values = [json.dumps(builder.emit("scrap", {"url": f"https://example.com/{i}"})) for i in range(events)]
+    for i in range(0, events, 1000):
+        queue.conn.rpush(queue.queue_name, *values[i:i + 1000])
+
+
+def count():
+    db = database.Session()
+    try:
+        return db.query(func.count(models.Url.uid)).scalar()
+    finally:
+        db.close()
+
+
+def drain_events():
+    database.init_database(f"sqlite:///{DB_PATH}")
+    worker = MyEventWorker(KiqQueue(HOST, "bench", True), KiqQueue(HOST, "bench_failed", True))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while worker.queue.conn.llen(worker.queue.queue_name):
+            worker.process(False)
+
+
+def drain_batches(batch_size, index):
+    database.init_database(f"sqlite:///{DB_PATH}")
+    conf = configparser.ConfigParser()
+    conf.read_string(f"[batch]\nbatch_size={batch_size}\nconsumer=bench\nblock_ms=10\n")
+    worker = MyBatchWorker(KiqQueue(HOST, "bench", True), KiqQueue(HOST, "bench_failed", True), conf["batch"], index)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while worker.process():
+            pass
+
+
+def run(name, events, target, args_list):
+    reset(events)
+    start = time.monotonic()
+    processes = [multiprocessing.Process(target=target, args=args) for args in args_list]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    elapsed = time.monotonic() - start
+    print(f"{name:>12} {events / elapsed:>11.0f} {count():>8}")
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    host, port = HOST.split(":")
+    server = subprocess.Popen(["redis-server", "--port", port, "--save", "", "--appendonly", "no"],
+                              stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    try:
+        print(f"{'worker':>12} {'events/sec':>11} {'rows':>8}")
+        run("event", events, drain_events, [()])
+        for batch_size in BATCH_SIZES:
+            run(f"batch {batch_size}", events, drain_batches, [(batch_size, i) for i in range(concurrency)])
+    finally:
+        server.terminate()
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
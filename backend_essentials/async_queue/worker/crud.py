@@ -1,3 +1,4 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from models import Url
 
@@ -7,3 +8,9 @@ def create_url(db: Session, url):
     db.commit()
     db.refresh(db_url)
     return db_url
+
+
+def create_urls(db: Session, urls):
+    # one INSERT with a row per url, and one commit
+    db.execute(insert(Url).values([{"url": url} for url in urls]))
+    db.commit()
@@ -1,5 +1,6 @@
 import redis
 import json
+import multiprocessing
 
 from simplekiq import KiqQueue
 from simplekiq import EventBuilder
@@ -9,6 +10,7 @@ from config import Config
 import crud
 import models
 import database
+from batch_worker import BatchWorker
 
 
 def get_db():
@@ -23,14 +25,48 @@ class MyEventWorker(Worker):
         print(event_type, value)
 
 
+class MyBatchWorker(BatchWorker):
+    def on_events(self, events):
+        db = get_db()
+        try:
+            crud.create_urls(db, [value["url"] for event_type, value in events])
+        finally:
+            db.close()
+        print(f"{len(events)} events")
+
+
 dbconf = Config("worker.ini").section("database")
 conf = Config("worker.ini").section("sidekiq")
-queue = KiqQueue(conf["host"], conf["queue"], True)
-failed_queue = KiqQueue(conf["host"], conf["failed_queue"], True)
+batch_conf = Config("worker.ini").section("batch")
+
+
+def run_event_worker():
+    queue = KiqQueue(conf["host"], conf["queue"], True)
+    failed_queue = KiqQueue(conf["host"], conf["failed_queue"], True)
+
+    database.init_database(dbconf["url"])
+    worker = MyEventWorker(queue, failed_queue)
+
+    while True:
+        worker.process(True)
+
+
+def run_batch_worker(index):
+    # every process has its own connections
+    queue = KiqQueue(conf["host"], conf["queue"], True)
+    failed_queue = KiqQueue(conf["host"], conf["failed_queue"], True)
+
+    database.init_database(dbconf["url"])
+    MyBatchWorker(queue, failed_queue, batch_conf, index).run()
 
-database.init_database(dbconf["url"])
-worker = MyEventWorker(queue, failed_queue)
 
+if __name__ == "__main__":
+    if not batch_conf.getboolean("enabled", fallback=False):
+        run_event_worker()
 
-while True:
-    worker.process(True)
+    processes = [multiprocessing.Process(target=run_batch_worker, args=(i,))
+                 for i in range(batch_conf.getint("concurrency", fallback=1))]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
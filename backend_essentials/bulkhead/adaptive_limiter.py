@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import math
+import time
+from collections import deque
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+LIMIT = Gauge("bulkhead_limit", "Current concurrency limit", ["name"])
+INFLIGHT = Gauge("bulkhead_inflight", "Calls running inside the bulkhead", ["name"])
+QUEUE_WAIT = Histogram(
+    "bulkhead_queue_wait_seconds", "Time spent waiting for a slot", ["name"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+REJECTIONS = Counter("bulkhead_rejections_total", "Calls rejected by the bulkhead", ["name", "reason"])
+
+
+class BulkheadFull(Exception):
+    """Raised when the queue of the bulkhead is full or the queue timeout expired."""
+
+
+class FixedLimit:
+    """The limit never changes, like the hyx bulkhead."""
+    def __init__(self, limit: int = 10):
+        self.initial_limit = limit
+
+    def update(self, limit: float, rtt: float, inflight: int, dropped: bool) -> float:
+        return limit
+
+
+class AIMDLimit:
+    """
+    Additive increase while the limit is actually used, multiplicative decrease on errors and on calls slower
+    than `timeout`.
+    """
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 200,
+                 backoff_ratio: float = 0.9, timeout: float = 1.0):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.timeout = timeout
+
+    def update(self, limit: float, rtt: float, inflight: int, dropped: bool) -> float:
+        if dropped or rtt > self.timeout:
+            limit = limit * self.backoff_ratio
+        elif inflight * 2 >= limit:
+            # only grow when the current limit is the bottleneck
+            limit = limit + 1.0 / max(1.0, math.sqrt(limit))
+
+        return min(self.max_limit, max(self.min_limit, limit))
+
+
+class GradientLimit:
+    """
+    Gradient2 style: compares a short-term latency average with a long-term one. When short-term latency rises
+    above the long-term one, requests queue somewhere downstream and the limit shrinks by their ratio, otherwise
+    it grows by a queue allowance of sqrt(limit).
+    """
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 200,
+                 tolerance: float = 1.5, smoothing: float = 0.2, long_window: int = 600, short_window: int = 10):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.long_alpha = 2.0 / (long_window + 1)
+        self.short_alpha = 2.0 / (short_window + 1)
+        self.long_rtt = None
+        self.short_rtt = None
+
+    def update(self, limit: float, rtt: float, inflight: int, dropped: bool) -> float:
+        if self.long_rtt is None:
+            self.long_rtt = self.short_rtt = rtt
+        self.short_rtt += self.short_alpha * (rtt - self.short_rtt)
+        self.long_rtt += self.long_alpha * (rtt - self.long_rtt)
+
+        # let the long-term average recover quickly once latency went back down
+        if self.long_rtt / self.short_rtt > 2:
+            self.long_rtt *= 0.95
+
+        if dropped:
+            gradient = 0.5
+        elif inflight < limit / 2:
+            # the limit is not what holds the calls back, keep it
+            return limit
+        else:
+            gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+
+        new_limit = limit * gradient + math.sqrt(limit)
+        limit = limit * (1 - self.smoothing) + new_limit * self.smoothing
+        return min(self.max_limit, max(self.min_limit, limit))
+
+
+class AdaptiveLimiter:
+    """
+    A bulkhead whose concurrency limit follows the observed latency and errors of the calls it protects.
+
+    Used as an async context manager (`async with limiter:`) or as a decorator (`@limiter`) of coroutine
+    functions. At most `limit` calls run at once, up to `max_capacity` wait in a FIFO queue for at most
+    `queue_timeout` seconds, and others are rejected with BulkheadFull.
+    """
+    def __init__(self, algorithm=None, max_capacity: int = 100, queue_timeout: Optional[float] = None,
+                 name: str = "default"):
+        self.algorithm = algorithm if algorithm else AIMDLimit()
+        self.limit = float(self.algorithm.initial_limit)
+        self.max_capacity = max_capacity
+        self.queue_timeout = queue_timeout
+        self.name = name
+
+        self.inflight = 0
+        self.waiters = deque()
+        # start times of the calls entered with `async with`, per task since the limiter is shared
+        self.starts = {}
+        LIMIT.labels(name).set(self.limit)
+
+    def wake(self):
+        while self.waiters and self.inflight < int(self.limit):
+            future = self.waiters.popleft()
+            if not future.done():
+                self.inflight += 1
+                future.set_result(None)
+        INFLIGHT.labels(self.name).set(self.inflight)
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self.waiters:
+            self.inflight += 1
+            INFLIGHT.labels(self.name).set(self.inflight)
+            QUEUE_WAIT.labels(self.name).observe(0)
+            return
+
+        if len(self.waiters) >= self.max_capacity:
+            REJECTIONS.labels(self.name, "capacity").inc()
+            raise BulkheadFull(f"{self.name}: queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # the slot was granted right when the waiter gave up
+                self.inflight -= 1
+                self.wake()
+            else:
+                future.cancel()
+                try:
+                    self.waiters.remove(future)
+                except ValueError:
+                    pass
+
+            if isinstance(e, asyncio.TimeoutError):
+                REJECTIONS.labels(self.name, "timeout").inc()
+                raise BulkheadFull(f"{self.name}: queue timeout") from e
+            raise
+        finally:
+            QUEUE_WAIT.labels(self.name).observe(time.monotonic() - start)
+
+    def release(self, rtt: float, dropped: bool):
+        inflight = self.inflight
+        self.inflight -= 1
+        self.limit = self.algorithm.update(self.limit, rtt, inflight, dropped)
+        LIMIT.labels(self.name).set(self.limit)
+        self.wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        self.starts.setdefault(asyncio.current_task(), []).append(time.monotonic())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        task = asyncio.current_task()
+        starts = self.starts[task]
+        start = starts.pop()
+        if not starts:
+            del self.starts[task]
+        self.release(time.monotonic() - start, exc_type is not None)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            await self.acquire()
+            start = time.monotonic()
+            dropped = True
+            try:
+                result = await func(*args, **kwargs)
+                dropped = False
+                return result
+            finally:
+                self.release(time.monotonic() - start, dropped)
+
+        return wrapper
@@ -0,0 +1,116 @@
+"""
+Simulates a downstream whose capacity and latency change over time, behind a fixed bulkhead and the adaptive ones.
+
+    python benchmark.py [requests per second] [seconds per phase]
+
+The downstream serves `workers` calls at once and queues the others, so calls slow down as soon as more are sent
+than it can take. Requests arrive at a constant rate (open loop) and the phases are healthy, degraded and
+recovered. For each phase it prints the completed and rejected calls, the latency seen by the caller, queue wait
+included, the latency of the downstream call alone and the average concurrency limit.
+"""
+import sys
+import time
+import asyncio
+
+from adaptive_limiter import AdaptiveLimiter, AIMDLimit, BulkheadFull, FixedLimit, GradientLimit
+
+# name, workers of the downstream, service time in seconds
+PHASES = [
+    ("healthy", 100, 0.02),
+    ("degraded", 10, 0.1),
+    ("recovered", 100, 0.02),
+]
+
+
+class Downstream:
+    def __init__(self):
+        self.cond = asyncio.Condition()
+        self.busy = 0
+        self.workers = PHASES[0][1]
+        self.service_time = PHASES[0][2]
+
+    async def set_phase(self, workers, service_time):
+        async with self.cond:
+            self.workers = workers
+            self.service_time = service_time
+            self.cond.notify_all()
+
+    async def call(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.busy < self.workers)
+            self.busy += 1
+        try:
+            await asyncio.sleep(self.service_time)
+        finally:
+            async with self.cond:
+                self.busy -= 1
+                self.cond.notify()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(name, algorithm, rate, phase_seconds):
+    downstream = Downstream()
+    limiter = AdaptiveLimiter(algorithm, max_capacity=100, queue_timeout=1.0, name=name)
+    stats = {phase: {"ok": 0, "rejected": 0, "latencies": [], "rtts": [], "limits": []} for phase, _, _ in PHASES}
+    tasks = set()
+
+    async def request(phase):
+        start = time.monotonic()
+        try:
+            async with limiter:
+                call_start = time.monotonic()
+                await downstream.call()
+        except BulkheadFull:
+            stats[phase]["rejected"] += 1
+            return
+        end = time.monotonic()
+        stats[phase]["ok"] += 1
+        stats[phase]["latencies"].append(end - start)
+        stats[phase]["rtts"].append(end - call_start)
+
+    interval = 1.0 / rate
+    for phase, workers, service_time in PHASES:
+        await downstream.set_phase(workers, service_time)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        while loop.time() - start < phase_seconds:
+            # catch up on the arrivals due since the last tick
+            due = int((loop.time() - start) / interval) + 1
+            for _ in range(due - sent):
+                task = asyncio.ensure_future(request(phase))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent = due
+            stats[phase]["limits"].append(limiter.limit)
+            await asyncio.sleep(interval)
+
+    await asyncio.gather(*tasks)
+
+    for phase, _, _ in PHASES:
+        s = stats[phase]
+        latencies = s["latencies"]
+        print(f"{name:<9} {phase:<10} ok={s['ok']:>5} rejected={s['rejected']:>5} "
+              f"p50={percentile(latencies, 0.5) * 1000:>6.1f}ms p99={percentile(latencies, 0.99) * 1000:>6.1f}ms "
+              f"downstream p99={percentile(s['rtts'], 0.99) * 1000:>6.1f}ms "
+              f"limit={sum(s['limits']) / len(s['limits']):>6.1f}")
+
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 800
+    phase_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"rate={rate:.0f}/s phases={', '.join(f'{p}({w} workers, {t * 1000:.0f}ms)' for p, w, t in PHASES)}")
+    asyncio.run(run("fixed", FixedLimit(10), rate, phase_seconds))
+    asyncio.run(run("aimd", AIMDLimit(initial_limit=10, timeout=0.25), rate, phase_seconds))
+    asyncio.run(run("gradient", GradientLimit(initial_limit=10), rate, phase_seconds))
+
+
+if __name__ == "__main__":
+    main()
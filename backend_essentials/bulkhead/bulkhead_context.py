@@ -1,11 +1,14 @@
 from fastapi import FastAPI
+from prometheus_client import make_asgi_app
 
-from hyx.bulkhead import bulkhead
+from adaptive_limiter import AdaptiveLimiter, GradientLimit
 
 # app is an instance of framework like Flask or FastAPI
 app = FastAPI()
+app.mount("/metrics", make_asgi_app())
 
-limiter = bulkhead(max_concurrency=10, max_capacity=100)
+# the concurrency limit starts at 10 and follows the latency of the calls, up to 100 more wait for a slot
+limiter = AdaptiveLimiter(GradientLimit(initial_limit=10, max_limit=200), max_capacity=100, name="projects")
 
 
 @app.post("/projects/")
@@ -1,14 +1,16 @@
 from fastapi import FastAPI
+from prometheus_client import make_asgi_app
 
-from hyx.bulkhead import bulkhead
+from adaptive_limiter import AdaptiveLimiter, AIMDLimit
 
 # app is an instance of framework like Flask or FastAPI
 app = FastAPI()
+app.mount("/metrics", make_asgi_app())
 
 
 @app.post("/projects/")
-@bulkhead(max_concurrency=10, max_capacity=100)
-def create_new_project():
+@AdaptiveLimiter(AIMDLimit(initial_limit=10, max_limit=200, timeout=1.0), max_capacity=100, name="projects")
+async def create_new_project():
     """
     Create a new project
     """
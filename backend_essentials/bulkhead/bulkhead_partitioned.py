@@ -0,0 +1,37 @@
+from typing import Optional
+
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
+from prometheus_client import make_asgi_app
+
+from adaptive_limiter import BulkheadFull, GradientLimit
+from partitioned_bulkhead import Partition, PartitionedBulkhead
+
+# app is an instance of framework like Flask or FastAPI
+app = FastAPI()
+app.mount("/metrics", make_asgi_app())
+
+# every tenant has its own queue and may use at most half of the limit, the internal one weighs twice as much
+limiter = PartitionedBulkhead(
+    GradientLimit(initial_limit=10, max_limit=200),
+    partitions={"internal": Partition(weight=2, max_share=1.0)},
+    default_partition=Partition(weight=1, max_share=0.5, max_capacity=100),
+    name="projects",
+)
+
+
+@app.exception_handler(BulkheadFull)
+async def bulkhead_full(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.post("/projects/")
+@limiter.partitioned(key=lambda kwargs: kwargs["x_tenant"],
+                     lane=lambda kwargs: kwargs["x_priority"],
+                     timeout=lambda kwargs: kwargs["x_request_timeout"])
+async def create_new_project(x_tenant: str = Header("anonymous"), x_priority: str = Header("normal"),
+                             x_request_timeout: Optional[float] = Header(None)):
+    """
+    Create a new project
+    """
+    ...
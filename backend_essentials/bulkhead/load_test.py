@@ -0,0 +1,86 @@
+"""
+Isolation of tenants behind one bulkhead with a shared queue and behind the partitioned one.
+
+    python load_test.py [requests per second per tenant] [seconds per phase]
+
+Tenants a and b send the same rate to a simulated downstream. In the flood phase b sends 10 times as much,
+more than the downstream can serve. For each phase and tenant it prints the completed and rejected calls and the
+latency seen by the caller, queue wait included. The concurrency limit is fixed so only queuing differs.
+"""
+import sys
+import time
+import asyncio
+
+from adaptive_limiter import AdaptiveLimiter, BulkheadFull, FixedLimit
+from benchmark import Downstream, percentile
+from partitioned_bulkhead import Partition, PartitionedBulkhead
+
+WORKERS = 20
+SERVICE_TIME = 0.05
+LIMIT = 20
+
+# name, rate multiplier of each tenant
+PHASES = [
+    ("baseline", {"a": 1, "b": 1}),
+    ("flood", {"a": 1, "b": 10}),
+]
+
+
+async def run(name, limiter, call, rate, phase_seconds):
+    downstream = Downstream()
+    await downstream.set_phase(WORKERS, SERVICE_TIME)
+    stats = {(phase, tenant): {"ok": 0, "rejected": 0, "latencies": []}
+             for phase, rates in PHASES for tenant in rates}
+    tasks = set()
+
+    async def request(phase, tenant):
+        s = stats[(phase, tenant)]
+        start = time.monotonic()
+        try:
+            async with call(limiter, tenant):
+                await downstream.call()
+        except BulkheadFull:
+            s["rejected"] += 1
+            return
+        s["ok"] += 1
+        s["latencies"].append(time.monotonic() - start)
+
+    loop = asyncio.get_running_loop()
+    for phase, rates in PHASES:
+        start = loop.time()
+        sent = {tenant: 0 for tenant in rates}
+        while loop.time() - start < phase_seconds:
+            elapsed = loop.time() - start
+            for tenant, multiplier in rates.items():
+                due = int(elapsed * rate * multiplier) + 1
+                for _ in range(due - sent[tenant]):
+                    task = asyncio.ensure_future(request(phase, tenant))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                sent[tenant] = due
+            await asyncio.sleep(0.001)
+
+    await asyncio.gather(*tasks)
+
+    for (phase, tenant), s in stats.items():
+        latencies = s["latencies"]
+        print(f"{name:<12} {phase:<9} tenant={tenant} ok={s['ok']:>5} rejected={s['rejected']:>5} "
+              f"p50={percentile(latencies, 0.5) * 1000:>6.1f}ms p99={percentile(latencies, 0.99) * 1000:>6.1f}ms")
+
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    phase_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"rate={rate:.0f}/s per tenant, downstream {WORKERS} workers {SERVICE_TIME * 1000:.0f}ms, limit {LIMIT}")
+
+    shared = AdaptiveLimiter(FixedLimit(LIMIT), max_capacity=100, queue_timeout=1.0, name="shared")
+    asyncio.run(run("shared", shared, lambda limiter, tenant: limiter, rate, phase_seconds))
+
+    partitioned = PartitionedBulkhead(FixedLimit(LIMIT), default_partition=Partition(weight=1, max_share=0.5),
+                                      name="partitioned")
+    asyncio.run(run("partitioned", partitioned, lambda limiter, tenant: limiter.call(tenant), rate, phase_seconds))
+
+
+if __name__ == "__main__":
+    main()
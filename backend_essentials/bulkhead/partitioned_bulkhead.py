@@ -0,0 +1,280 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+from adaptive_limiter import AdaptiveLimiter, BulkheadFull, INFLIGHT, QUEUE_WAIT, REJECTIONS
+
+
+PARTITION_INFLIGHT = Gauge("bulkhead_partition_inflight", "Calls running per partition", ["name", "partition"])
+PARTITION_QUEUED = Gauge("bulkhead_partition_queued", "Calls waiting per partition", ["name", "partition"])
+PARTITION_REJECTIONS = Counter("bulkhead_partition_rejections_total", "Calls rejected per partition",
+                               ["name", "partition", "reason"])
+
+# priority lanes, highest first, with the longest time a call may wait in each one
+DEFAULT_LANES = {"high": 0.1, "normal": 1.0, "low": 5.0}
+
+
+class Partition:
+    """
+    Settings of a partition: its weight in the fair queuing, the fraction of the concurrency limit it may use
+    and how many calls may wait in its queue.
+    """
+    def __init__(self, weight: float = 1.0, max_share: float = 1.0, max_capacity: int = 100):
+        # a partition without weight never earns a deficit, the fair queuing would spin on it
+        if weight <= 0:
+            raise Exception(f"Partition weight should be positive: {weight}")
+        self.weight = weight
+        self.max_share = max_share
+        self.max_capacity = max_capacity
+
+
+class Waiter:
+    def __init__(self, future, lane: str, deadline: Optional[float]):
+        self.future = future
+        self.lane = lane
+        self.deadline = deadline
+
+
+class PartitionState:
+    def __init__(self, name: str, config: Partition, lanes):
+        self.name = name
+        self.config = config
+        self.lanes = {lane: deque() for lane in lanes}
+        self.inflight = 0
+        self.queued = 0
+        self.deficit = 0.0
+        self.active = False
+
+    def max_concurrency(self, limit: float) -> int:
+        return max(1, int(limit * self.config.max_share))
+
+    def pop(self) -> Optional[Waiter]:
+        """The oldest waiter of the highest priority lane, skipping those which gave up."""
+        for lane in self.lanes.values():
+            while lane:
+                waiter = lane.popleft()
+                self.queued -= 1
+                if not waiter.future.done():
+                    return waiter
+        return None
+
+    def pending(self) -> bool:
+        return self.queued > 0
+
+
+class PartitionedBulkhead(AdaptiveLimiter):
+    """
+    A bulkhead shared by several partitions, e.g. tenants, routes or clients, so that one of them cannot
+    starve the others.
+
+    Every partition has its own queue, with one lane per priority, and may use at most `max_share` of the
+    concurrency limit. When a slot frees up, the next call is picked among the partitions by deficit round robin
+    according to their weights, and within a partition from the highest priority lane. A call waits at most the
+    delay of its lane, and is shed right away when the time left to it is shorter than its expected wait.
+    """
+    def __init__(self, algorithm=None, partitions: Optional[Dict[str, Partition]] = None,
+                 default_partition: Optional[Partition] = None, lanes: Optional[Dict[str, float]] = None,
+                 quantum: float = 1.0, name: str = "default"):
+        super().__init__(algorithm, max_capacity=0, name=name)
+        self.configs = partitions if partitions else {}
+        self.default_partition = default_partition if default_partition else Partition()
+        self.lanes = lanes if lanes else DEFAULT_LANES
+        self.quantum = quantum
+
+        self.partitions: Dict[str, PartitionState] = {}
+        # partitions with waiters, the first one has the turn
+        self.active = deque()
+        # average latency of a call, to estimate waits
+        self.rtt = None
+
+    def get_partition(self, name: str) -> PartitionState:
+        partition = self.partitions.get(name)
+        if not partition:
+            partition = PartitionState(name, self.configs.get(name, self.default_partition), self.lanes)
+            self.partitions[name] = partition
+        return partition
+
+    def reject(self, partition: PartitionState, reason: str):
+        REJECTIONS.labels(self.name, reason).inc()
+        PARTITION_REJECTIONS.labels(self.name, partition.name, reason).inc()
+        raise BulkheadFull(f"{self.name}/{partition.name}: {reason}")
+
+    def estimated_wait(self, partition: PartitionState) -> float:
+        if self.rtt is None:
+            return 0.0
+        return (partition.queued + 1) * self.rtt / partition.max_concurrency(self.limit)
+
+    def next_turn(self):
+        self.active.rotate(-1)
+        self.active[0].deficit += self.quantum * self.active[0].config.weight
+
+    def grant(self, partition: PartitionState, waiter: Waiter):
+        self.inflight += 1
+        partition.inflight += 1
+        waiter.future.set_result(None)
+
+    def wake(self):
+        blocked = 0
+        while self.inflight < int(self.limit) and self.active and blocked < len(self.active):
+            partition = self.active[0]
+            if not partition.pending():
+                self.active.popleft()
+                partition.active = False
+                partition.deficit = 0.0
+                PARTITION_QUEUED.labels(self.name, partition.name).set(0)
+                if self.active:
+                    self.active[0].deficit += self.quantum * self.active[0].config.weight
+                continue
+
+            if partition.inflight >= partition.max_concurrency(self.limit):
+                blocked += 1
+                self.next_turn()
+                continue
+
+            if partition.deficit < 1:
+                self.next_turn()
+                continue
+
+            waiter = partition.pop()
+            if not waiter:
+                continue
+
+            now = time.monotonic()
+            if waiter.deadline is not None and now + (self.rtt or 0.0) > waiter.deadline:
+                # it would not finish in time anyway
+                waiter.future.set_exception(BulkheadFull(f"{self.name}/{partition.name}: deadline"))
+                continue
+
+            blocked = 0
+            partition.deficit -= 1
+            self.grant(partition, waiter)
+
+        INFLIGHT.labels(self.name).set(self.inflight)
+        for partition in self.active:
+            PARTITION_QUEUED.labels(self.name, partition.name).set(partition.queued)
+
+    async def acquire(self, partition_name: str = "default", lane: str = "normal", timeout: Optional[float] = None):
+        """
+        Takes a slot for a call of the partition. `timeout` is the time left to the whole call, if it has one.
+        """
+        partition = self.get_partition(partition_name)
+        if lane not in self.lanes:
+            raise Exception(f"Unknown priority lane {lane}")
+
+        now = time.monotonic()
+        deadline = now + timeout if timeout is not None else None
+
+        if (self.inflight < int(self.limit) and not self.active
+                and partition.inflight < partition.max_concurrency(self.limit)):
+            self.inflight += 1
+            partition.inflight += 1
+            INFLIGHT.labels(self.name).set(self.inflight)
+            PARTITION_INFLIGHT.labels(self.name, partition.name).set(partition.inflight)
+            QUEUE_WAIT.labels(self.name).observe(0)
+            return
+
+        if partition.queued >= partition.config.max_capacity:
+            self.reject(partition, "capacity")
+
+        max_wait = self.lanes[lane]
+        if deadline is not None:
+            max_wait = min(max_wait, deadline - now - (self.rtt or 0.0))
+        if max_wait <= 0 or self.estimated_wait(partition) > max_wait:
+            self.reject(partition, "deadline")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = Waiter(future, lane, deadline)
+        partition.lanes[lane].append(waiter)
+        partition.queued += 1
+        PARTITION_QUEUED.labels(self.name, partition.name).set(partition.queued)
+        if not partition.active:
+            partition.active = True
+            self.active.append(partition)
+            if len(self.active) == 1:
+                partition.deficit += self.quantum * partition.config.weight
+        # there may be free slots while the other partitions are at their share
+        self.wake()
+
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except BulkheadFull:
+            REJECTIONS.labels(self.name, "deadline").inc()
+            PARTITION_REJECTIONS.labels(self.name, partition.name, "deadline").inc()
+            raise
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # the slot was granted right when the waiter gave up
+                self.release(0.0, False, partition_name, observe=False)
+            else:
+                self.forget(partition, waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self.reject(partition, "timeout")
+            raise
+        finally:
+            QUEUE_WAIT.labels(self.name).observe(time.monotonic() - now)
+
+        PARTITION_INFLIGHT.labels(self.name, partition.name).set(partition.inflight)
+
+    def forget(self, partition: PartitionState, waiter: Waiter):
+        """Takes a waiter which gave up out of its lane, so it no longer counts against the queue."""
+        try:
+            partition.lanes[waiter.lane].remove(waiter)
+        except ValueError:
+            # already popped
+            return
+        partition.queued -= 1
+        PARTITION_QUEUED.labels(self.name, partition.name).set(partition.queued)
+
+    def release(self, rtt: float, dropped: bool, partition_name: str = "default", observe: bool = True):
+        partition = self.partitions[partition_name]
+        partition.inflight -= 1
+        PARTITION_INFLIGHT.labels(self.name, partition.name).set(partition.inflight)
+
+        if not observe:
+            self.inflight -= 1
+            self.wake()
+            return
+
+        self.rtt = rtt if self.rtt is None else self.rtt + 0.1 * (rtt - self.rtt)
+        super().release(rtt, dropped)
+
+    def call(self, partition_name: str = "default", lane: str = "normal", timeout: Optional[float] = None):
+        """`async with bulkhead.call(tenant, "high"):`"""
+        return PartitionedCall(self, partition_name, lane, timeout)
+
+    def partitioned(self, key, lane=None, timeout=None):
+        """
+        Decorator of coroutine functions. `key`, and optionally `lane` and `timeout`, are functions of the keyword
+        arguments of the call which return its partition, priority lane and time left.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                async with self.call(key(kwargs), lane(kwargs) if lane else "normal",
+                                     timeout(kwargs) if timeout else None):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+class PartitionedCall:
+    def __init__(self, bulkhead: PartitionedBulkhead, partition_name: str, lane: str, timeout: Optional[float]):
+        self.bulkhead = bulkhead
+        self.partition_name = partition_name
+        self.lane = lane
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        await self.bulkhead.acquire(self.partition_name, self.lane, self.timeout)
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.bulkhead.release(time.monotonic() - self.start, exc_type is not None, self.partition_name)
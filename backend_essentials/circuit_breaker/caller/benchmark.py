@@ -0,0 +1,124 @@
+"""
+Latency and connections of the calls to the callee, against a local stub server.
+
+    python benchmark.py [requests] [concurrency] [slow ratio]
+
+The stub answers in 10ms, except `slow ratio` of the requests which take 200ms, and counts the TCP connections
+it accepted. The calls are made with a new client per call as before, with the shared pool, and with the shared
+pool and hedging. `sent` counts the requests the stub received, hedges included.
+"""
+import sys
+import time
+import random
+import asyncio
+import configparser
+
+import httpx
+
+from http_client import HttpClient
+
+FAST = 0.01
+SLOW = 0.2
+
+
+class StubServer:
+    def __init__(self, slow_ratio):
+        self.slow_ratio = slow_ratio
+        self.connections = 0
+        self.requests = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                self.requests += 1
+                await asyncio.sleep(SLOW if random.random() < self.slow_ratio else FAST)
+                body = b'{"code": 0, "scrap": {}}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0, backlog=1024)
+        return self.server.sockets[0].getsockname()[1]
+
+    def reset(self):
+        self.connections = 0
+        self.requests = 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def http_conf(hedge):
+    conf = configparser.ConfigParser()
+    conf.read_dict({"http": {"timeout": "2", "max_connections": "100", "max_keepalive_connections": "100",
+                             "hedge": str(hedge).lower(), "hedge_min_samples": "100", "hedge_budget": "0.1"}})
+    return conf["http"]
+
+
+async def run(name, stub, get, requests, concurrency):
+    stub.reset()
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            await get()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:<14} {requests / elapsed:>7.0f} req/s p50={percentile(latencies, 0.5) * 1000:>6.1f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:>6.1f}ms p99={percentile(latencies, 0.99) * 1000:>6.1f}ms "
+          f"connections={stub.connections:>5} sent={stub.requests}")
+
+
+async def bench(requests, concurrency, slow_ratio):
+    stub = StubServer(slow_ratio)
+    port = await stub.start()
+    url = f"http://127.0.0.1:{port}/api/v1/scrap?url=x"
+    print(f"requests={requests} concurrency={concurrency} {slow_ratio:.0%} of responses take {SLOW * 1000:.0f}ms")
+
+    async def per_call():
+        async with httpx.AsyncClient(timeout=2) as client:
+            r = await client.get(url)
+            return r.text
+
+    # a client per call is much slower, fewer calls are enough to see it
+    await run("client per call", stub, per_call, min(requests, 500), concurrency)
+
+    for name, hedge in (("pooled", False), ("pooled+hedge", True)):
+        client = HttpClient(http_conf(hedge))
+        await client.start()
+        await run(name, stub, lambda: client.get(url), requests, concurrency)
+        await client.close()
+
+    stub.server.close()
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    slow_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 0.04
+    asyncio.run(bench(requests, concurrency, slow_ratio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import functools
+import time
+from typing import Optional, Tuple
+
+import redis.asyncio
+
+from instrumentator import CB_CALLS, CB_STATE
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitBreakerError(Exception):
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Window:
+    """Calls, failures and slow calls of the last `window_seconds`, counted in buckets of `bucket_seconds`."""
+    def __init__(self, window_seconds: float, bucket_seconds: float):
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, int(window_seconds / bucket_seconds))
+        # [bucket number, calls, failures, slow calls]
+        self.buckets = [[-1, 0, 0, 0] for _ in range(self.size)]
+
+    def add(self, now: float, calls: int, failures: int, slow: int):
+        number = int(now / self.bucket_seconds)
+        bucket = self.buckets[number % self.size]
+        if bucket[0] != number:
+            bucket[:] = [number, 0, 0, 0]
+        bucket[1] += calls
+        bucket[2] += failures
+        bucket[3] += slow
+
+    def totals(self, now: float) -> Tuple[int, int, int]:
+        oldest = int(now / self.bucket_seconds) - self.size + 1
+        calls = failures = slow = 0
+        for number, c, f, s in self.buckets:
+            if number >= oldest:
+                calls += c
+                failures += f
+                slow += s
+        return calls, failures, slow
+
+    def reset(self):
+        for bucket in self.buckets:
+            bucket[:] = [-1, 0, 0, 0]
+
+
+class LocalState:
+    """The state of the breaker kept in this process only."""
+    def __init__(self, breaker: "CircuitBreaker"):
+        self.breaker = breaker
+        self.window = Window(breaker.window_seconds, breaker.bucket_seconds)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.half_opened_at = 0.0
+        self.permits = 0
+        self.probes = [0, 0, 0]
+
+    def set_state(self, state: str, now: float):
+        if state == self.state:
+            return
+
+        print(f"Circuit breaker {self.breaker.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = now
+        elif state == HALF_OPEN:
+            self.half_opened_at = now
+            self.permits = 0
+            self.probes = [0, 0, 0]
+        elif state == CLOSED:
+            self.window.reset()
+        CB_STATE.labels(self.breaker.name).set(STATE_VALUES[state])
+
+    async def acquire(self) -> bool:
+        """Raises CircuitBreakerError when the call is not allowed, returns whether it is a half-open probe."""
+        now = time.time()
+        breaker = self.breaker
+        if self.state == OPEN:
+            if now < self.opened_at + breaker.open_seconds:
+                raise CircuitBreakerError(f"{breaker.name} is open", self.opened_at + breaker.open_seconds - now)
+            self.set_state(HALF_OPEN, now)
+
+        if self.state == HALF_OPEN:
+            # probes of which the result never came back do not keep the breaker half-open forever
+            if now > self.half_opened_at + breaker.open_seconds:
+                self.half_opened_at = now
+                self.permits = 0
+                self.probes = [0, 0, 0]
+            if self.permits >= breaker.half_open_permits:
+                raise CircuitBreakerError(f"{breaker.name} is half-open, no probe permit left")
+            self.permits += 1
+            return True
+
+        return False
+
+    def record_probe(self, now: float, failed: bool, slow: bool):
+        if self.state != HALF_OPEN:
+            return
+        self.probes[0] += 1
+        self.probes[1] += failed
+        self.probes[2] += slow
+        if self.probes[0] >= self.breaker.half_open_permits:
+            self.set_state(OPEN if self.breaker.should_trip(*self.probes, minimum=0) else CLOSED, now)
+
+    def check(self, now: float):
+        if self.breaker.should_trip(*self.window.totals(now)):
+            self.set_state(OPEN, now)
+
+    async def record(self, failed: bool, slow: bool, probe: bool):
+        now = time.time()
+        if probe:
+            self.record_probe(now, failed, slow)
+        elif self.state == CLOSED:
+            self.window.add(now, 1, failed, slow)
+            self.check(now)
+
+
+# KEYS[1] state hash  KEYS[2] window hash
+# ARGV: calls, failures, slow, bucket ms, buckets, minimum calls, failure rate, slow rate
+FLUSH_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state ~= 'closed' then
+    return {state, redis.call('HGET', KEYS[1], 'opened_at') or '0', tostring(now)}
+end
+
+local bucket_ms = tonumber(ARGV[4])
+local size = tonumber(ARGV[5])
+local number = math.floor(now / bucket_ms)
+if tonumber(ARGV[1]) > 0 then
+    redis.call('HINCRBY', KEYS[2], number .. ':c', ARGV[1])
+    redis.call('HINCRBY', KEYS[2], number .. ':f', ARGV[2])
+    redis.call('HINCRBY', KEYS[2], number .. ':s', ARGV[3])
+    redis.call('PEXPIRE', KEYS[2], bucket_ms * size * 2)
+end
+
+local calls, failures, slow = 0, 0, 0
+local fields = redis.call('HGETALL', KEYS[2])
+for i = 1, #fields, 2 do
+    local sep = string.find(fields[i], ':')
+    local bucket = tonumber(string.sub(fields[i], 1, sep - 1))
+    local kind = string.sub(fields[i], sep + 1)
+    if bucket <= number - size then
+        redis.call('HDEL', KEYS[2], fields[i])
+    elseif kind == 'c' then
+        calls = calls + tonumber(fields[i + 1])
+    elseif kind == 'f' then
+        failures = failures + tonumber(fields[i + 1])
+    else
+        slow = slow + tonumber(fields[i + 1])
+    end
+end
+
+if calls >= tonumber(ARGV[6]) and calls > 0 and
+        (failures / calls >= tonumber(ARGV[7]) or slow / calls >= tonumber(ARGV[8])) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now)
+    redis.call('DEL', KEYS[2])
+    return {'open', tostring(now), tostring(now)}
+end
+return {'closed', '0', tostring(now)}
+"""
+
+# KEYS[1] state hash  ARGV: open ms, permits
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at') or '0')
+local open_ms = tonumber(ARGV[1])
+
+if state == 'closed' then
+    return {'closed', '0', tostring(now)}
+end
+if state == 'open' then
+    if now < opened_at + open_ms then
+        return {'open', tostring(opened_at), tostring(now)}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'half_opened_at', now, 'permits', 0,
+               'probe_calls', 0, 'probe_failures', 0, 'probe_slow', 0)
+elseif now > tonumber(redis.call('HGET', KEYS[1], 'half_opened_at') or '0') + open_ms then
+    -- probes of which the result never came back do not keep the breaker half-open forever
+    redis.call('HSET', KEYS[1], 'half_opened_at', now, 'permits', 0, 'probe_calls', 0, 'probe_failures', 0,
+               'probe_slow', 0)
+end
+
+if redis.call('HINCRBY', KEYS[1], 'permits', 1) > tonumber(ARGV[2]) then
+    return {'half_open', tostring(opened_at), tostring(now)}
+end
+return {'probe', tostring(opened_at), tostring(now)}
+"""
+
+# KEYS[1] state hash  KEYS[2] window hash  ARGV: failed, slow, permits, failure rate, slow rate
+PROBE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= 'half_open' then
+    return redis.call('HGET', KEYS[1], 'state') or 'closed'
+end
+
+local calls = redis.call('HINCRBY', KEYS[1], 'probe_calls', 1)
+local failures = redis.call('HINCRBY', KEYS[1], 'probe_failures', ARGV[1])
+local slow = redis.call('HINCRBY', KEYS[1], 'probe_slow', ARGV[2])
+if calls < tonumber(ARGV[3]) then
+    return 'half_open'
+end
+
+if failures / calls >= tonumber(ARGV[4]) or slow / calls >= tonumber(ARGV[5]) then
+    local t = redis.call('TIME')
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000))
+    return 'open'
+end
+redis.call('HSET', KEYS[1], 'state', 'closed')
+redis.call('DEL', KEYS[2])
+return 'closed'
+"""
+
+
+class RedisState(LocalState):
+    """
+    The state of the breaker shared by every process through Redis, so that all workers trip together.
+
+    Calls are counted locally and added to the shared window every `sync_interval` seconds, which also refreshes
+    the cached shared state, so a closed breaker costs one round trip per interval and not per call. When the
+    local window would trip, it is synced at once, at most once per bucket. Transitions
+    and half-open permits are decided by scripts in Redis. When Redis fails the local window decides alone.
+    """
+    def __init__(self, breaker: "CircuitBreaker", url: str, sync_interval: float):
+        super().__init__(breaker)
+        self.redis = redis.asyncio.from_url(url)
+        self.sync_interval = sync_interval
+        self.state_key = f"cb:{breaker.name}"
+        self.window_key = f"cb:{breaker.name}:window"
+
+        self.pending = [0, 0, 0]
+        self.next_sync = 0.0
+        self.next_early_sync = 0.0
+
+    def apply(self, shared):
+        state, opened_at, now = [v.decode() if isinstance(v, bytes) else v for v in shared]
+        self.set_state(state, time.time())
+        if state == OPEN:
+            # the moment it opened, on the clock of this process
+            self.opened_at = time.time() - (int(now) - int(opened_at)) / 1000
+
+    async def sync(self):
+        breaker = self.breaker
+        # taken out while the script runs so a concurrent sync does not send them twice, and put back if it fails
+        sent, self.pending = self.pending, [0, 0, 0]
+        self.next_sync = time.time() + self.sync_interval
+        try:
+            shared = await self.redis.eval(FLUSH_SCRIPT, 2, self.state_key, self.window_key, *sent,
+                                           int(breaker.bucket_seconds * 1000), self.window.size,
+                                           breaker.minimum_calls, breaker.failure_rate_threshold,
+                                           breaker.slow_call_rate_threshold)
+        except Exception:
+            self.pending = [p + n for p, n in zip(self.pending, sent)]
+            raise
+        self.apply(shared)
+
+    async def acquire(self) -> bool:
+        try:
+            if time.time() >= self.next_sync:
+                await self.sync()
+
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN and time.time() < self.opened_at + self.breaker.open_seconds:
+                raise CircuitBreakerError(f"{self.breaker.name} is open",
+                                          self.opened_at + self.breaker.open_seconds - time.time())
+
+            shared = await self.redis.eval(ACQUIRE_SCRIPT, 1, self.state_key, int(self.breaker.open_seconds * 1000),
+                                           self.breaker.half_open_permits)
+        except CircuitBreakerError:
+            raise
+        except Exception as e:
+            print(f"Circuit breaker {self.breaker.name}: redis failed, using the local state: {e}")
+            return await super().acquire()
+
+        state = shared[0].decode() if isinstance(shared[0], bytes) else shared[0]
+        if state == "probe":
+            self.apply([HALF_OPEN, shared[1], shared[2]])
+            return True
+
+        self.apply(shared)
+        if state == CLOSED:
+            return False
+        raise CircuitBreakerError(f"{self.breaker.name} is {state}")
+
+    async def record(self, failed: bool, slow: bool, probe: bool):
+        now = time.time()
+        if not probe and self.state == CLOSED:
+            # counted locally as well, to decide alone when redis is unavailable
+            self.window.add(now, 1, failed, slow)
+
+        try:
+            if probe:
+                state = await self.redis.eval(PROBE_SCRIPT, 2, self.state_key, self.window_key, int(failed),
+                                              int(slow), self.breaker.half_open_permits,
+                                              self.breaker.failure_rate_threshold,
+                                              self.breaker.slow_call_rate_threshold)
+                self.set_state(state.decode() if isinstance(state, bytes) else state, now)
+                return
+
+            self.pending[0] += 1
+            self.pending[1] += failed
+            self.pending[2] += slow
+            if now >= self.next_sync:
+                await self.sync()
+            elif now >= self.next_early_sync and self.breaker.should_trip(*self.window.totals(now)):
+                # what this process saw may be enough to trip, it is not kept until the next interval then, but
+                # synced at most once per bucket while the shared window does not trip
+                self.next_early_sync = now + self.breaker.bucket_seconds
+                await self.sync()
+        except Exception as e:
+            print(f"Circuit breaker {self.breaker.name}: redis failed, using the local state: {e}")
+            if probe:
+                self.record_probe(now, failed, slow)
+            elif self.state == CLOSED:
+                self.check(now)
+
+    async def close(self):
+        await self.redis.close()
+
+
+class CircuitBreaker:
+    """
+    Opens when, over the last `window_seconds` and after at least `minimum_calls` calls, the rate of failed calls
+    or the rate of calls slower than `slow_call_seconds` reaches its threshold. It stays open `open_seconds`, then
+    lets `half_open_permits` probe calls through, and closes if they are below the thresholds or opens again.
+
+    Used as a decorator of coroutine functions, like aiobreaker. With `redis_url` set, the state is shared by
+    every process through Redis.
+    """
+    def __init__(self, name: str, conf):
+        self.name = name
+        self.window_seconds = conf.getfloat("window_seconds", fallback=10)
+        self.bucket_seconds = conf.getfloat("bucket_seconds", fallback=1)
+        self.minimum_calls = conf.getint("minimum_calls", fallback=20)
+        self.failure_rate_threshold = conf.getfloat("failure_rate_threshold", fallback=0.5)
+        self.slow_call_rate_threshold = conf.getfloat("slow_call_rate_threshold", fallback=0.5)
+        self.slow_call_seconds = conf.getfloat("slow_call_seconds", fallback=1)
+        self.open_seconds = conf.getfloat("open_seconds", fallback=5)
+        self.half_open_permits = conf.getint("half_open_permits", fallback=5)
+
+        redis_url = conf.get("redis_url", fallback="")
+        if redis_url:
+            self.store = RedisState(self, redis_url, conf.getfloat("sync_interval_ms", fallback=200) / 1000)
+        else:
+            self.store = LocalState(self)
+        CB_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        return self.store.state
+
+    def should_trip(self, calls: int, failures: int, slow: int, minimum: Optional[int] = None) -> bool:
+        minimum = self.minimum_calls if minimum is None else minimum
+        if calls == 0 or calls < minimum:
+            return False
+        return failures / calls >= self.failure_rate_threshold or slow / calls >= self.slow_call_rate_threshold
+
+    async def call(self, func, *args, **kwargs):
+        try:
+            probe = await self.store.acquire()
+        except CircuitBreakerError:
+            CB_CALLS.labels(self.name, "rejected").inc()
+            raise
+
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            await self.record(start, True, probe)
+            raise
+        # a cancelled call has no outcome, the permit of a cancelled probe expires with the half-open state
+
+        await self.record(start, False, probe)
+        return result
+
+    async def record(self, start: float, failed: bool, probe: bool):
+        slow = time.monotonic() - start >= self.slow_call_seconds
+        CB_CALLS.labels(self.name, "failure" if failed else "slow" if slow else "success").inc()
+        await self.store.record(failed, slow, probe)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, **kwargs)
+
+        return wrapper
+
+    async def close(self):
+        if isinstance(self.store, RedisState):
+            await self.store.close()
@@ -0,0 +1,130 @@
+import asyncio
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from instrumentator import HEDGED_REQUESTS, HEDGE_WINS, HEDGE_BUDGET_EXHAUSTED
+
+
+class LatencyTracker:
+    """Latencies of the latest calls, to tell when a call is slower than usual."""
+    def __init__(self, percentile: float = 0.95, min_samples: int = 100, window: int = 1000):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.cached = None
+        self.stale = 0
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+        self.stale += 1
+
+    def threshold(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+
+        # sorting the window on every call is wasteful, the percentile moves slowly
+        if self.cached is None or self.stale >= 50:
+            values = sorted(self.samples)
+            self.cached = values[min(len(values) - 1, int(len(values) * self.percentile))]
+            self.stale = 0
+        return self.cached
+
+
+class HedgeBudget:
+    """Every call earns `ratio` of a hedge, so at most that fraction of the calls are hedged, with small bursts."""
+    def __init__(self, ratio: float = 0.1, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class HttpClient:
+    """
+    One httpx client, so one connection pool with keep-alive, shared by every call of the process.
+
+    With hedging on, a call which takes longer than the percentile of the latest calls is sent once more and
+    the first answer wins. Whatever the attempts, a call has one outcome: it fails only when every attempt failed,
+    so the circuit breaker wrapping it counts one failure per call.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.client = None
+
+        self.hedge = conf.getboolean("hedge", fallback=False)
+        self.tracker = LatencyTracker(conf.getfloat("hedge_percentile", fallback=0.95),
+                                      conf.getint("hedge_min_samples", fallback=100))
+        self.budget = HedgeBudget(conf.getfloat("hedge_budget", fallback=0.1))
+
+    async def start(self):
+        limits = httpx.Limits(
+            max_connections=self.conf.getint("max_connections", fallback=100),
+            max_keepalive_connections=self.conf.getint("max_keepalive_connections", fallback=20),
+            keepalive_expiry=self.conf.getfloat("keepalive_expiry", fallback=30),
+        )
+        self.client = httpx.AsyncClient(timeout=self.conf.getfloat("timeout", fallback=2), limits=limits)
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url: str, hedge: bool = True) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.budget.deposit()
+
+        tasks = [asyncio.ensure_future(self.client.get(url))]
+        try:
+            delay = self.tracker.threshold() if self.hedge and hedge else None
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    if self.budget.withdraw():
+                        HEDGED_REQUESTS.inc()
+                        tasks.append(asyncio.ensure_future(self.client.get(url)))
+                    else:
+                        HEDGE_BUDGET_EXHAUSTED.inc()
+
+            response = await self.first_success(tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        # the slower request is left to finish, cancelling it would close its keep-alive connection
+        for task in tasks:
+            if not task.done():
+                task.add_done_callback(self.discard)
+
+        self.tracker.observe(loop.time() - start)
+        return response
+
+    @staticmethod
+    def discard(task):
+        if not task.cancelled():
+            task.exception()
+
+    async def first_success(self, tasks) -> httpx.Response:
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        HEDGE_WINS.inc()
+                    return task.result()
+                error = task.exception()
+
+        raise error
@@ -1,4 +1,22 @@
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_client import Counter, Gauge
+
+
+HEDGED_REQUESTS = Counter(
+    "cb_hedged_requests_total", "Duplicate requests sent because the first one was slower than the hedge delay"
+)
+HEDGE_WINS = Counter(
+    "cb_hedge_wins_total", "Hedged requests which answered before the first one"
+)
+HEDGE_BUDGET_EXHAUSTED = Counter(
+    "cb_hedge_budget_exhausted_total", "Hedges not sent because the hedge budget was spent"
+)
+CB_STATE = Gauge(
+    "cb_state", "State of the circuit breaker, 0 closed, 1 open, 2 half-open", ["breaker"]
+)
+CB_CALLS = Counter(
+    "cb_calls_total", "Calls through the circuit breaker by outcome", ["breaker", "outcome"]
+)
 
 
 def init_instrumentator(app):
@@ -3,12 +3,10 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from exceptions import UnicornException
-from datetime import timedelta
 
 import urllib.parse
 import json
 import redis
-import httpx
 
 from settings import Settings
 from log import init_log
@@ -16,7 +14,8 @@ from cors import init_cors
 from instrumentator import init_instrumentator
 from config import Config
 
-import aiobreaker 
+from breaker import CircuitBreaker, CircuitBreakerError, CLOSED
+from http_client import HttpClient
 
 
 app = FastAPI()
@@ -28,7 +27,19 @@ init_cors(app)
 init_instrumentator(app)
 
 
-cb = aiobreaker.CircuitBreaker(fail_max=3, timeout_duration=timedelta(seconds=20))
+cb = CircuitBreaker("scrap", conf.section("breaker"))
+g_http = HttpClient(conf.section("http"))
+
+
+@app.on_event("startup")
+async def startup():
+    await g_http.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await g_http.close()
+    await cb.close()
 
 
 @app.exception_handler(UnicornException)
@@ -44,9 +55,9 @@ async def call_api(url: str):
     endpoint = conf.section("scrap")["endpoint"]
     encoded_url = urllib.parse.quote(url)
     url = f"http://{endpoint}/api/v1/scrap?url={encoded_url}"
-    async with httpx.AsyncClient(timeout=2) as client:
-        r = await client.get(url)
-        return endpoint, r.text
+    # the trial call of a half-open breaker stays a single request
+    r = await g_http.get(url, hedge=cb.state == CLOSED)
+    return endpoint, r.text
     
 
 @app.get("/api/v1/scrap/")
@@ -56,5 +67,5 @@ async def get_post(url: str):
         endpoint, scrap_raw = await call_api(decoded_url)
         scrap = json.loads(scrap_raw)
         return {"code": 0, "message": "Ok", "endpoint": endpoint, "scarp": scrap}
-    except aiobreaker.state.CircuitBreakerError as e:
+    except CircuitBreakerError as e:
         raise UnicornException(status=500, code=-20005, message="CircuitBreakerError")
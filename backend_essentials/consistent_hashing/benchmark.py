@@ -0,0 +1,104 @@
+"""
+Compares the hash ring strategies of hash_strategy.py without any Redis.
+
+    python benchmark.py [--nodes 8] [--keys 100000] [--replicas 1,40,160]
+
+For every strategy and replica count it reports
+- ns/lookup for get() (and get_many() where it is vectorized)
+- max/mean load ratio of the synthetic keys over the nodes
+- fraction of keys remapped when a node is added and when one is removed
+"""
+import argparse
+import time
+
+from hash_strategy import STRATEGIES, create_ring
+
+
+def make_kvlist(count, offset=0):
+    return [(f"10.0.0.{i}:6379", f"redis{i}", f"redis{i}") for i in range(offset, offset + count)]
+
+
+def lookup_ns(ring, keys):
+    get = ring.get
+    start = time.perf_counter_ns()
+    for key in keys:
+        get(key)
+    return (time.perf_counter_ns() - start) / len(keys)
+
+
+def bulk_lookup_ns(ring, keys):
+    start = time.perf_counter_ns()
+    ring.get_many(keys)
+    return (time.perf_counter_ns() - start) / len(keys)
+
+
+def count_loads(ring, keys):
+    loads = {kv[0]: 0 for kv in ring.kvlist}
+    for idx, value in ring.get_many(keys):
+        loads[ring.continuum[idx][0]] += 1
+
+    return loads
+
+
+def load_ratio(ring, keys):
+    loads = count_loads(ring, keys)
+    mean = len(keys) / len(loads)
+    return max(loads.values()) / mean
+
+
+def remapped(before, after, keys):
+    old = before.get_many(keys)
+    new = after.get_many(keys)
+    return sum(1 for o, n in zip(old, new) if o[1] != n[1]) / len(keys)
+
+
+def run(strategy, replica, nodes, keys, load_factor):
+    kvlist = make_kvlist(nodes)
+    ring = create_ring(strategy, kvlist, replica, load_factor=load_factor)
+    if strategy == "bounded_load":
+        # the snapshot is the load the keys put on plain ketama
+        ring.set_loads(count_loads(ring, keys))
+
+    result = {}
+    result["ns/lookup"] = lookup_ns(ring, keys)
+    result["ns/lookup(bulk)"] = bulk_lookup_ns(ring, keys)
+    result["max/mean"] = load_ratio(ring, keys)
+
+    added = ring.with_changes(make_kvlist(1, offset=nodes), [])
+    result["remap(add)"] = remapped(ring, added, keys)
+
+    # remove a node from the middle, jump hash only handles removing the last one gracefully
+    removed = ring.with_changes([], [kvlist[nodes // 2][0]])
+    result["remap(remove)"] = remapped(ring, removed, keys)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--replicas", default="1,40,160")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES))
+    parser.add_argument("--load-factor", type=float, default=1.25)
+    args = parser.parse_args()
+
+    keys = [f"url:https://example.com/{i}" for i in range(args.keys)]
+    columns = ["ns/lookup", "ns/lookup(bulk)", "max/mean", "remap(add)", "remap(remove)"]
+
+    print(f"nodes={args.nodes} keys={args.keys} ideal remap(add)={1 / (args.nodes + 1):.4f} "
+          f"ideal remap(remove)={1 / args.nodes:.4f}")
+    print(f"{'strategy':<14}{'replica':>8}" + "".join(f"{c:>17}" for c in columns))
+
+    for strategy in args.strategies.split(","):
+        # jump and rendezvous have no virtual nodes
+        replicas = [int(r) for r in args.replicas.split(",")]
+        if strategy in ("jump", "rendezvous"):
+            replicas = [1]
+
+        for replica in replicas:
+            result = run(strategy, replica, args.nodes, keys, args.load_factor)
+            print(f"{strategy:<14}{replica:>8}" + "".join(f"{result[c]:>17.4f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
 import sys
+import copy
+import heapq
 import hashlib
 import struct
 
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 VALUE_IDX = 2
 HASH_IDX = 3
@@ -9,7 +19,31 @@ LAST = -1
 FIRST = 0
 
 
-class ConsistentHash:
+class HashRing:
+    """
+    Interface of the ring strategies. get() returns (index, value) where index points into self.continuum.
+    """
+    def get(self, key):
+        raise NotImplementedError
+
+    def with_changes(self, added, removed):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def group_by_value(self, keys):
+        """
+        Route many keys and group them by the value which owns them. Returns {value: [keys]}.
+        """
+        groups = {}
+        for key, (idx, value) in zip(keys, self.get_many(keys)):
+            groups.setdefault(value, []).append(key)
+
+        return groups
+
+
+class ConsistentHash(HashRing):
     def __init__(self, kvlist, replica, hash_func = None):
         self.hash_func = hash_func
         if not self.hash_func:
@@ -19,12 +53,13 @@ class ConsistentHash:
         self.replica = replica
 
         self.continuum = self.rebuild(kvlist)
+        self.points, self.owners = self.build_index(self.continuum)
 
     def ketama_hash(self, key):
         key = key.encode('utf-8')
         return struct.unpack('<I', hashlib.md5(key).digest()[0:4])[0]
 
-      
+
     def rebuild(self, kvlist):
         continuum = [(k, i, v, self._hash("%s:%s"%(nick,i)), "%s:%s"%(nick, i)) \
                      for k, nick, v in kvlist \
@@ -33,35 +68,70 @@ class ConsistentHash:
         continuum.sort(key=lambda x: x[HASH_IDX])
         return continuum
 
+    def build_index(self, continuum):
+        # packed uint32 points and the value owning each point, in ring order
+        points = array('I', [c[HASH_IDX] for c in continuum])
+        owners = [c[VALUE_IDX] for c in continuum]
+        return points, owners
+
+    def with_changes(self, added, removed):
+        """
+        Returns a new ring with the nodes of `added` (kvlist) inserted and the nodes whose key is in `removed` dropped.
+        Virtual points of surviving nodes are reused instead of being re-hashed, and self is left untouched
+        so readers holding the old ring never see a half-built continuum.
+        """
+        removed = set(removed)
+        kvlist = [kv for kv in self.kvlist if kv[0] not in removed] + list(added)
+        kept = [c for c in self.continuum if c[0] not in removed]
+        continuum = list(heapq.merge(kept, self.rebuild(added), key=lambda x: x[HASH_IDX]))
+
+        ch = copy.copy(self)
+        ch.kvlist = kvlist
+        ch.continuum = continuum
+        ch.points, ch.owners = ch.build_index(continuum)
+        return ch
+
     def _hash(self, key):
-        return self.hash_func(key)
+        # the points are packed as uint32, a wider custom hash is cut to its low 32 bits
+        return self.hash_func(key) & 0xFFFFFFFF
 
-    def find_near_value(self, continnum, h):
-        size = len(continnum)
-        begin = left = 0
-        end = right = size
+    def find_index(self, h):
+        idx = bisect_left(self.points, h)
+        if idx == len(self.points):
+            idx = FIRST
 
-        while left < right:
-            middle = left + int((right - left) / 2)
-            if continnum[middle][HASH_IDX] < h:
-                left = middle + 1
-            else:
-                right = middle
+        return idx
 
-        if right == end:
-            right = begin
+    def find_indexes(self, hashes):
+        size = len(self.points)
+        if np is not None:
+            points = np.frombuffer(self.points, dtype=np.uint32)
+            idxs = np.searchsorted(points, np.array(hashes, dtype=np.uint32), side='left')
+            idxs[idxs == size] = FIRST
+            return idxs.tolist()
 
-        return right, continnum[right][VALUE_IDX]
-        
+        points = self.points
+        return [idx if idx != size else FIRST for idx in (bisect_left(points, h) for h in hashes)]
 
     def get(self, key):
-        h = self._hash(key)
-        if h < self.continuum[FIRST][HASH_IDX] or h > self.continuum[LAST][HASH_IDX]:
-            return 0, self.continuum[FIRST][VALUE_IDX]
+        if not self.points:
+            raise Exception("There is no node")
+
+        idx = self.find_index(self._hash(key))
+        return idx, self.owners[idx]
+
+    def get_many(self, keys):
+        """
+        Route many keys in one call. Returns a list of (index, value) in the order of keys.
+        """
+        if not self.points:
+            raise Exception("There is no node")
+
+        owners = self.owners
+        hashes = [self._hash(key) for key in keys]
+        return [(idx, owners[idx]) for idx in self.find_indexes(hashes)]
+
 
-        return self.find_near_value(self.continuum, h)
-      
-      
 if __name__ == "__main__":
     replica = 2
     kvlist = [
@@ -0,0 +1,161 @@
+import math
+import time
+import asyncio
+
+
+Z_95 = 1.96
+
+
+def wilson_interval(hits, n, z=Z_95):
+    if n == 0:
+        return 0.0, 1.0
+
+    p = hits / n
+    denom = 1 + z*z/n
+    center = (p + z*z/(2*n)) / denom
+    margin = z * math.sqrt(p*(1-p)/n + z*z/(4*n*n)) / denom
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def mean_interval(values, z=Z_95):
+    n = len(values)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+
+    mean = sum(values) / n
+    if n == 1:
+        return mean, mean, mean
+
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    margin = z * std / math.sqrt(n)
+    return mean, max(0.0, mean - margin), mean + margin
+
+
+class DistributionReporter:
+    """
+    Estimates how keys and memory are spread over the ring nodes from a small sample per node,
+    instead of scanning the whole keyspace.
+
+    For every node the exact key count comes from DBSIZE, and a sample of keys (RANDOMKEY, or one bounded SCAN page)
+    gives the share of keys the ring really routes to that node and the mean MEMORY USAGE per key,
+    both with 95% confidence bounds. The last full report is cached for `ttl` seconds.
+    """
+    def __init__(self, sample_size=200, ttl=60, method="randomkey"):
+        self.sample_size = sample_size
+        self.ttl = ttl
+        self.method = method
+        self.lock = asyncio.Lock()
+        self.updated = asyncio.Condition()
+        self.refreshing = None
+        self.partial = []
+        self.report = None
+        self.report_at = 0
+
+    def cached(self):
+        if self.report is not None and time.monotonic() - self.report_at < self.ttl:
+            return self.report
+
+        return None
+
+    async def sample_keys(self, conn):
+        if self.method == "scan":
+            cursor, keys = await conn.scan(cursor=0, count=self.sample_size)
+            return keys[:self.sample_size]
+
+        async with conn.pipeline(transaction=False) as pipe:
+            for _ in range(self.sample_size):
+                pipe.randomkey()
+            keys = await pipe.execute()
+
+        return [k for k in keys if k is not None]
+
+    async def node_report(self, ch, addr, nick, node):
+        conn = node.get_async_conn()
+        try:
+            dbsize = await conn.dbsize()
+            used_memory = (await conn.info("memory")).get("used_memory", 0)
+            keys = await self.sample_keys(conn)
+
+            async with conn.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.memory_usage(key, samples=0)
+                sizes = await pipe.execute()
+        except Exception as e:
+            return {"nick": nick, "addr": addr, "error": str(e)}
+
+        names = [k.decode('utf-8') for k in keys]
+        owned = sum(1 for idx, value in ch.get_many(names) if value is node)
+        owned_lo, owned_hi = wilson_interval(owned, len(names))
+        mean, mean_lo, mean_hi = mean_interval([s for s in sizes if s is not None])
+
+        return {
+            "nick": nick,
+            "addr": addr,
+            "keys": dbsize,
+            "sampled": len(names),
+            "owned_ratio": owned / len(names) if names else None,
+            "owned_keys": [int(dbsize * owned_lo), int(dbsize * owned_hi)],
+            "key_bytes_mean": mean,
+            "key_memory": [int(dbsize * mean_lo), int(dbsize * mean_hi)],
+            "used_memory": used_memory,
+            "sample": sorted(names)[:20],
+        }
+
+    async def refresh(self, ch, partial):
+        tasks = []
+        # anything failing here still ends the report, or the readers would wait for it forever
+        try:
+            nodes = {v: (k, nick) for k, nick, v in ch.kvlist}
+            tasks = [asyncio.ensure_future(self.node_report(ch, k, nick, v)) for v, (k, nick) in nodes.items()]
+            for fut in asyncio.as_completed(tasks):
+                r = await fut
+                async with self.updated:
+                    partial.append(r)
+                    self.updated.notify_all()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            report = list(partial)
+            async with self.updated:
+                # the end of the report for the readers
+                partial.append(None)
+                self.updated.notify_all()
+            self.refreshing = None
+
+        self.report = report
+        self.report_at = time.monotonic()
+
+    async def stream(self, ch):
+        """
+        Yields one node report at a time, as soon as each node answers.
+
+        Concurrent requests read the same collection. The lock is only held to start it, never across a yield,
+        so a slow client does not hold back the others.
+        """
+        async with self.lock:
+            report = self.cached()
+            if report is None and self.refreshing is None:
+                self.partial = []
+                self.refreshing = asyncio.ensure_future(self.refresh(ch, self.partial))
+            partial = self.partial
+
+        if report is not None:
+            for r in report:
+                yield r
+            return
+
+        i = 0
+        while True:
+            async with self.updated:
+                await self.updated.wait_for(lambda: i < len(partial))
+                new = partial[i:]
+            i += len(new)
+
+            for r in new:
+                if r is None:
+                    return
+                yield r
+
+    async def collect(self, ch):
+        return [r async for r in self.stream(ch)]
@@ -0,0 +1,174 @@
+import math
+import hashlib
+import struct
+
+from consistent_hash import HashRing, ConsistentHash
+
+
+MASK64 = (1 << 64) - 1
+
+
+def hash64(key):
+    key = key.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(key).digest()[0:8])[0]
+
+
+def mix64(h):
+    # splitmix64 finalizer
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & MASK64
+    return h ^ (h >> 31)
+
+
+def jump_hash(key, num_buckets):
+    """
+    Jump consistent hash (Lamping & Veach). Maps a 64bit key to a bucket in [0, num_buckets).
+    """
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & MASK64
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+
+    return b
+
+
+class BoundedLoadHash(ConsistentHash):
+    """
+    Consistent hashing with bounded loads (Mirrokni et al.) over a snapshot of the node loads.
+
+    A key goes to the first node clockwise from its ketama point whose load in the snapshot is below
+    ceil(load_factor * total load / nodes). The node only depends on the key, the nodes and the snapshot, so
+    processes given the same snapshot agree on it and a lookup changes nothing. Without a snapshot it is ketama.
+    """
+    def __init__(self, kvlist, replica, hash_func = None, load_factor = 1.25, loads = None):
+        super().__init__(kvlist, replica, hash_func)
+        self.load_factor = load_factor
+        self.set_loads(loads or {})
+
+    def set_loads(self, loads):
+        """
+        loads is {node key: load}. The load of a node is spread over its points in proportion to their arcs, and the
+        points of a node above capacity are redirected, in ring order, to the next point of a node with room for
+        them until the node is back to capacity.
+        """
+        self.loads = dict(loads)
+        size = len(self.continuum)
+        self.targets = list(range(size))
+
+        keys = [k for k, nick, v in self.kvlist]
+        load = {k: self.loads.get(k, 0) for k in keys}
+        total = sum(load.values())
+        if not size or not total:
+            return
+
+        cap = math.ceil(self.load_factor * total / len(keys))
+        nodes = [c[0] for c in self.continuum]
+        arcs = [(self.points[idx] - self.points[idx - 1]) % (1 << 32) or (1 << 32) for idx in range(size)]
+        node_arcs = {}
+        for node, arc in zip(nodes, arcs):
+            node_arcs[node] = node_arcs.get(node, 0) + arc
+
+        for idx in range(size):
+            node = nodes[idx]
+            if load[node] <= cap:
+                continue
+
+            share = load[node] * arcs[idx] / node_arcs[node]
+            for step in range(1, size):
+                target = (idx + step) % size
+                if nodes[target] != node and load[nodes[target]] + share <= cap:
+                    self.targets[idx] = target
+                    load[node] -= share
+                    load[nodes[target]] += share
+                    break
+
+    def get(self, key):
+        if not self.points:
+            raise Exception("There is no node")
+
+        idx = self.targets[self.find_index(self._hash(key))]
+        return idx, self.owners[idx]
+
+    def get_many(self, keys):
+        owners = self.owners
+        targets = self.targets
+        return [(targets[idx], owners[targets[idx]]) for idx, value in super().get_many(keys)]
+
+    def with_changes(self, added, removed):
+        ch = super().with_changes(added, removed)
+        ch.set_loads(self.loads)
+        return ch
+
+
+class JumpHash(HashRing):
+    """
+    Jump consistent hash over the nodes in kvlist order. No virtual nodes and no memory per node,
+    but only adding or removing the last node moves the minimum number of keys.
+    """
+    def __init__(self, kvlist, replica = None, hash_func = None):
+        self.hash_func = hash_func if hash_func else hash64
+        self.replica = replica
+        self.kvlist = list(kvlist)
+        self.continuum = [(k, 0, v, self.hash_func(nick), nick) for k, nick, v in self.kvlist]
+
+    def get(self, key):
+        if not self.continuum:
+            raise Exception("There is no node")
+
+        idx = jump_hash(self.hash_func(key), len(self.continuum))
+        return idx, self.continuum[idx][2]
+
+    def with_changes(self, added, removed):
+        removed = set(removed)
+        kvlist = [kv for kv in self.kvlist if kv[0] not in removed] + list(added)
+        return JumpHash(kvlist, self.replica, self.hash_func)
+
+
+class RendezvousHash(HashRing):
+    """
+    Highest random weight hashing. Every node scores the key and the highest score wins,
+    so a membership change only moves the keys of the node that changed. Lookup is O(nodes).
+    """
+    def __init__(self, kvlist, replica = None, hash_func = None):
+        self.hash_func = hash_func if hash_func else hash64
+        self.replica = replica
+        self.kvlist = list(kvlist)
+        self.continuum = [(k, 0, v, self.hash_func(nick), nick) for k, nick, v in self.kvlist]
+        self.seeds = [c[3] for c in self.continuum]
+
+    def get(self, key):
+        if not self.seeds:
+            raise Exception("There is no node")
+
+        h = self.hash_func(key)
+        best, best_score = 0, -1
+        for idx, seed in enumerate(self.seeds):
+            score = mix64(h ^ seed)
+            if score > best_score:
+                best, best_score = idx, score
+
+        return best, self.continuum[best][2]
+
+    def with_changes(self, added, removed):
+        removed = set(removed)
+        kvlist = [kv for kv in self.kvlist if kv[0] not in removed] + list(added)
+        return RendezvousHash(kvlist, self.replica, self.hash_func)
+
+
+STRATEGIES = {
+    "ketama": ConsistentHash,
+    "bounded_load": BoundedLoadHash,
+    "jump": JumpHash,
+    "rendezvous": RendezvousHash,
+}
+
+
+def create_ring(strategy, kvlist, replica, load_factor = 1.25, loads = None):
+    if strategy not in STRATEGIES:
+        raise Exception("Unknown hash strategy: " + strategy)
+
+    if strategy == "bounded_load":
+        return BoundedLoadHash(kvlist, replica, load_factor=load_factor, loads=loads)
+
+    return STRATEGIES[strategy](kvlist, replica)
@@ -1,4 +1,19 @@
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_client import Counter, Gauge
+
+
+MIGRATION_RUNNING = Gauge(
+    "ch_migration_running", "Whether a key migration job is running"
+)
+MIGRATION_PROGRESS = Gauge(
+    "ch_migration_progress_ratio", "Scanned keys over the keyspace size of the source node", ["node"]
+)
+MIGRATION_SCANNED_KEYS = Counter(
+    "ch_migration_scanned_keys_total", "Keys scanned by the migration job", ["node"]
+)
+MIGRATION_MOVED_KEYS = Counter(
+    "ch_migration_moved_keys_total", "Keys moved to their new owner", ["source", "target"]
+)
 
 
 def init_instrumentator(app):
@@ -1,10 +1,11 @@
-from typing import Optional
-from fastapi import FastAPI, Request, Response
+from typing import Optional, List
+from fastapi import FastAPI, Request, Response, Query
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from bs4 import BeautifulSoup
 from datetime import datetime
 from fastapi.responses import HTMLResponse
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 
 import logging
@@ -14,11 +15,20 @@ import httpx
 import sys
 import json
 import traceback
+import threading
+import asyncio
+import copy
+import functools
+import time
+
+from kazoo.exceptions import BadVersionError
 
 from exceptions import UnicornException
 from settings import Settings
 
-from consistent_hash import ConsistentHash 
+from hash_strategy import create_ring, BoundedLoadHash, STRATEGIES
+from migration import KeyMigrator
+from distribution import DistributionReporter
 from log import init_log
 from cors import init_cors
 from instrumentator import init_instrumentator
@@ -28,42 +38,207 @@ from config import Config
 from redis_conn import RedisConnection
 
 
+g_ch = None
+g_connections = {}
+g_refresh_lock = threading.Lock()
+g_migrator = None
+g_loop = None
+g_loads = {}
+g_retired = []
+g_migration_lock = None
+
+
+def parse_node(node):
+    parts = node.split(':')
+    addr = f"{parts[1]}:{parts[2]}"
+    nick = parts[0]
+    return addr, nick
+
+
 def refresh_shard_range(nodes):
-    connections = {}
     if not nodes or len(nodes) == 0:
         print("There is no redis nodes")
         return
 
-    ch_list = [] 
-    for node in nodes:
-        print("Node: ", node)
-        parts = node.split(':')
-        addr = f"{parts[1]}:{parts[2]}"
-        nick = parts[0]
-        conn = RedisConnection(addr)
-        ch_list.append((addr, nick, conn))
+    global g_ch
+    with g_refresh_lock:
+        members = {}
+        for node in nodes:
+            print("Node: ", node)
+            addr, nick = parse_node(node)
+            members[addr] = nick
+
+        current = g_ch
+        previous = {k: nick for k, nick, v in current.kvlist} if current else {}
+
+        # only the nodes that changed are (re)hashed, surviving nodes keep their warm pools
+        added = []
+        for addr, nick in members.items():
+            if previous.get(addr) == nick:
+                continue
+
+            conn = g_connections.get(addr)
+            if not conn:
+                conn = RedisConnection(addr)
+                g_connections[addr] = conn
+            added.append((addr, nick, conn))
+
+        removed = [addr for addr, nick in previous.items() if members.get(addr) != nick]
+
+        if not added and not removed:
+            print("No membership changes")
+            return
+
+        if current:
+            ch = current.with_changes(added, removed)
+        else:
+            ring = conf.section("ring")
+            ch = create_ring(ring["strategy"], added, int(ring["replica"]),
+                             ring.getfloat("load_factor", fallback=1.25), g_loads)
+
+        g_ch = ch
+
+        retired = []
+        for addr in removed:
+            if addr not in members:
+                conn = g_connections.pop(addr, None)
+                if conn:
+                    retired.append(conn)
+
+        if current:
+            start_migration(current, ch, retired)
+        else:
+            for conn in retired:
+                conn.close()
 
-    replica = 1
-    ch = ConsistentHash(ch_list, replica)
+    print(f"Finished refresh_shard_range: added={len(added)} removed={len(removed)}")
+
+
+def refresh_loads(data, stat):
+    """The load snapshot in ZooKeeper changed, every server routes the bounded_load ring over the same one."""
+    if not data:
+        return
 
     global g_ch
-    g_ch = ch
-    print("Finished refresh_shard_range")
+    global g_loads
+    with g_refresh_lock:
+        g_loads = json.loads(data.decode('utf-8'))
+        current = g_ch
+        if isinstance(current, BoundedLoadHash):
+            # a copy, the readers of the current ring keep a consistent one
+            ch = copy.copy(current)
+            ch.set_loads(g_loads)
+            g_ch = ch
+
+    print(f"Finished refresh_loads: {g_loads}")
+
+
+async def publish_loads(interval):
+    """
+    Writes the key count of every node to LOADS_PATH once per `interval`. Every server tries, the versioned write
+    lets only one of them do it.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            data, stat = await loop.run_in_executor(None, zk.get, LOADS_PATH)
+            if time.time() - stat.mtime / 1000 < interval:
+                continue
+
+            ch = g_ch
+            if not ch:
+                continue
+
+            nodes = {k: v for k, nick, v in ch.kvlist}
+            sizes = await asyncio.gather(*[v.get_async_conn().dbsize() for v in nodes.values()])
+            value = json.dumps(dict(zip(nodes, sizes))).encode('utf-8')
+            await loop.run_in_executor(None, functools.partial(zk.set, LOADS_PATH, value, version=stat.version))
+        except BadVersionError:
+            pass
+        except Exception as e:
+            print("publish_loads failed: ", str(e))
+
+
+def elect_migrator():
+    # every server sees the membership changes, only the one holding the lock migrates, for as long as it lives
+    g_migration_lock.acquire()
+    print("This server migrates the keys")
+
+
+def start_migration(old_ring, new_ring, retired):
+    global g_migrator
+    global g_retired
+
+    sources = {}
+    if g_migrator:
+        g_migrator.stop()
+        g_migrator.join()
+        # the nodes it did not finish are moved by the next migration, even those out of the ring by now
+        sources = g_migrator.unfinished()
+        g_migrator = None
+
+    # closed once a migration finishes, the unfinished nodes are still read until then
+    g_retired += retired
+
+    def close_retired():
+        global g_retired
+        closing, g_retired = g_retired, []
+        for conn in closing:
+            conn.close()
+            if g_loop:
+                asyncio.run_coroutine_threadsafe(conn.aclose(), g_loop)
+
+    migration = conf.section("migration")
+    if migration.get("enabled", "true") != "true" or not (g_migration_lock and g_migration_lock.is_acquired):
+        close_retired()
+        return
+
+    g_migrator = KeyMigrator(old_ring, new_ring,
+                             page_size=int(migration["page_size"]),
+                             max_keys_per_sec=int(migration["max_keys_per_sec"]),
+                             sources=sources)
+    g_migrator.start(on_done=close_retired)
 
 
 app = FastAPI()
 my_settings = Settings()
 conf = Config(my_settings.CONFIG_PATH)
 ZK_PATH = "/the_red/cache/redis/scrap"
+LOADS_PATH = "/the_red/cache/redis/scrap_loads"
+MIGRATION_LOCK_PATH = "/the_red/cache/redis/scrap_migration"
+
+ring_conf = conf.section("ring")
+if ring_conf["strategy"] not in STRATEGIES:
+    raise Exception("Unknown hash strategy: " + ring_conf["strategy"])
 
 
 init_log(app, conf.section("log")["path"])
 init_cors(app)
 init_instrumentator(app)
 zk = init_kazoo(conf.section("zookeeper")["hosts"], ZK_PATH, refresh_shard_range)
+g_migration_lock = zk.Lock(MIGRATION_LOCK_PATH)
+threading.Thread(target=elect_migrator, name="migrator-election", daemon=True).start()
+if ring_conf["strategy"] == "bounded_load":
+    zk.ensure_path(LOADS_PATH)
+    zk.DataWatch(LOADS_PATH)(refresh_loads)
 
 templates = Jinja2Templates(directory="templates/")
 
+report = conf.section("report")
+g_reporter = DistributionReporter(sample_size=int(report["sample_size"]),
+                                  ttl=int(report["ttl"]),
+                                  method=report["method"])
+
+
+@app.on_event("startup")
+async def startup():
+    # ZooKeeper callbacks run on the kazoo thread and need the loop to close async pools
+    global g_loop
+    g_loop = asyncio.get_running_loop()
+    if ring_conf["strategy"] == "bounded_load":
+        asyncio.ensure_future(publish_loads(ring_conf.getfloat("load_interval_seconds", fallback=30)))
+
 
 @app.exception_handler(UnicornException)
 async def unicorn_exception_handler(request: Request, exc: UnicornException):
@@ -103,14 +278,14 @@ def parse_opengraph(body: str):
 
 
 def get_conn(ch, key):
-    if not g_ch:
+    if not ch:
         return None
 
-    v = g_ch.get(key)
-    return g_ch.continuum[v[0]][2].get_conn()
+    v = ch.get(key)
+    return v[1].get_async_conn()
 
 
-def store_to_cache(url: str, value: str):
+async def store_to_cache(url: str, value: str):
     global g_ch
 
     key = f"url:{url}"
@@ -118,10 +293,10 @@ def store_to_cache(url: str, value: str):
     if not conn:
         return None
 
-    conn.set(key, json.dumps(value))
+    await conn.set(key, json.dumps(value))
 
 
-def get_from_cache(url: str):
+async def get_from_cache(url: str):
     global g_ch
 
     key = f"url:{url}"
@@ -130,25 +305,64 @@ def get_from_cache(url: str):
         return None
 
     try:
-        value = conn.get(key)
+        value = await conn.get(key)
         if value:
             return json.loads(value.decode('utf-8'))
         else:
             return None
     except Exception as e:
         raise e
-    
+
+
+async def get_many_from_cache(ch, urls):
+    """
+    Groups the keys by owning node and issues one MGET per node, all nodes concurrently.
+    """
+    keys = {f"url:{url}": url for url in urls}
+    groups = ch.group_by_value(list(keys))
+
+    async def mget(node, node_keys):
+        return node_keys, await node.get_async_conn().mget(node_keys)
+
+    values = {}
+    for node_keys, raws in await asyncio.gather(*[mget(node, node_keys) for node, node_keys in groups.items()]):
+        for key, raw in zip(node_keys, raws):
+            if raw:
+                values[keys[key]] = json.loads(raw.decode('utf-8'))
+
+    return values
+
+
+async def store_many_to_cache(ch, values):
+    """
+    Writes {url: value} with one pipelined SET batch per owning node, all nodes concurrently.
+    """
+    keys = {f"url:{url}": value for url, value in values.items()}
+    groups = ch.group_by_value(list(keys))
+
+    async def mset(node, node_keys):
+        async with node.get_async_conn().pipeline(transaction=False) as pipe:
+            for key in node_keys:
+                pipe.set(key, json.dumps(keys[key]))
+            await pipe.execute()
+
+    await asyncio.gather(*[mset(node, node_keys) for node, node_keys in groups.items()])
+
+
+async def fetch_scrap(url: str):
+    body = await call_api(url)
+    return parse_opengraph(body)
+
 
 @app.get("/api/v1/scrap/")
 async def scrap(url: str):
     try:
         url = urllib.parse.unquote(url)
-        value = get_from_cache(url)
+        value = await get_from_cache(url)
         if not value:
             print("Not Exist in Cache: ", url)
-            body = await call_api(url)
-            value = parse_opengraph(body)
-            store_to_cache(url, value)
+            value = await fetch_scrap(url)
+            await store_to_cache(url, value)
         else:
             print("Exist in Cache: ", url)
 
@@ -158,24 +372,52 @@ async def scrap(url: str):
         raise UnicornException(status=400, code=-20000, message=str(e))
 
 
-def all_keys(conn):
-    results = []
-    for key in conn.scan_iter("*"):
-        k = key.decode('utf-8')
-        results.append((g_ch.hash_func(k), k))
+@app.get("/api/v1/scraps/")
+async def scraps(url: List[str] = Query([])):
+    ch = g_ch
+    if not ch:
+        raise UnicornException(status=500, code=-20001, message="There is no redis nodes")
 
-    return sorted(results, key=lambda x: x[0])
+    try:
+        urls = list(dict.fromkeys(urllib.parse.unquote(u) for u in url))
+        values = await get_many_from_cache(ch, urls)
+
+        missed = [u for u in urls if u not in values]
+        if missed:
+            print("Not Exist in Cache: ", missed)
+            fetched = dict(zip(missed, await asyncio.gather(*[fetch_scrap(u) for u in missed])))
+            await store_many_to_cache(ch, fetched)
+            values.update(fetched)
+
+        return {"scraps": [values[u] for u in urls]}
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        raise UnicornException(status=400, code=-20000, message=str(e))
 
 
 @app.get("/demo")
 async def demo(request: Request):
     global g_ch
-    results = []
-    for k,i,v,h,nick in g_ch.continuum:
-        try:
-            keys = all_keys(v.get_conn())
-            results.append((nick, h, keys))
-        except Exception as e:
-            results.append((nick, h, []))
+    ch = g_ch
+    if not ch:
+        raise UnicornException(status=500, code=-20001, message="There is no redis nodes")
 
+    results = await g_reporter.collect(ch)
     return templates.TemplateResponse('demo.html', context={'request': request, 'results': results})
+
+
+@app.get("/demo/report")
+async def demo_report():
+    """
+    Streams the sampled distribution report as one JSON line per node.
+    """
+    global g_ch
+    ch = g_ch
+    if not ch:
+        raise UnicornException(status=500, code=-20001, message="There is no redis nodes")
+
+    async def lines():
+        async for r in g_reporter.stream(ch):
+            yield json.dumps(r) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,209 @@
+import sys
+import time
+import threading
+
+from redis.exceptions import ResponseError
+
+from instrumentator import MIGRATION_RUNNING, MIGRATION_PROGRESS, MIGRATION_SCANNED_KEYS, MIGRATION_MOVED_KEYS
+
+
+PAGE_SIZE = 500
+MAX_KEYS_PER_SEC = 5000
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many keys per second the migration may touch.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+
+    def acquire(self, n, stop_event=None):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            if self.tokens >= n or self.tokens >= self.rate:
+                self.tokens -= n
+                return
+
+            wait = (n - self.tokens) / self.rate
+            if stop_event:
+                if stop_event.wait(wait):
+                    return
+            else:
+                time.sleep(wait)
+
+
+class KeyMigrator:
+    """
+    Moves keys whose owner changed between old_ring and new_ring.
+
+    Each node of the old ring, and each of `sources` ({value: addr}, the nodes a stopped migration did not finish),
+    is scanned page by page, every page is routed through the new ring, and the keys owned by another node are copied
+    with pipelined DUMP/RESTORE (TTL preserved) and then deleted from the source. A key that already exists on the
+    target was written through the new ring and is newer, so it is never replaced. A key whose RESTORE failed for
+    another reason stays on the source.
+    """
+    def __init__(self, old_ring, new_ring, page_size=PAGE_SIZE, max_keys_per_sec=MAX_KEYS_PER_SEC, sources=None):
+        self.old_ring = old_ring
+        self.new_ring = new_ring
+        self.sources = self.nodes(old_ring)
+        self.sources.update(sources or {})
+        self.finished = set()
+        self.page_size = page_size
+        self.limiter = RateLimiter(max_keys_per_sec)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.scanned = 0
+        self.moved = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def nodes(self, ring):
+        return {v: k for k, nick, v in ring.kvlist}
+
+    def start(self, on_done=None):
+        def run():
+            try:
+                self.run()
+            except Exception as e:
+                print("Migration failed: ", str(e), file=sys.stderr)
+            finally:
+                # a stopped migration hands its unfinished nodes to the next one, which calls on_done
+                if on_done and not self.stop_event.is_set():
+                    on_done()
+
+        self.thread = threading.Thread(target=run, name="key-migrator", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def unfinished(self):
+        return {v: addr for v, addr in self.sources.items() if v not in self.finished}
+
+    def run(self):
+        MIGRATION_RUNNING.set(1)
+        try:
+            for source, addr in self.sources.items():
+                if self.stop_event.is_set():
+                    break
+
+                try:
+                    if self.migrate_node(source, addr):
+                        self.finished.add(source)
+                except Exception as e:
+                    print(f"Migration of {addr} failed: ", str(e), file=sys.stderr)
+        finally:
+            MIGRATION_RUNNING.set(0)
+
+        print(f"Finished migration: scanned={self.scanned} moved={self.moved} skipped={self.skipped} "
+              f"failed={self.failed}")
+
+    def migrate_node(self, source, addr) -> bool:
+        """Returns whether the whole node was scanned."""
+        targets = self.nodes(self.new_ring)
+        conn = source.get_conn()
+        total = max(conn.dbsize(), 1)
+        scanned = 0
+
+        cursor = 0
+        while not self.stop_event.is_set():
+            cursor, keys = conn.scan(cursor=cursor, count=self.page_size)
+            if keys:
+                self.limiter.acquire(len(keys), self.stop_event)
+                scanned += len(keys)
+                self.scanned += len(keys)
+                MIGRATION_SCANNED_KEYS.labels(addr).inc(len(keys))
+
+                groups = self.new_ring.group_by_value([k.decode('utf-8') for k in keys])
+                for target, moving in groups.items():
+                    if target is source:
+                        continue
+
+                    moved = self.move_keys(conn, target.get_conn(), moving)
+                    MIGRATION_MOVED_KEYS.labels(addr, targets.get(target, "")).inc(moved)
+
+            MIGRATION_PROGRESS.labels(addr).set(min(scanned / total, 1.0))
+            if cursor == 0:
+                return True
+
+        return False
+
+    def move_keys(self, src, dst, keys):
+        pipe = src.pipeline(transaction=False)
+        for key in keys:
+            pipe.pttl(key)
+            pipe.dump(key)
+        values = pipe.execute()
+
+        restoring = []
+        pipe = dst.pipeline(transaction=False)
+        for i, key in enumerate(keys):
+            pttl, data = values[2*i], values[2*i+1]
+            if data is None or pttl == -2:
+                continue
+
+            pipe.restore(key, pttl if pttl > 0 else 0, data)
+            restoring.append(key)
+
+        if not restoring:
+            return 0
+
+        moved = 0
+        done = []
+        results = pipe.execute(raise_on_error=False)
+        for key, result in zip(restoring, results):
+            if not isinstance(result, ResponseError):
+                moved += 1
+            elif str(result).startswith("BUSYKEY"):
+                # the new owner already has a fresher value
+                self.skipped += 1
+            else:
+                print(f"Restore of {key} failed: ", str(result), file=sys.stderr)
+                self.failed += 1
+                continue
+            done.append(key)
+
+        if done:
+            src.delete(*done)
+        self.moved += moved
+        return moved
+
+
+if __name__ == "__main__":
+    # python migration.py 127.0.0.1:16379 127.0.0.1:16380 127.0.0.1:16381
+    # seeds keys into a ring without the last node, adds it and checks every key is reachable afterwards
+    from consistent_hash import ConsistentHash
+    from redis_conn import RedisConnection
+
+    addrs = sys.argv[1:]
+    kvlist = [(addr, f"redis{i}", RedisConnection(addr)) for i, addr in enumerate(addrs)]
+    old_ring = ConsistentHash(kvlist[:-1], 1)
+    new_ring = old_ring.with_changes(kvlist[-1:], [])
+
+    keys = [f"url:migration-test-{i}" for i in range(10000)]
+    for conn, group in old_ring.group_by_value(keys).items():
+        pipe = conn.get_conn().pipeline(transaction=False)
+        for key in group:
+            pipe.set(key, key, ex=3600)
+        pipe.execute()
+
+    migrator = KeyMigrator(old_ring, new_ring)
+    migrator.run()
+
+    missing = 0
+    for conn, group in new_ring.group_by_value(keys).items():
+        missing += sum(1 for v in conn.get_conn().mget(group) if v is None)
+
+    print(f"moved={migrator.moved} missing={missing}")
@@ -1,9 +1,22 @@
 import redis
+import redis.asyncio
 
 
 class RedisConnection:
     def __init__(self, host):
         self.pool = redis.ConnectionPool.from_url(f"redis://{host}")
+        # connections of the async pool are opened lazily on the event loop that uses them
+        self.async_pool = redis.asyncio.ConnectionPool.from_url(f"redis://{host}")
 
     def get_conn(self):
         return redis.StrictRedis(connection_pool=self.pool)
+
+    def get_async_conn(self):
+        return redis.asyncio.StrictRedis(connection_pool=self.async_pool)
+
+    def close(self):
+        # only idle connections are dropped, so in-flight commands can finish
+        self.pool.disconnect(inuse_connections=False)
+
+    async def aclose(self):
+        await self.async_pool.disconnect(inuse_connections=False)
@@ -0,0 +1,60 @@
+from consistent_hash import ConsistentHash
+import consistent_hash
+
+import pytest
+
+
+KVLIST = [
+    ("host1", "cache1", "value1"),
+    ("host2", "cache2", "value2"),
+    ("host3", "cache3", "value3"),
+    ("host4", "cache4", "value4"),
+]
+KEYS = [f"key:{i}" for i in range(1000)]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "bisect"])
+def ring(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(consistent_hash, "np", None)
+    elif consistent_hash.np is None:
+        pytest.skip("numpy is not installed")
+    return ConsistentHash(KVLIST, 100)
+
+
+def test_get_many_agrees_with_get(ring):
+    assert ring.get_many(KEYS) == [ring.get(key) for key in KEYS]
+
+
+def test_group_by_value_agrees_with_get(ring):
+    groups = ring.group_by_value(KEYS)
+
+    assert sorted(k for keys in groups.values() for k in keys) == sorted(KEYS)
+    for value, keys in groups.items():
+        for key in keys:
+            assert ring.get(key)[1] == value
+
+
+def test_empty_ring_fails_like_get():
+    ring = ConsistentHash([], 100)
+    with pytest.raises(Exception, match="There is no node"):
+        ring.get(KEYS[0])
+    with pytest.raises(Exception, match="There is no node"):
+        ring.get_many(KEYS)
+    with pytest.raises(Exception, match="There is no node"):
+        ring.group_by_value(KEYS)
+
+
+def test_with_changes_agrees_with_new_ring(ring):
+    added = [("host5", "cache5", "value5")]
+    changed = ring.with_changes(added, ["host2"])
+    rebuilt = ConsistentHash([kv for kv in KVLIST if kv[0] != "host2"] + added, 100)
+
+    assert changed.get_many(KEYS) == rebuilt.get_many(KEYS)
+
+
+def test_wide_hash_func_is_cut_to_32_bits(ring):
+    wide = ConsistentHash(KVLIST, 100, lambda key: ring.ketama_hash(key) | (1 << 40))
+
+    assert wide.get_many(KEYS) == [wide.get(key) for key in KEYS]
+    assert [v for i, v in wide.get_many(KEYS)] == [v for i, v in ring.get_many(KEYS)]
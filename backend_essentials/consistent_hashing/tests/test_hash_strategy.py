@@ -0,0 +1,51 @@
+from hash_strategy import BoundedLoadHash
+from consistent_hash import ConsistentHash
+
+import pytest
+
+
+KVLIST = [(f"host{i}", f"cache{i}", f"value{i}") for i in range(8)]
+KEYS = [f"key:{i}" for i in range(5000)]
+
+
+def ketama_loads(ring):
+    loads = {k: 0 for k, nick, v in KVLIST}
+    for idx, value in ConsistentHash(KVLIST, ring.replica).get_many(KEYS):
+        loads[ring.continuum[idx][0]] += 1
+    return loads
+
+
+def test_without_loads_it_is_ketama():
+    assert BoundedLoadHash(KVLIST, 40).get_many(KEYS) == ConsistentHash(KVLIST, 40).get_many(KEYS)
+
+
+def test_same_snapshot_same_placement():
+    a = BoundedLoadHash(KVLIST, 40, load_factor=1.05)
+    b = BoundedLoadHash(KVLIST, 40, load_factor=1.05)
+    loads = ketama_loads(a)
+    a.set_loads(loads)
+    b.set_loads(loads)
+
+    # the order of the lookups does not matter
+    assert a.get_many(KEYS) == list(reversed(b.get_many(list(reversed(KEYS)))))
+    assert a.get_many(KEYS) == [a.get(key) for key in KEYS]
+
+
+def test_loads_are_bounded():
+    ring = BoundedLoadHash(KVLIST, 160, load_factor=1.1)
+    ring.set_loads(ketama_loads(ring))
+
+    counts = {}
+    for idx, value in ring.get_many(KEYS):
+        counts[value] = counts.get(value, 0) + 1
+    assert max(counts.values()) <= 1.15 * len(KEYS) / len(KVLIST)
+
+
+def test_empty_ring():
+    ring = BoundedLoadHash([], 40)
+    ring.set_loads({"host0": 10})
+
+    with pytest.raises(Exception):
+        ring.get_many(KEYS)
+    with pytest.raises(Exception):
+        ring.get("key")
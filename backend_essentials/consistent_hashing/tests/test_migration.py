@@ -0,0 +1,117 @@
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from consistent_hash import ConsistentHash
+from migration import KeyMigrator
+from redis_conn import RedisConnection
+
+
+BASE_PORT = 6430
+KEYS = [f"url:migration-test-{i}" for i in range(2000)]
+
+
+@pytest.fixture(scope="module")
+def kvlist():
+    if not shutil.which("redis-server"):
+        pytest.skip("redis-server is not installed")
+
+    servers = [subprocess.Popen(["redis-server", "--port", str(BASE_PORT + i), "--save", "", "--appendonly", "no"],
+                                stdout=subprocess.DEVNULL) for i in range(3)]
+    time.sleep(0.5)
+    yield [(f"127.0.0.1:{BASE_PORT + i}", f"redis{i}", RedisConnection(f"127.0.0.1:{BASE_PORT + i}"))
+           for i in range(3)]
+
+    for server in servers:
+        server.kill()
+        server.wait()
+
+
+def seed(ring, kvlist):
+    for k, nick, v in kvlist:
+        v.get_conn().flushall()
+    for conn, group in ring.group_by_value(KEYS).items():
+        pipe = conn.get_conn().pipeline(transaction=False)
+        for i, key in enumerate(group):
+            pipe.set(key, key, ex=3600 if i % 2 else None)
+        pipe.execute()
+
+
+def missing(ring):
+    return sum(sum(1 for v in conn.get_conn().mget(group) if v is None)
+               for conn, group in ring.group_by_value(KEYS).items())
+
+
+def test_moves_keys_with_their_ttl(kvlist):
+    old_ring = ConsistentHash(kvlist[:-1], 40)
+    new_ring = old_ring.with_changes(kvlist[-1:], [])
+    seed(old_ring, kvlist)
+
+    migrator = KeyMigrator(old_ring, new_ring)
+    migrator.run()
+
+    added = kvlist[-1][2].get_conn()
+    assert migrator.moved == added.dbsize() > 0
+    assert missing(new_ring) == 0
+    ttls = [added.ttl(key) for key in added.scan_iter()]
+    assert {ttl == -1 for ttl in ttls} == {True, False}
+    assert all(ttl == -1 or 3500 < ttl <= 3600 for ttl in ttls)
+    assert sum(v.get_conn().dbsize() for k, nick, v in kvlist) == len(KEYS)
+
+
+def test_keeps_the_newer_value_of_the_target(kvlist):
+    old_ring = ConsistentHash(kvlist[:-1], 40)
+    new_ring = old_ring.with_changes(kvlist[-1:], [])
+    seed(old_ring, kvlist)
+
+    added = kvlist[-1][2].get_conn()
+    key = new_ring.group_by_value(KEYS)[kvlist[-1][2]][0]
+    added.set(key, "newer")
+
+    migrator = KeyMigrator(old_ring, new_ring)
+    migrator.run()
+
+    assert migrator.skipped == 1
+    assert added.get(key) == b"newer"
+    assert sum(v.get_conn().exists(key) for k, nick, v in kvlist) == 1
+
+
+def test_keeps_the_source_key_when_restore_fails(kvlist):
+    old_ring = ConsistentHash(kvlist[:1], 40)
+    new_ring = old_ring.with_changes(kvlist[1:2], [])
+    src, dst = kvlist[0][2].get_conn(), kvlist[1][2].get_conn()
+    src.flushall()
+    dst.flushall()
+    src.set("a", "1")
+
+    # the target refuses writes with OOM
+    dst.config_set("maxmemory-policy", "noeviction")
+    dst.config_set("maxmemory", 1)
+    try:
+        migrator = KeyMigrator(old_ring, new_ring)
+        migrator.move_keys(src, dst, ["a"])
+    finally:
+        dst.config_set("maxmemory", 0)
+
+    assert migrator.failed == 1
+    assert src.get("a") == b"1"
+
+
+def test_stopped_migration_hands_over_its_nodes(kvlist):
+    # the first node leaves, then the second one before the first migration went anywhere
+    ring = ConsistentHash(kvlist, 40)
+    seed(ring, kvlist)
+    first = ring.with_changes([], [kvlist[0][0]])
+    second = first.with_changes([], [kvlist[1][0]])
+
+    stopped = KeyMigrator(ring, first)
+    stopped.stop()
+    stopped.run()
+    assert kvlist[0][2] in stopped.unfinished()
+
+    KeyMigrator(first, second, sources=stopped.unfinished()).run()
+
+    assert missing(second) == 0
+    assert kvlist[2][2].get_conn().dbsize() == len(KEYS)
@@ -0,0 +1,75 @@
+"""
+Throughput of the Snowflake generator, asserting that every id is unique.
+
+    python benchmark.py [count] [threads]
+"""
+import sys
+import time
+import asyncio
+import threading
+
+from guid import Snowflake
+
+
+def check(name, ids, count, elapsed):
+    assert len(ids) == count, f"{name}: expected {count} ids, got {len(ids)}"
+    assert len(set(ids)) == count, f"{name}: {count - len(set(ids))} duplicated ids"
+    print(f"{name:<16} {count} unique ids in {elapsed:.3f}s ({count / elapsed:,.0f} ids/s)")
+
+
+def bench_next(count):
+    snowflake = Snowflake(0, 0)
+    start = time.perf_counter()
+    ids = [snowflake.next() for _ in range(count)]
+    check("next", ids, count, time.perf_counter() - start)
+    assert ids == sorted(ids), "next: ids are not increasing"
+
+
+def bench_block(count):
+    snowflake = Snowflake(0, 1)
+    start = time.perf_counter()
+    ids = snowflake.next_block(count)
+    check("next_block", ids, count, time.perf_counter() - start)
+    assert ids == sorted(ids), "next_block: ids are not increasing"
+
+
+def bench_threads(count, threads):
+    snowflake = Snowflake(0, 2)
+    results = [[] for _ in range(threads)]
+
+    def run(out):
+        for _ in range(count // threads):
+            out.append(snowflake.next())
+
+    workers = [threading.Thread(target=run, args=(out,)) for out in results]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    ids = [n for out in results for n in out]
+    check(f"next x{threads}", ids, count // threads * threads, time.perf_counter() - start)
+
+
+def bench_async(count, tasks):
+    snowflake = Snowflake(0, 3)
+
+    async def run():
+        async def worker():
+            return await snowflake.next_block_async(count // tasks)
+        return await asyncio.gather(*[worker() for _ in range(tasks)])
+
+    start = time.perf_counter()
+    ids = [n for out in asyncio.run(run()) for n in out]
+    check(f"async x{tasks}", ids, count // tasks * tasks, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    bench_next(count)
+    bench_block(count)
+    bench_threads(count, threads)
+    bench_async(count, threads)
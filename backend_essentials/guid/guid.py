@@ -1,5 +1,6 @@
-from utils import get_timestamp, til_next_millis, get_bitsize
+from utils import get_timestamp, til_next_millis, async_til_next_millis, get_bitsize
 import time
+import threading
 
 EPOCH = time.mktime((2021, 6, 1, 0, 0, 0, 0, 0, 0))
 
@@ -14,6 +15,7 @@ class GUID_BITS:
     TIMESTAMP_LEFT_SHIFT = SEQUENCE_BITS + WORKER_ID_BITS + DATACENTER_ID_BITS
 
     WORKER_ID_MASK = (1 << WORKER_ID_BITS) - 1
+    DATACENTER_ID_MASK = (1 << DATACENTER_ID_BITS) - 1
     SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
 
 
@@ -24,30 +26,87 @@ class Snowflake(object):
             raise Exception("Invalid datacenter_id or worker_id")
 
         self.epoch = epoch
-        self.datacenter_id = (datacenter_id & GUID_BITS.DATACENTER_ID_BITS) << \
+        self.epoch_ms = int(epoch*1000)
+        self.datacenter_id = (datacenter_id & GUID_BITS.DATACENTER_ID_MASK) << \
                               GUID_BITS.DATACENTER_ID_SHIFT
-        self.worker_id = (worker_id & GUID_BITS.WORKER_ID_BITS) << \
+        self.worker_id = (worker_id & GUID_BITS.WORKER_ID_MASK) << \
                           GUID_BITS.WORKER_ID_SHIFT
 
         self.last_timestamp = -1
         self.sequence = 0
+        self.lock = threading.Lock()
 
-    def next(self):
-        timestamp = get_timestamp()
-        if (timestamp < self.last_timestamp):
-            raise Exception("Clock moved backwards")
-
-        if (timestamp == self.last_timestamp):
-            self.sequence = (self.sequence + 1) & GUID_BITS.SEQUENCE_MASK
-            if (self.sequence == 0):
-                timestamp = til_next_millis(self.last_timestamp)
+    def reserve(self, count):
+        """
+        Reserves up to `count` sequence numbers of the current millisecond.
+        Returns (timestamp, first sequence, reserved count), or None when the millisecond is used up.
+        """
+        with self.lock:
+            timestamp = get_timestamp()
+            if (timestamp < self.last_timestamp):
+                raise Exception("Clock moved backwards")
+
+            if (timestamp == self.last_timestamp):
+                if (self.sequence == GUID_BITS.SEQUENCE_MASK):
+                    return None
+                start = self.sequence + 1
             else:
-                self.sequence = 0
+                start = 0
 
-        self.last_timestamp = timestamp
-        timestamp = timestamp - (int(self.epoch*1000))
+            reserved = min(count, GUID_BITS.SEQUENCE_MASK + 1 - start)
+            self.sequence = start + reserved - 1
+            self.last_timestamp = timestamp
+            return timestamp, start, reserved
+
+    def make(self, timestamp, sequence):
+        timestamp = timestamp - self.epoch_ms
         guoidValue = (timestamp << GUID_BITS.TIMESTAMP_LEFT_SHIFT) |\
-                     (self.datacenter_id | (self.worker_id) | self.sequence)
+                     (self.datacenter_id | (self.worker_id) | sequence)
 
         return guoidValue
 
+    def block(self, reservation):
+        timestamp, start, reserved = reservation
+        first = self.make(timestamp, start)
+        return range(first, first + reserved)
+
+    def next(self):
+        while True:
+            reservation = self.reserve(1)
+            if reservation:
+                return self.make(reservation[0], reservation[1])
+
+            til_next_millis(self.last_timestamp)
+
+    def next_block(self, count):
+        """
+        Returns `count` ids in ascending order. Ids of the same millisecond are contiguous.
+        """
+        ids = []
+        while len(ids) < count:
+            reservation = self.reserve(count - len(ids))
+            if reservation:
+                ids.extend(self.block(reservation))
+            else:
+                til_next_millis(self.last_timestamp)
+
+        return ids
+
+    async def next_async(self):
+        while True:
+            reservation = self.reserve(1)
+            if reservation:
+                return self.make(reservation[0], reservation[1])
+
+            await async_til_next_millis(self.last_timestamp)
+
+    async def next_block_async(self, count):
+        ids = []
+        while len(ids) < count:
+            reservation = self.reserve(count - len(ids))
+            if reservation:
+                ids.extend(self.block(reservation))
+            else:
+                await async_til_next_millis(self.last_timestamp)
+
+        return ids
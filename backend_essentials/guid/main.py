@@ -13,8 +13,12 @@ import logging
 import json_logging
 import httpx
 import sys
+import os
+import socket
 
 from guid import Snowflake
+from worker_lease import WorkerIdLease
+from zoo import init_kazoo
 from log import init_log
 from cors import init_cors
 from instrumentator import init_instrumentator
@@ -37,7 +41,38 @@ def init_snowflake(conf):
     return snowflake
 
 
-snowflake = init_snowflake(conf)
+def init_worker_lease(conf):
+    guid = conf.section("guid")
+    zookeeper = conf.section("zookeeper")
+    zk = init_kazoo(zookeeper["hosts"], None, None)
+    identity = f"{socket.gethostname()}:{os.getpid()}:{my_settings.APP_ENDPOINT}"
+    lease = WorkerIdLease(zk, zookeeper["path"], int(guid['DATACENTER_ID']), identity)
+    lease.claim()
+    return lease
+
+
+snowflake = None
+lease = None
+if conf.section("guid").get("worker_id_mode", "static") == "zookeeper":
+    lease = init_worker_lease(conf)
+else:
+    snowflake = init_snowflake(conf)
+
+MAX_BATCH = int(conf.section("guid").get("max_batch", "10000"))
+
+
+def get_snowflake():
+    if lease:
+        return lease.get()
+
+    return snowflake
+
+
+@app.on_event("shutdown")
+def shutdown():
+    if lease:
+        lease.release()
+        lease.zk.stop()
 
 
 @app.exception_handler(UnicornException)
@@ -51,7 +86,19 @@ async def unicorn_exception_handler(request: Request, exc: UnicornException):
 @app.get("/api/v1/guid/")
 async def guid():
     try:
-        n = snowflake.next()
+        n = await get_snowflake().next_async()
         return {"guid": n, "guid_str": str(n)}
     except Exception as e:
         raise UnicornException(status=400, code=-20000, message=str(e))
+
+
+@app.get("/api/v1/guid/batch")
+async def guid_batch(count: int = 1):
+    if count < 1 or count > MAX_BATCH:
+        raise UnicornException(status=400, code=-20001, message=f"count should be between 1 and {MAX_BATCH}")
+
+    try:
+        ids = await get_snowflake().next_block_async(count)
+        return {"count": len(ids), "guids": ids, "guids_str": [str(n) for n in ids]}
+    except Exception as e:
+        raise UnicornException(status=400, code=-20000, message=str(e))
@@ -0,0 +1,186 @@
+import threading
+import time
+
+from kazoo.exceptions import BadVersionError, NoNodeError, NodeExistsError
+from kazoo.protocol.states import KazooState
+
+from worker_lease import WorkerIdLease
+
+import pytest
+
+
+PATH = "/the_red/guid/workers"
+
+
+class Stat:
+    def __init__(self, version):
+        self.version = version
+
+
+class FakeEnsemble:
+    """The znodes of an in-process ZooKeeper, shared by the clients."""
+    def __init__(self):
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+
+class FakeZooKeeper:
+    """
+    A kazoo client over a FakeEnsemble. expire() drops the ephemeral znodes of the session like ZooKeeper does when
+    a session times out, and reconnect() starts a new session.
+    """
+    def __init__(self, ensemble):
+        self.ensemble = ensemble
+        self.session = object()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def notify(self, state):
+        for listener in list(self.listeners):
+            listener(state)
+
+    def ensure_path(self, path):
+        with self.ensemble.lock:
+            self.ensemble.nodes.setdefault(path, (b"", 0, None))
+
+    def get_children(self, path):
+        prefix = path + "/"
+        with self.ensemble.lock:
+            return [p[len(prefix):] for p in self.ensemble.nodes if p.startswith(prefix)]
+
+    def create(self, path, value=b"", ephemeral=False):
+        with self.ensemble.lock:
+            if path in self.ensemble.nodes:
+                raise NodeExistsError()
+            self.ensemble.nodes[path] = (value, 0, self.session if ephemeral else None)
+
+    def get(self, path):
+        with self.ensemble.lock:
+            if path not in self.ensemble.nodes:
+                raise NoNodeError()
+            value, version, owner = self.ensemble.nodes[path]
+            return value, Stat(version)
+
+    def delete(self, path, version=-1):
+        with self.ensemble.lock:
+            if path not in self.ensemble.nodes:
+                raise NoNodeError()
+            if version != -1 and self.ensemble.nodes[path][1] != version:
+                raise BadVersionError()
+            del self.ensemble.nodes[path]
+
+    def suspend(self):
+        self.notify(KazooState.SUSPENDED)
+
+    def expire(self):
+        with self.ensemble.lock:
+            for path, (value, version, owner) in list(self.ensemble.nodes.items()):
+                if owner is self.session:
+                    del self.ensemble.nodes[path]
+        self.notify(KazooState.LOST)
+
+    def reconnect(self, new_session=False):
+        if new_session:
+            self.session = object()
+        self.notify(KazooState.CONNECTED)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def ensemble():
+    return FakeEnsemble()
+
+
+def test_claim_takes_the_first_free_slot(ensemble):
+    first = WorkerIdLease(FakeZooKeeper(ensemble), PATH, 1, "pod-a")
+    second = WorkerIdLease(FakeZooKeeper(ensemble), PATH, 1, "pod-b")
+
+    assert first.claim() == 0
+    assert second.claim() == 1
+    assert first.get().worker_id != second.get().worker_id
+    assert ensemble.nodes[f"{PATH}/0"][0] == b"pod-a"
+
+
+def test_claim_fails_when_every_slot_is_taken(ensemble):
+    WorkerIdLease(FakeZooKeeper(ensemble), PATH, 1, "pod-a", max_workers=1).claim()
+
+    with pytest.raises(Exception):
+        WorkerIdLease(FakeZooKeeper(ensemble), PATH, 1, "pod-b", max_workers=1).claim()
+
+
+def test_suspended_lease_is_fenced_until_verified(ensemble):
+    zk = FakeZooKeeper(ensemble)
+    lease = WorkerIdLease(zk, PATH, 1, "pod-a")
+    lease.claim()
+
+    zk.suspend()
+    with pytest.raises(Exception):
+        lease.get()
+
+    zk.reconnect()
+    wait_for(lambda: not lease.fenced)
+    assert lease.worker_id == 0
+    assert lease.get() is lease.snowflake
+
+
+def test_expired_lease_is_reclaimed(ensemble):
+    zk = FakeZooKeeper(ensemble)
+    lease = WorkerIdLease(zk, PATH, 1, "pod-a")
+    lease.claim()
+
+    zk.expire()
+    with pytest.raises(Exception):
+        lease.get()
+
+    # the slot of the expired session was taken by another pod meanwhile
+    other = WorkerIdLease(FakeZooKeeper(ensemble), PATH, 1, "pod-b")
+    assert other.claim() == 0
+
+    zk.reconnect(new_session=True)
+    wait_for(lambda: not lease.fenced)
+    assert lease.worker_id == 1
+    assert ensemble.nodes[f"{PATH}/1"][0] == b"pod-a"
+
+
+def test_renew_reclaims_a_slot_taken_over(ensemble):
+    zk = FakeZooKeeper(ensemble)
+    lease = WorkerIdLease(zk, PATH, 1, "pod-a")
+    lease.claim()
+
+    # the slot now belongs to someone else, the lease must not keep using it
+    ensemble.nodes[f"{PATH}/0"] = (b"pod-b", 1, None)
+    lease.renew()
+
+    assert lease.worker_id == 1
+    assert lease.get() is lease.snowflake
+
+
+def test_release_deletes_only_its_own_slot(ensemble):
+    zk = FakeZooKeeper(ensemble)
+    lease = WorkerIdLease(zk, PATH, 1, "pod-a")
+    lease.claim()
+
+    lease.release()
+    assert f"{PATH}/0" not in ensemble.nodes
+    assert lease.claim() is None
+    with pytest.raises(Exception):
+        lease.get()
+    assert zk.listeners == []
+
+    taken = WorkerIdLease(zk, PATH, 1, "pod-b")
+    taken.claim()
+    ensemble.nodes[f"{PATH}/0"] = (b"pod-c", 3, None)
+    taken.release()
+    assert ensemble.nodes[f"{PATH}/0"][0] == b"pod-c"
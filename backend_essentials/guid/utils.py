@@ -1,4 +1,5 @@
 import time
+import asyncio
 
 
 def get_bitsize(v):
@@ -11,7 +12,16 @@ def get_timestamp():
 def til_next_millis(last):
     timestamp = get_timestamp()
     while (timestamp <= last):
-        time.sleep(0.001)
+        time.sleep(max((last + 1) / 1000 - time.time(), 0))
+        timestamp = get_timestamp()
+
+    return timestamp
+
+async def async_til_next_millis(last):
+    # sleeps on the event loop instead of blocking it until the next millisecond
+    timestamp = get_timestamp()
+    while (timestamp <= last):
+        await asyncio.sleep(max((last + 1) / 1000 - time.time(), 0))
         timestamp = get_timestamp()
 
     return timestamp
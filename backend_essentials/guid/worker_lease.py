@@ -0,0 +1,120 @@
+import threading
+
+from kazoo.exceptions import NoNodeError
+from kazoo.exceptions import NodeExistsError
+from kazoo.protocol.states import KazooState
+
+from guid import Snowflake, GUID_BITS
+from utils import get_bitsize
+
+
+class WorkerIdLease:
+    """
+    Leases a Snowflake worker id from ZooKeeper so that processes and pods never share one.
+
+    Every worker id is a slot `{path}/{worker_id}` created as an ephemeral znode holding the identity of the process,
+    so a slot is held exactly as long as the ZooKeeper session, which kazoo keeps renewing with its heartbeats.
+    When the connection is suspended the lease is fenced and no id is issued, because the session may expire
+    and the slot may be handed to another process. On reconnection the slot is verified and the lease unfenced,
+    or a new slot is claimed when the session was lost.
+    """
+    def __init__(self, zk, path, datacenter_id, identity, max_workers=get_bitsize(GUID_BITS.WORKER_ID_BITS)):
+        self.zk = zk
+        self.path = path
+        self.datacenter_id = datacenter_id
+        self.identity = identity.encode('utf-8')
+        self.max_workers = max_workers
+
+        self.worker_id = None
+        self.snowflake = None
+        self.fenced = True
+        self.released = False
+        self.lock = threading.Lock()
+
+        self.zk.add_listener(self.on_state)
+
+    def slot_path(self, worker_id):
+        return f"{self.path}/{worker_id}"
+
+    def claim(self):
+        with self.lock:
+            if self.released:
+                return None
+
+            self.zk.ensure_path(self.path)
+            used = set(self.zk.get_children(self.path))
+            for worker_id in range(self.max_workers):
+                if str(worker_id) in used:
+                    continue
+
+                try:
+                    self.zk.create(self.slot_path(worker_id), self.identity, ephemeral=True)
+                except NodeExistsError:
+                    continue
+
+                self.worker_id = worker_id
+                self.snowflake = Snowflake(self.datacenter_id, worker_id)
+                self.fenced = False
+                print(f"Leased worker id {worker_id}")
+                return worker_id
+
+            raise Exception("There is no free worker id")
+
+    def verify(self):
+        with self.lock:
+            if self.released or self.worker_id is None:
+                return False
+
+            try:
+                data, stat = self.zk.get(self.slot_path(self.worker_id))
+            except NoNodeError:
+                return False
+
+            if data != self.identity:
+                return False
+
+            self.fenced = False
+            return True
+
+    def renew(self):
+        try:
+            if not self.verify():
+                self.claim()
+        except Exception as e:
+            print("Worker id lease renewal failed: ", str(e))
+
+    def on_state(self, state):
+        # runs on the kazoo thread, zookeeper calls must be made from another thread
+        if state == KazooState.SUSPENDED:
+            self.fenced = True
+            print("Worker id lease fenced: connection suspended")
+        elif state == KazooState.LOST:
+            self.fenced = True
+            self.worker_id = None
+            print("Worker id lease lost: session expired")
+        elif state == KazooState.CONNECTED:
+            threading.Thread(target=self.renew, daemon=True).start()
+
+    def get(self):
+        snowflake = self.snowflake
+        if self.fenced or not snowflake:
+            raise Exception("Worker id lease is not held")
+
+        return snowflake
+
+    def release(self):
+        with self.lock:
+            self.released = True
+            self.fenced = True
+            self.zk.remove_listener(self.on_state)
+
+            if self.worker_id is not None:
+                try:
+                    data, stat = self.zk.get(self.slot_path(self.worker_id))
+                    if data == self.identity:
+                        self.zk.delete(self.slot_path(self.worker_id), version=stat.version)
+                except NoNodeError:
+                    pass
+
+                print(f"Released worker id {self.worker_id}")
+                self.worker_id = None
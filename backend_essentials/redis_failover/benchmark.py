@@ -0,0 +1,101 @@
+"""
+Read throughput with the reads on the primary only, and spread over 1, 2 and 4 replicas.
+
+    python benchmark.py [seconds] [concurrency] [service ms] [write ratio]
+
+Starts a primary and 4 replicas with redis-server on ports 6400 to 6404. The instances of a laptop share its cores,
+unlike in production, so every command is given `service ms` of server time with DEBUG SLEEP, which blocks the
+instance like a busy primary without using the CPU. Every client writes `write ratio` of the time and reads its
+own writes through the session offset.
+"""
+import sys
+import time
+import random
+import asyncio
+import subprocess
+import configparser
+
+from read_router import ReadRouter
+
+BASE_PORT = 6400
+
+
+def start_servers(count):
+    version = subprocess.run(["redis-server", "--version"], capture_output=True, text=True).stdout
+    major = int(version.split("v=")[1].split(".")[0])
+    servers = []
+    for i in range(count):
+        args = ["redis-server", "--port", str(BASE_PORT + i), "--save", "", "--appendonly", "no"]
+        if major >= 7:
+            args += ["--enable-debug-command", "local"]
+        if i:
+            args += ["--replicaof", "127.0.0.1", str(BASE_PORT)]
+        servers.append(subprocess.Popen(args, stdout=subprocess.DEVNULL))
+    time.sleep(1)
+    return servers
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def client(router, service, write_ratio, deadline, latencies, counts):
+    session = 0
+    while time.monotonic() < deadline:
+        key = f"k:{random.randint(0, 1000)}"
+        start = time.monotonic()
+        if random.random() < write_ratio:
+            session = await router.set(key, "v")
+            counts["writes"] += 1
+            continue
+
+        node = router.pick(session)
+        with node.track():
+            pipe = node.conn.pipeline(transaction=False)
+            if service:
+                pipe.execute_command("DEBUG", "SLEEP", service)
+            pipe.get(key)
+            await pipe.execute()
+        latencies.append(time.monotonic() - start)
+        counts["primary" if node is router.state[0] else "replica"] += 1
+
+
+async def run(replicas, seconds, concurrency, service, write_ratio):
+    conf = configparser.ConfigParser()
+    conf.read_string(f"[read]\nreplica_reads={'true' if replicas else 'false'}\n")
+    router = ReadRouter(conf["read"])
+    router.update(f"127.0.0.1:{BASE_PORT}", [f"127.0.0.1:{BASE_PORT + i}" for i in range(1, replicas + 1)])
+    router.start()
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    counts = {"primary": 0, "replica": 0, "writes": 0}
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[client(router, service, write_ratio, deadline, latencies, counts)
+                           for _ in range(concurrency)])
+    await router.stop()
+
+    reads = counts["primary"] + counts["replica"]
+    print(f"{replicas:>8} {reads / seconds:>9.0f} {percentile(latencies, 0.5) * 1000:>8.1f} "
+          f"{percentile(latencies, 0.99) * 1000:>8.1f} {counts['primary'] / max(reads, 1):>13.1%}")
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    service = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.001
+    write_ratio = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+
+    servers = start_servers(5)
+    try:
+        print(f"{'replicas':>8} {'reads/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'primary reads':>13}")
+        for replicas in [0, 1, 2, 4]:
+            asyncio.run(run(replicas, seconds, concurrency, service, write_ratio))
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
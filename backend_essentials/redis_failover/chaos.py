@@ -0,0 +1,138 @@
+"""
+Kills the primary under load and counts the failed requests and the latency spike.
+
+    python chaos.py [seconds] [concurrency] [failover ms] [write ratio]
+
+Starts a primary and 2 replicas with redis-server on ports 6410 to 6412. Halfway through, the primary is killed,
+and `failover ms` later the first replica is promoted and the router is told from another thread, as the monitor
+and the ZooKeeper watch would do. Every client writes `write ratio` of the time and reads its own writes, so its
+reads go to the dead primary until the replicas are seen to have replicated its last write.
+
+The run is made once with a cold swap (no connections opened before it, no wait for it before retrying a read)
+and once with the defaults. The writes sent during the failover fail whatever the mode.
+"""
+import sys
+import time
+import random
+import asyncio
+import threading
+import subprocess
+import configparser
+
+import redis.asyncio as redis
+
+from read_router import ReadRouter
+
+BASE_PORT = 6410
+MODES = {
+    "cold swap": "warm_connections=0\nretry_wait_ms=0\n",
+    "warm swap": "",
+}
+
+
+def start_servers(count):
+    servers = []
+    for i in range(count):
+        args = ["redis-server", "--port", str(BASE_PORT + i), "--save", "", "--appendonly", "no"]
+        if i:
+            args += ["--replicaof", "127.0.0.1", str(BASE_PORT)]
+        servers.append(subprocess.Popen(args, stdout=subprocess.DEVNULL))
+    time.sleep(1)
+    return servers
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def client(router, write_ratio, deadline, results):
+    session = 0
+    while time.monotonic() < deadline:
+        key = f"k:{random.randint(0, 1000)}"
+        write = random.random() < write_ratio
+        start = time.monotonic()
+        ok = True
+        try:
+            if write:
+                session = await router.set(key, "v")
+            else:
+                await router.get(key, session)
+        except Exception:
+            ok = False
+            # the failed requests are not retried at once, like a client backing off
+            await asyncio.sleep(0.01)
+        results.append((start, time.monotonic() - start, write, ok))
+
+
+async def fail_over(servers, failover):
+    servers[0].kill()
+    killed = time.monotonic()
+    await asyncio.sleep(failover)
+
+    new_primary = redis.from_url(f"redis://127.0.0.1:{BASE_PORT + 1}")
+    await new_primary.slaveof()
+    await new_primary.aclose()
+    other = redis.from_url(f"redis://127.0.0.1:{BASE_PORT + 2}")
+    await other.slaveof("127.0.0.1", BASE_PORT + 1)
+    await other.aclose()
+
+    # the ZooKeeper watch calls the router from its own thread
+    hosts = (f"127.0.0.1:{BASE_PORT + 1}", [f"127.0.0.1:{BASE_PORT + 2}", f"127.0.0.1:{BASE_PORT}"])
+    threading.Thread(target=lambda: router_update(hosts)).start()
+    return killed
+
+
+router = None
+
+
+def router_update(hosts):
+    router.update(*hosts)
+
+
+async def run(mode, seconds, concurrency, failover, write_ratio):
+    global router
+    servers = start_servers(3)
+    try:
+        conf = configparser.ConfigParser()
+        conf.read_string("[read]\n" + MODES[mode])
+        router = ReadRouter(conf["read"])
+        router.update(f"127.0.0.1:{BASE_PORT}", [f"127.0.0.1:{BASE_PORT + 1}", f"127.0.0.1:{BASE_PORT + 2}"])
+        router.start()
+        await asyncio.sleep(0.5)
+
+        results = []
+        deadline = time.monotonic() + seconds
+        clients = asyncio.gather(*[client(router, write_ratio, deadline, results) for _ in range(concurrency)])
+        await asyncio.sleep(seconds / 2)
+        killed = await fail_over(servers, failover)
+        await clients
+        await router.stop()
+    finally:
+        for server in servers:
+            server.kill()
+            server.wait()
+
+    before = [r[1] for r in results if r[0] < killed]
+    after = [r[1] for r in results if r[0] >= killed]
+    failed_reads = sum(1 for r in results if not r[3] and not r[2])
+    failed_writes = sum(1 for r in results if not r[3] and r[2])
+    print(f"{mode:>10} {len(results):>9} {failed_reads:>12} {failed_writes:>13} "
+          f"{percentile(before, 0.99) * 1000:>12.1f} {percentile(after, 0.99) * 1000:>11.1f} "
+          f"{max(after) * 1000:>11.1f}")
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    failover = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.7
+    write_ratio = float(sys.argv[4]) if len(sys.argv) > 4 else 0.1
+
+    print(f"{'mode':>10} {'requests':>9} {'failed reads':>12} {'failed writes':>13} "
+          f"{'p99 ms before':>12} {'p99 ms after':>11} {'max ms after':>11}")
+    for mode in MODES:
+        asyncio.run(run(mode, seconds, concurrency, failover, write_ratio))
+
+
+if __name__ == "__main__":
+    main()
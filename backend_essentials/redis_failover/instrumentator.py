@@ -1,4 +1,39 @@
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_client import Counter, Gauge, Histogram
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30)
+
+PROBES = Counter(
+    "redis_monitor_probes_total", "PING probes of the Redis instances", ["node", "result"]
+)
+DETECTION_SECONDS = Histogram(
+    "redis_monitor_detection_seconds", "From the first failed probe of the primary to the quorum agreeing it is down",
+    buckets=LATENCY_BUCKETS
+)
+PROMOTION_SECONDS = Histogram(
+    "redis_monitor_promotion_seconds", "From the quorum agreeing the primary is down to the new primary in ZooKeeper",
+    buckets=LATENCY_BUCKETS
+)
+FAILOVERS = Counter(
+    "redis_monitor_failovers_total", "Replicas promoted by this monitor"
+)
+
+READS = Counter(
+    "redis_reads_total", "Reads by the role of the instance which served them", ["role"]
+)
+READ_FALLBACKS = Counter(
+    "redis_read_fallbacks_total", "Reads sent to the primary although there are replicas", ["reason"]
+)
+READ_RETRIES = Counter(
+    "redis_read_retries_total", "Reads tried once more after a connection error"
+)
+PRIMARY_SWAPS = Counter(
+    "redis_primary_swaps_total", "Connections swapped to a new primary"
+)
+REPLICA_LAG = Gauge(
+    "redis_replica_lag_bytes", "Replication offset of the primary minus the one of the replica", ["replica"]
+)
 
 
 def init_instrumentator(app):
@@ -1,5 +1,5 @@
 from typing import Optional
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Header, Request, Response
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -22,10 +22,17 @@ from cors import init_cors
 from instrumentator import init_instrumentator
 from zoo import init_kazoo
 from config import Config
-from redis_conn import RedisConnection
+from read_router import ReadRouter
 
 
-pconn = None
+SESSION_HEADER = "X-Session-Token"
+
+app = FastAPI()
+
+my_settings = Settings()
+conf = Config(my_settings.CONFIG_PATH)
+g_router = ReadRouter(conf.section("read"))
+
 
 def refresh_storage(data, stat):
     if not data:
@@ -35,19 +42,12 @@ def refresh_storage(data, stat):
     print(data)
     hosts = json.loads(data.decode('utf-8'))
     print(hosts)
-    h1 = hosts["primary"] 
-
-    global pconn
-    pconn = RedisConnection(h1)
+    g_router.update(hosts["primary"], hosts["secondary"])
     print("Finished refresh_storage")
 
 
-app = FastAPI()
-
 ZK_SCRAP_PATH = "/zk/storage/posts"
 
-my_settings = Settings()
-conf = Config(my_settings.CONFIG_PATH)
 init_log(app, conf.section("log")["path"])
 init_cors(app)
 init_instrumentator(app)
@@ -57,6 +57,16 @@ zk = init_kazoo(conf.section("zookeeper")["hosts"], ZK_SCRAP_PATH, refresh_stora
 client = httpx.AsyncClient()
 
 
+@app.on_event("startup")
+async def startup():
+    g_router.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await g_router.stop()
+
+
 @app.exception_handler(UnicornException)
 async def unicorn_exception_handler(request: Request, exc: UnicornException):
     return JSONResponse(
@@ -66,10 +76,12 @@ async def unicorn_exception_handler(request: Request, exc: UnicornException):
 
 
 @app.get("/api/v1/write/{user_id}")
-async def write(user_id: int, value: str):
+async def write(user_id: int, value: str, response: Response):
     try:
         key = f"k:{user_id}"
-        pconn.get_conn().set(key, value)
+        offset = await g_router.set(key, value)
+        # to be sent back on the next reads to see this write
+        response.headers[SESSION_HEADER] = str(offset)
         return {"user_id": user_id, "value": value}
     except Exception as e:
         traceback.print_exc(file=sys.stderr)
@@ -77,10 +89,17 @@ async def write(user_id: int, value: str):
 
 
 @app.get("/api/v1/get/{user_id}")
-async def get(user_id: int):
+async def get(user_id: int, x_session_token: Optional[str] = Header(None)):
+    min_offset = 0
+    if x_session_token:
+        try:
+            min_offset = int(x_session_token)
+        except ValueError:
+            raise UnicornException(status=400, code=-20001, message=f"invalid {SESSION_HEADER}")
+
     try:
         key = f"k:{user_id}"
-        value = pconn.get_conn().get(key)
+        value = await g_router.get(key, min_offset)
         
         result = None
         if value:
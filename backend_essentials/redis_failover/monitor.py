@@ -1,150 +1,288 @@
-import redis
-import os
-import time
+import asyncio
+import functools
 import json
+import os
+import socket
 import sys
+import time
 
-from kazoo.client import KazooClient
-from kazoo.exceptions import NoNodeError
-from kazoo.exceptions import NodeExistsError
+import redis.asyncio as redis
+from kazoo.exceptions import BadVersionError, LockTimeout, NoNodeError, NodeExistsError
+from prometheus_client import start_http_server
 
 from config import Config
+from instrumentator import DETECTION_SECONDS, FAILOVERS, PROBES, PROMOTION_SECONDS
 from zoo import init_kazoo
 
 
-conf = Config(sys.argv[1])
-ZK_PATH = conf.section("zookeeper")["path"]
-print(ZK_PATH)
-primary_addr = None
-
-
-def connect_to_redis(host):
-    try:
-        return redis.from_url(f"redis://{host}/")
-    except Exception as e:
-        print(str(e))
-        return None
-
-
-def set_primary(host):
-    try:
-        rconn = connect_to_redis(host)
-        rconn.slaveof()
-        return rconn
-    except Exception as e:
-        print(str(e))
-        return None
-
-
-def info(conn):
-    try:
-        value = conn.info()
-        return True, value
-    except redis.exceptions.ConnectionError as e:
-        print(str(e))
-        return False, None
-
-
-def set_replicas(primary, hosts):
-    parts = primary.split(":")
-    for h in hosts:
-        rconn = connect_to_redis(h)
-        ok, value = info(rconn)
-        if ok:
-            set_as_replica = False
-            role = value["role"] 
-            if role != "slave":
-                set_as_replica = True
-            else:
-                master_host = value["master_host"]
-                master_port = value["master_port"]
-                master_addr = f"{master_host}:{master_port}"
-
-                if master_addr != primary:
-                    set_as_replica = True
-
-            if set_as_replica:
-                rconn.slaveof(parts[0], int(parts[1]))
-                print(f"set {h} as replica of {primary}")
-
-
-def refresh_node(data, stat):
-    global primary_addr
-    if not data:
-        print("There is no data")
-        return
-
-    hosts = json.loads(data.decode('utf-8'))
-    primary = hosts["primary"]
-
-    primary_addr = primary
-    conn = set_primary(primary)
-    if conn:
-        print(f"Primary Redis is {primary}")
-        set_replicas(primary, hosts["secondary"])
-
-
-zk = init_kazoo(conf.section("zookeeper")["hosts"], ZK_PATH, refresh_node, False)
-
-failure_count = 0
-
-
-def get_good_secondary(hosts):
-    for h in hosts:
-        conn = redis.from_url(f"redis://{h}/")
-        if info(conn)[0]:
-            return h, conn
-    return None, None
-
-
-def get_redis_info_from_zk(path):
-    data = zk.get(ZK_PATH)
-    if not data:
-        return None
-
-    return json.loads(data[0].decode('utf-8'))
-
-
-def monitor():
-    global failure_count
-    global primary_addr
-
-    while True:
-        conn = connect_to_redis(primary_addr)
-        ok, value = info(conn)
-        if ok:
-            failure_count = 0
-            hosts = get_redis_info_from_zk(ZK_PATH)
-            if hosts:
-                if primary_addr == hosts["primary"]:
-                    set_replicas(hosts["primary"], hosts["secondary"])
-
-            time.sleep(10)
-        else:
-            print(f"check: {primary_addr} failure_count: {failure_count}")
-            failure_count += 1
-            if failure_count >= 3:
-                hosts = get_redis_info_from_zk(ZK_PATH)
-                if not hosts:
-                    print("There is no data")
-                    time.sleep(10)
-                    continue
-
-                host, conn = get_good_secondary(hosts["secondary"])
-                if not conn:
-                    print("There is no good secondary", hosts)
-                    time.sleep(10)
-                    continue
-
-                old_p = hosts["primary"]
-                hosts["secondary"].remove(host)
-                hosts["secondary"].append(old_p)
-                hosts["primary"] = host
-
-                set_primary(host)
-                zk.set(ZK_PATH, json.dumps(hosts).encode('utf-8'))
-
-                failure_count = 0
-
-
-monitor()
+class Node:
+    """One Redis instance, probed over a connection kept open between probes."""
+    def __init__(self, addr: str, timeout: float):
+        self.addr = addr
+        self.conn = redis.from_url(f"redis://{addr}/", socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.failures = 0
+        # start of the first failed probe in a row, and when the quorum agreed it is down
+        self.down_since = None
+        self.detected = None
+
+
+class Monitor:
+    """
+    Probes the primary and every replica concurrently with PING, every `probe_interval_ms`.
+
+    After `down_after_failures` failed probes in a row the monitor votes the primary down with an ephemeral znode
+    under `quorum_path`. Once `quorum` monitors voted, the first one to take the ZooKeeper lock writes the replica
+    with the smallest replication lag to `path` as the new primary and then promotes it, unless another monitor has
+    done it already. A monitor which dies takes its vote with it.
+    """
+    def __init__(self, conf, zk_conf):
+        self.id = conf.get("id", fallback=f"{socket.gethostname()}:{os.getpid()}")
+        self.interval = conf.getint("probe_interval_ms", fallback=200) / 1000
+        self.timeout = conf.getint("probe_timeout_ms", fallback=150) / 1000
+        self.down_after = conf.getint("down_after_failures", fallback=3)
+        self.quorum = conf.getint("quorum", fallback=0)
+        self.lock_timeout = conf.getfloat("lock_timeout_seconds", fallback=5)
+        self.reconcile_interval = conf.getfloat("reconcile_interval_seconds", fallback=10)
+
+        self.zk_hosts = zk_conf["hosts"]
+        self.path = zk_conf["path"]
+        self.quorum_path = zk_conf.get("quorum_path", fallback=self.path + "_monitors")
+
+        self.zk = None
+        self.loop = None
+        self.hosts = None
+        self.nodes = {}
+        self.primary_offset = 0
+        self.voted = None
+        self.failing_over = None
+
+    async def zk_call(self, fn, *args, **kwargs):
+        # kazoo blocks, the probes must not wait for ZooKeeper
+        return await self.loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def on_data(self, data, stat):
+        # called from the kazoo thread
+        if not data:
+            print("There is no data")
+            return
+        self.loop.call_soon_threadsafe(self.set_hosts, json.loads(data.decode('utf-8')))
+
+    def set_hosts(self, hosts):
+        self.hosts = hosts
+        addrs = [hosts["primary"]] + hosts["secondary"]
+        for addr in addrs:
+            if addr not in self.nodes:
+                self.nodes[addr] = Node(addr, self.timeout)
+        for addr in list(self.nodes):
+            if addr not in addrs:
+                asyncio.ensure_future(self.nodes.pop(addr).conn.aclose())
+
+        print(f"Primary Redis is {hosts['primary']}")
+        if self.voted and self.voted != hosts["primary"]:
+            asyncio.ensure_future(self.unvote())
+        asyncio.ensure_future(self.reconcile())
+
+    async def reconcile(self):
+        """Makes the Redis instances match ZooKeeper: the primary is not a replica, the others replicate it."""
+        hosts = self.hosts
+        primary = hosts["primary"]
+        try:
+            value = await self.nodes[primary].conn.info("replication")
+            if value["role"] != "master":
+                await self.nodes[primary].conn.slaveof()
+            self.primary_offset = value.get("master_repl_offset", 0)
+        except Exception as e:
+            print(f"reconcile {primary}: {str(e)}")
+            return
+
+        await asyncio.gather(*[self.set_replica(self.nodes[h], primary) for h in hosts["secondary"]])
+
+    async def set_replica(self, node, primary):
+        try:
+            value = await node.conn.info("replication")
+            if value["role"] == "slave" and f"{value['master_host']}:{value['master_port']}" == primary:
+                return
+            host, port = primary.split(":")
+            await node.conn.slaveof(host, int(port))
+            print(f"set {node.addr} as replica of {primary}")
+        except Exception as e:
+            print(f"set_replica {node.addr}: {str(e)}")
+
+    async def probe(self, node):
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(node.conn.ping(), self.timeout)
+        except Exception:
+            PROBES.labels(node.addr, "failure").inc()
+            if node.failures == 0:
+                node.down_since = start
+            node.failures += 1
+            return
+
+        PROBES.labels(node.addr, "success").inc()
+        if node.failures >= self.down_after:
+            print(f"{node.addr} is back after {node.failures} failed probes")
+        node.failures = 0
+        node.down_since = None
+        node.detected = None
+
+    async def required_votes(self) -> int:
+        if self.quorum > 0:
+            return self.quorum
+        monitors = await self.zk_call(self.zk.get_children, f"{self.quorum_path}/monitors")
+        return len(monitors) // 2 + 1
+
+    async def vote(self, addr) -> int:
+        """Votes `addr` down if not done yet, and returns the votes."""
+        path = f"{self.quorum_path}/votes/{addr}"
+        try:
+            votes = await self.zk_call(self.zk.get_children, path)
+        except NoNodeError:
+            votes = []
+
+        # checked on every probe, the vote is lost with the ZooKeeper session
+        if self.id not in votes:
+            try:
+                await self.zk_call(self.zk.create, f"{path}/{self.id}", ephemeral=True, makepath=True)
+            except NodeExistsError:
+                pass
+            votes.append(self.id)
+            if self.voted != addr:
+                print(f"Voted {addr} down")
+            self.voted = addr
+        return len(votes)
+
+    async def unvote(self):
+        addr, self.voted = self.voted, None
+        if not addr:
+            return
+        try:
+            await self.zk_call(self.zk.delete, f"{self.quorum_path}/votes/{addr}/{self.id}")
+        except NoNodeError:
+            pass
+
+    async def check_primary(self):
+        primary = self.nodes.get(self.hosts["primary"])
+        if primary.failures < self.down_after:
+            if self.voted:
+                await self.unvote()
+            return
+
+        votes = await self.vote(primary.addr)
+        required = await self.required_votes()
+        print(f"check: {primary.addr} failures: {primary.failures} votes: {votes}/{required}")
+        if votes < required:
+            return
+
+        if primary.detected is None:
+            primary.detected = time.monotonic()
+            DETECTION_SECONDS.observe(primary.detected - primary.down_since)
+
+        # waiting for the lock must not hold back the probes
+        if not self.failing_over or self.failing_over.done():
+            self.failing_over = asyncio.ensure_future(self.failover(primary))
+
+    async def failover(self, primary):
+        lock = self.zk.Lock(f"{self.quorum_path}/lock", self.id)
+        try:
+            if not await self.zk_call(lock.acquire, timeout=self.lock_timeout):
+                return
+        except LockTimeout:
+            print("Another monitor holds the failover lock")
+            return
+
+        try:
+            data, stat = await self.zk_call(self.zk.get, self.path)
+            hosts = json.loads(data.decode('utf-8'))
+            if hosts["primary"] != primary.addr:
+                # another monitor was faster, its update is on the way through the watch
+                return
+
+            host = await self.pick_replica(hosts["secondary"])
+            if not host:
+                print("There is no good secondary", hosts)
+                return
+
+            hosts["secondary"].remove(host)
+            hosts["secondary"].append(primary.addr)
+            hosts["primary"] = host
+            # the versioned write first, so a lost race promotes nothing; a failed promotion is redone by reconcile
+            await self.zk_call(self.zk.set, self.path, json.dumps(hosts).encode('utf-8'), version=stat.version)
+            try:
+                await self.nodes[host].conn.slaveof()
+            except Exception as e:
+                print(f"promote {host}: {str(e)}")
+
+            PROMOTION_SECONDS.observe(time.monotonic() - primary.detected)
+            FAILOVERS.inc()
+            print(f"Promoted {host}, {primary.addr} is down")
+        except BadVersionError:
+            print("The config changed during the failover, nothing was promoted")
+        except Exception as e:
+            print("Failover failed: ", str(e))
+        finally:
+            await self.zk_call(lock.release)
+
+    async def pick_replica(self, hosts):
+        """The reachable replica with the highest replication offset, so the least writes lost."""
+        async def offset(h):
+            node = self.nodes.get(h)
+            if not node or node.failures:
+                return None
+            try:
+                value = await asyncio.wait_for(node.conn.info("replication"), self.timeout)
+                return value.get("slave_repl_offset", value.get("master_repl_offset", 0))
+            except Exception as e:
+                print(f"pick_replica {h}: {str(e)}")
+                return None
+
+        offsets = await asyncio.gather(*[offset(h) for h in hosts])
+        candidates = [(o, h) for o, h in zip(offsets, hosts) if o is not None]
+        if not candidates:
+            return None
+
+        best, host = max(candidates)
+        print(f"Replica {host} lags {max(0, self.primary_offset - best)} bytes behind the last known primary offset")
+        return host
+
+    async def probe_loop(self):
+        while True:
+            start = self.loop.time()
+            try:
+                if self.hosts:
+                    await asyncio.gather(*[self.probe(node) for node in list(self.nodes.values())])
+                    await self.check_primary()
+            except Exception as e:
+                print("Probe failed: ", str(e))
+            await asyncio.sleep(max(0, self.interval - (self.loop.time() - start)))
+
+    async def reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.register()
+                if self.hosts and not self.voted:
+                    await self.reconcile()
+            except Exception as e:
+                print("Reconcile failed: ", str(e))
+
+    async def register(self):
+        try:
+            await self.zk_call(self.zk.create, f"{self.quorum_path}/monitors/{self.id}", ephemeral=True,
+                               makepath=True)
+            print(f"Registered monitor {self.id}")
+        except NodeExistsError:
+            pass
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.zk = await self.zk_call(init_kazoo, self.zk_hosts, self.path, self.on_data, False)
+        await self.register()
+        await asyncio.gather(self.probe_loop(), self.reconcile_loop())
+
+
+if __name__ == "__main__":
+    conf = Config(sys.argv[1])
+    monitor_conf = conf.section("monitor")
+    start_http_server(monitor_conf.getint("metrics_port", fallback=9400))
+    asyncio.run(Monitor(monitor_conf, conf.section("zookeeper")).run())
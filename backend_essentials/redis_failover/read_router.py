@@ -0,0 +1,228 @@
+import asyncio
+import random
+from contextlib import contextmanager
+from typing import List, Optional
+
+import redis
+
+from instrumentator import PRIMARY_SWAPS, READS, READ_FALLBACKS, READ_RETRIES, REPLICA_LAG
+from redis_conn import RedisConnection
+
+
+class Node:
+    """A Redis instance with its replication offset and the commands in flight on it from this process."""
+    def __init__(self, addr: str):
+        self.addr = addr
+        self.conn = RedisConnection(addr).get_conn()
+        self.offset = 0
+        self.lag = None
+        self.outstanding = 0
+
+    @contextmanager
+    def track(self):
+        self.outstanding += 1
+        try:
+            yield self
+        finally:
+            self.outstanding -= 1
+
+    async def warm(self, count: int):
+        """Opens `count` connections, one per concurrent PING, which stay in the pool."""
+        await asyncio.gather(*[self.conn.ping() for _ in range(count)])
+
+    async def drain(self, seconds: float):
+        """Closes the connections once the commands in flight are done, or after `seconds`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while self.outstanding and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        await self.conn.connection_pool.disconnect()
+        print(f"Closed the connections to {self.addr}")
+
+
+class ReadRouter:
+    """
+    Sends the writes to the primary and the reads to the least loaded replica which is at most `max_lag_bytes`
+    behind the primary.
+
+    The replication offsets are read every `lag_check_interval_ms`. A replica which did not answer has no lag and
+    takes no reads until it answers again. When the primary does not answer, the replicas are compared to its last
+    known offset, so reads keep being served while it is failed over.
+
+    A write returns the offset of the primary right after it. A read given that offset is only sent to a replica
+    which has replicated it, so a client reads its own writes.
+
+    `update` is called from the ZooKeeper watch thread. Once the router runs, a new primary gets
+    `warm_connections` connections opened before the swap, so the requests after it do not pay for the connects.
+    The primary and the replicas are then swapped together as one tuple, and the instances which left are closed
+    once their commands in flight are done. A read failing on the primary waits up to `retry_wait_ms` for a swap and
+    is tried once more, a read failing on a replica is tried once more elsewhere. Writes are not retried.
+    """
+    def __init__(self, conf):
+        self.max_lag_bytes = conf.getint("max_lag_bytes", fallback=65536)
+        self.interval = conf.getint("lag_check_interval_ms", fallback=100) / 1000
+        self.timeout = conf.getint("lag_check_timeout_ms", fallback=500) / 1000
+        self.replica_reads = conf.getboolean("replica_reads", fallback=True)
+        self.warm_connections = conf.getint("warm_connections", fallback=8)
+        self.warm_timeout = conf.getint("warm_timeout_ms", fallback=1000) / 1000
+        self.drain_seconds = conf.getfloat("drain_seconds", fallback=5)
+        self.retry_wait = conf.getint("retry_wait_ms", fallback=3000) / 1000
+
+        self.state = (None, [])
+        self.primary_offset = 0
+        self.task = None
+        self.loop = None
+        self.pending = None
+        self.swap_lock = None
+        self.swapped = None
+
+    def update(self, primary: str, secondaries: List[str]):
+        if not self.loop:
+            self.apply(self.nodes(primary, secondaries))
+            return
+
+        # only the latest config matters when several arrive during a swap
+        self.pending = (primary, secondaries)
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.swap()))
+
+    def nodes(self, primary: str, secondaries: List[str]):
+        old_primary, old_replicas = self.state
+        nodes = {n.addr: n for n in old_replicas}
+        if old_primary:
+            nodes[old_primary.addr] = old_primary
+        return nodes.get(primary) or Node(primary), [nodes.get(addr) or Node(addr) for addr in secondaries]
+
+    def apply(self, state):
+        primary, replicas = state
+        old_primary = self.state[0]
+        if not old_primary or old_primary.addr != primary.addr:
+            # the offsets were of the old primary
+            for node in replicas:
+                node.lag = None
+        self.state = state
+
+    async def swap(self):
+        async with self.swap_lock:
+            if not self.pending:
+                return
+            state, self.pending = self.nodes(*self.pending), None
+
+            old = [self.state[0]] + self.state[1] if self.state[0] else []
+            primary = state[0]
+            changed = not old or old[0] is not primary
+            if changed and self.warm_connections:
+                try:
+                    await asyncio.wait_for(primary.warm(self.warm_connections), self.warm_timeout)
+                except Exception as e:
+                    print(f"warm {primary.addr}: {str(e)}")
+
+            self.apply(state)
+            if changed:
+                PRIMARY_SWAPS.inc()
+                print(f"Primary Redis is {primary.addr}")
+                swapped, self.swapped = self.swapped, asyncio.Event()
+                swapped.set()
+
+            kept = [state[0]] + state[1]
+            for node in old:
+                if all(node is not n for n in kept):
+                    asyncio.ensure_future(node.drain(self.drain_seconds))
+
+    def primary(self) -> Node:
+        primary = self.state[0]
+        if not primary:
+            raise Exception("There is no primary")
+        return primary
+
+    def pick(self, min_offset: int = 0) -> Node:
+        primary, replicas = self.state
+        if not self.replica_reads or not replicas:
+            return self.primary()
+
+        fresh = [n for n in replicas if n.lag is not None and n.lag <= self.max_lag_bytes]
+        candidates = [n for n in fresh if n.offset >= min_offset]
+        if not candidates:
+            READ_FALLBACKS.labels("session" if fresh else "lag").inc()
+            return self.primary()
+
+        least = min(n.outstanding for n in candidates)
+        return random.choice([n for n in candidates if n.outstanding == least])
+
+    async def get(self, key: str, min_offset: int = 0):
+        swapped = self.swapped
+        node = self.pick(min_offset)
+        try:
+            return await self.read(node, key)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            print(f"read {node.addr}: {str(e)}")
+
+        READ_RETRIES.inc()
+        if node is self.state[0] and swapped:
+            try:
+                await asyncio.wait_for(swapped.wait(), self.retry_wait)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # out of the reads until the next lag check finds it again
+            node.lag = None
+        return await self.read(self.pick(min_offset), key)
+
+    async def read(self, node: Node, key: str):
+        READS.labels("primary" if node is self.state[0] else "replica").inc()
+        with node.track():
+            return await node.conn.get(key)
+
+    async def set(self, key: str, value: str) -> int:
+        """Sets `key` on the primary and returns the replication offset of the write."""
+        node = self.primary()
+        with node.track():
+            pipe = node.conn.pipeline(transaction=False)
+            pipe.set(key, value)
+            pipe.execute_command("ROLE")
+            _, role = await pipe.execute()
+        return role[1]
+
+    async def replication(self, node: Node) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(node.conn.info("replication"), self.timeout)
+        except Exception as e:
+            print(f"replication {node.addr}: {str(e)}")
+            return None
+
+    async def check(self):
+        primary, replicas = self.state
+        if not primary:
+            return
+
+        values = await asyncio.gather(*[self.replication(n) for n in [primary] + replicas])
+        if values[0]:
+            self.primary_offset = values[0]["master_repl_offset"]
+
+        for node, value in zip(replicas, values[1:]):
+            if value is None or value["role"] != "slave":
+                node.lag = None
+                REPLICA_LAG.labels(node.addr).set(-1)
+                continue
+            node.offset = value["slave_repl_offset"]
+            node.lag = max(0, self.primary_offset - node.offset)
+            REPLICA_LAG.labels(node.addr).set(node.lag)
+
+    async def run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                print("Lag check failed: ", str(e))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.swap_lock = asyncio.Lock()
+        self.swapped = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.loop = None
@@ -10,6 +10,7 @@ import httpx
 from bs4 import BeautifulSoup
 
 import urllib.parse
+import json
 
 from exceptions import UnicornException
 from settings import Settings
@@ -79,11 +80,27 @@ async def scrap(url: str):
     except Exception as e:
         raise UnicornException(status=400, code=-20000, message=str(e))
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def service_metadata():
+    """What the callers need to route to this server, published as the data of its znode."""
+    service = conf.section("service")
+    return {
+        "weight": service.getfloat("weight", fallback=1),
+        "zone": service.get("zone", fallback=None),
+        "capacity": service.getint("capacity", fallback=None),
+        "version": service.get("version", fallback=None),
+    }
+
+
 def register_into_service_discovery(endpoint):
     node_path = f"{ZK_SCRAP_PATH}/{endpoint}"
     if zk.exists(node_path):
         zk.delete(node_path)
-    zk.create(node_path, ephemeral=True, makepath=True)
+    zk.create(node_path, json.dumps(service_metadata()).encode('utf-8'), ephemeral=True, makepath=True)
 
 @app.on_event("startup")
 def startup():
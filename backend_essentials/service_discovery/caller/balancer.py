@@ -0,0 +1,197 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from instrumentator import ZONE_SPILLOVERS
+
+# cost of an endpoint with requests in flight but no latency observed yet, so that it is not flooded
+PENALTY = 1e6
+
+
+class EndpointStats:
+    """Requests in flight and peak-EWMA latency of one endpoint, as seen from this process."""
+    def __init__(self, endpoint: str, decay_seconds: float = 10.0, failure_penalty: float = 1.0, detector=None):
+        self.endpoint = endpoint
+        self.decay_seconds = decay_seconds
+        self.failure_penalty = failure_penalty
+        self.detector = detector
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.stamp = time.monotonic()
+
+        # outlier detection
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+        # published by the server in its znode
+        self.weight = 1.0
+        self.zone = None
+        self.capacity = None
+        self.version = None
+        # smooth weighted round robin
+        self.current_weight = 0.0
+
+    def apply_metadata(self, meta):
+        self.weight = meta.weight
+        self.zone = meta.zone
+        self.capacity = meta.capacity
+        self.version = meta.version
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def observe(self, rtt: float):
+        now = time.monotonic()
+        if rtt > self.ewma:
+            # peak: a latency spike is taken at once and forgotten slowly
+            self.ewma = rtt
+        else:
+            w = math.exp(-(now - self.stamp) / self.decay_seconds)
+            self.ewma = self.ewma * w + rtt * (1 - w)
+        self.stamp = now
+
+    def cost(self) -> float:
+        # decays towards zero while unused, so a slow endpoint gets tried again after a while
+        w = math.exp(-(time.monotonic() - self.stamp) / self.decay_seconds)
+        ewma = self.ewma * w
+        if ewma == 0.0 and self.outstanding:
+            return PENALTY + self.outstanding
+        return ewma * (self.outstanding + 1)
+
+    @contextmanager
+    def track(self):
+        self.outstanding += 1
+        start = time.monotonic()
+        try:
+            yield self
+        except Exception as e:
+            # an endpoint failing fast must not look fast
+            self.observe(max(time.monotonic() - start, self.failure_penalty))
+            if self.detector:
+                self.detector.report(self, e)
+            raise
+        else:
+            self.observe(time.monotonic() - start)
+            if self.detector:
+                self.detector.report(self, None)
+        finally:
+            self.outstanding -= 1
+
+
+class Balancer:
+    """
+    Picks the endpoint of the next request.
+
+    `update` is called from the ZooKeeper watch thread while `pick` runs on the event loop, so the endpoint list
+    and its stats are swapped together as one tuple. Endpoints which stay keep their stats, and the requests in
+    flight on a removed endpoint finish on stats nobody reads anymore.
+    """
+    def __init__(self, decay_seconds: float = 10.0, failure_penalty: float = 1.0, detector=None,
+                 zone: Optional[str] = None, spillover_threshold: float = 0.8):
+        self.decay_seconds = decay_seconds
+        self.failure_penalty = failure_penalty
+        self.detector = detector
+        self.zone = zone
+        self.spillover_threshold = spillover_threshold
+        self.state = ([], {})
+        if detector:
+            detector.balancer = self
+
+    def update(self, endpoints: List[str], metadata=None):
+        _, old_stats = self.state
+        stats: Dict[str, EndpointStats] = {}
+        for endpoint in endpoints:
+            stats[endpoint] = old_stats.get(endpoint) or EndpointStats(endpoint, self.decay_seconds,
+                                                                       self.failure_penalty, self.detector)
+            if metadata:
+                stats[endpoint].apply_metadata(metadata.get(endpoint))
+        self.state = ([stats[endpoint] for endpoint in endpoints], stats)
+        if self.detector:
+            self.detector.update_gauges()
+
+    def set_metadata(self, endpoint: str, meta):
+        stats = self.state[1].get(endpoint)
+        if stats:
+            stats.apply_metadata(meta)
+
+    def endpoints(self) -> List[str]:
+        return [s.endpoint for s in self.state[0]]
+
+    def prefer_zone(self, candidates: List[EndpointStats]) -> List[EndpointStats]:
+        """The servers of our zone, or every server when our zone has none or is saturated."""
+        if not self.zone:
+            return candidates
+
+        local = [s for s in candidates if s.zone == self.zone]
+        if not local or len(local) == len(candidates):
+            return candidates
+
+        # a server without a published capacity is never saturated
+        if all(s.capacity for s in local):
+            capacity = sum(s.capacity for s in local)
+            if sum(s.outstanding for s in local) >= capacity * self.spillover_threshold:
+                ZONE_SPILLOVERS.inc()
+                return candidates
+        return local
+
+    def pick(self) -> EndpointStats:
+        candidates = self.state[0]
+        if not candidates:
+            raise Exception("There is no endpoint")
+        if self.detector:
+            candidates = self.detector.available(candidates)
+        return self.choose(self.prefer_zone(candidates))
+
+    def choose(self, candidates: List[EndpointStats]) -> EndpointStats:
+        raise NotImplementedError
+
+
+class RoundRobinBalancer(Balancer):
+    """Smooth weighted round robin, every endpoint in turn when the weights are equal."""
+    def choose(self, candidates):
+        total = 0.0
+        best = None
+        for stats in candidates:
+            stats.current_weight += stats.weight
+            total += stats.weight
+            if best is None or stats.current_weight > best.current_weight:
+                best = stats
+        best.current_weight -= total
+        return best
+
+
+class LeastOutstandingBalancer(Balancer):
+    """The endpoint with the fewest requests in flight for its weight, ties broken at random."""
+    def choose(self, candidates):
+        least = min((s.outstanding + 1) / s.weight for s in candidates)
+        return random.choice([s for s in candidates if (s.outstanding + 1) / s.weight == least])
+
+
+class P2CEwmaBalancer(Balancer):
+    """
+    Power of two choices: the cheaper of two endpoints drawn in proportion to their weight, by peak-EWMA
+    latency times load.
+    """
+    def choose(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.choices(candidates, weights=[s.weight for s in candidates], k=2)
+        if a is b:
+            b = random.choice(candidates)
+        return a if a.cost() <= b.cost() else b
+
+
+STRATEGIES = {
+    "round_robin": RoundRobinBalancer,
+    "least_outstanding": LeastOutstandingBalancer,
+    "p2c_ewma": P2CEwmaBalancer,
+}
+
+
+def create_balancer(strategy: str, **kwargs) -> Balancer:
+    if strategy not in STRATEGIES:
+        raise Exception(f"Unknown balancer strategy: {strategy}")
+    return STRATEGIES[strategy](**kwargs)
@@ -0,0 +1,90 @@
+"""
+Latency of the balancing strategies over simulated backends, one of them 10 times slower than the others.
+
+    python benchmark.py [requests per second] [seconds] [backends]
+
+Every backend serves `WORKERS` requests at once and queues the others, with exponentially distributed service
+times. Requests arrive at a constant rate (open loop) and each strategy runs the same load. It prints the latency
+percentiles and the share of requests sent to the slow backend.
+"""
+import sys
+import time
+import random
+import asyncio
+
+from balancer import STRATEGIES, create_balancer
+
+WORKERS = 8
+SERVICE_TIME = 0.01
+SLOW_FACTOR = 10
+
+
+class Backend:
+    def __init__(self, name, service_time):
+        self.name = name
+        self.service_time = service_time
+        self.workers = asyncio.Semaphore(WORKERS)
+        self.requests = 0
+
+    async def call(self):
+        self.requests += 1
+        async with self.workers:
+            await asyncio.sleep(random.expovariate(1 / self.service_time))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(strategy, rate, seconds, count):
+    random.seed(1)
+    backends = {f"10.0.0.{i}:7002": Backend(f"10.0.0.{i}:7002", SERVICE_TIME) for i in range(count)}
+    slow = list(backends.values())[0]
+    slow.service_time = SERVICE_TIME * SLOW_FACTOR
+
+    balancer = create_balancer(strategy, decay_seconds=1.0)
+    balancer.update(list(backends))
+
+    latencies = []
+    tasks = set()
+
+    async def request():
+        start = time.monotonic()
+        stats = balancer.pick()
+        with stats.track():
+            await backends[stats.endpoint].call()
+        latencies.append(time.monotonic() - start)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    sent = 0
+    while loop.time() - start < seconds:
+        due = int((loop.time() - start) * rate) + 1
+        for _ in range(due - sent):
+            task = asyncio.ensure_future(request())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        sent = due
+        await asyncio.sleep(0.001)
+
+    await asyncio.gather(*tasks)
+
+    print(f"{strategy:<18} p50={percentile(latencies, 0.5) * 1000:>6.1f}ms p90={percentile(latencies, 0.9) * 1000:>6.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:>7.1f}ms p999={percentile(latencies, 0.999) * 1000:>7.1f}ms "
+          f"slow backend={slow.requests / len(latencies):.1%}")
+
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    print(f"rate={rate:.0f}/s backends={count} service={SERVICE_TIME * 1000:.0f}ms, "
+          f"one at {SERVICE_TIME * SLOW_FACTOR * 1000:.0f}ms, {WORKERS} workers each")
+    for strategy in STRATEGIES:
+        asyncio.run(run(strategy, rate, seconds, count))
+
+
+if __name__ == "__main__":
+    main()
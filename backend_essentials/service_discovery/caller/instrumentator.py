@@ -1,4 +1,25 @@
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_client import Counter, Gauge
+
+
+ENDPOINTS = Gauge(
+    "sd_endpoints", "Scrap servers registered in ZooKeeper"
+)
+ENDPOINTS_EJECTED = Gauge(
+    "sd_endpoints_ejected", "Scrap servers currently ejected by the outlier detection"
+)
+EJECTIONS = Counter(
+    "sd_ejections_total", "Ejections of a scrap server", ["endpoint", "reason"]
+)
+EJECTIONS_SKIPPED = Counter(
+    "sd_ejections_skipped_total", "Ejections not made because of the max ejection percent"
+)
+HEALTH_CHECKS = Counter(
+    "sd_health_checks_total", "Health checks of the scrap servers", ["endpoint", "result"]
+)
+ZONE_SPILLOVERS = Counter(
+    "sd_zone_spillovers_total", "Requests sent out of the local zone because it was saturated"
+)
 
 
 def init_instrumentator(app):
@@ -13,26 +13,38 @@ from settings import Settings
 from log import init_log
 from cors import init_cors
 from instrumentator import init_instrumentator
-from zoo import init_kazoo
+from zoo import init_kazoo, get_kazoo
 from config import Config
+from balancer import create_balancer
+from outlier import OutlierDetector
+from metadata import MetadataCache
 
 
-scrap_endpoints = []
+app = FastAPI()
+my_settings = Settings()
+conf = Config(my_settings.CONFIG_PATH)
+
+ZK_SCRAP_PATH = "/zk/services/scrap/nodes"
+
+balancer_conf = conf.section("balancer")
+g_detector = OutlierDetector(conf.section("outlier"))
+g_balancer = create_balancer(balancer_conf.get("strategy", fallback="p2c_ewma"),
+                             decay_seconds=balancer_conf.getfloat("decay_seconds", fallback=10),
+                             failure_penalty=balancer_conf.getfloat("failure_penalty", fallback=1),
+                             detector=g_detector,
+                             zone=balancer_conf.get("zone", fallback=None) or None,
+                             spillover_threshold=balancer_conf.getfloat("spillover_threshold", fallback=0.8))
+g_metadata = MetadataCache(ZK_SCRAP_PATH, g_balancer.set_metadata)
 
 def refresh_scrap(children):
-    global scrap_endpoints
-    scrap_endpoints = children
+    # the first call comes from init_kazoo itself, so the client is not returned yet
+    g_metadata.watch(get_kazoo(), children)
+    g_balancer.update(children, g_metadata)
     for child in children:
         print(child)
     print("Finished refresh_scrap")
 
 
-app = FastAPI()
-my_settings = Settings()
-conf = Config(my_settings.CONFIG_PATH)
-
-ZK_SCRAP_PATH = "/zk/services/scrap/nodes"
-
 init_log(app, conf.section("log")["path"])
 init_cors(app)
 init_instrumentator(app)
@@ -41,6 +53,16 @@ zk = init_kazoo(conf.section("zookeeper")["hosts"], ZK_SCRAP_PATH, refresh_scrap
 client = httpx.AsyncClient()
 
 
+@app.on_event("startup")
+async def startup():
+    g_detector.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await g_detector.stop()
+
+
 @app.exception_handler(UnicornException)
 async def unicorn_exception_handler(request: Request, exc: UnicornException):
     return JSONResponse(
@@ -49,22 +71,23 @@ async def unicorn_exception_handler(request: Request, exc: UnicornException):
     )
 
 
-next_idx = 0
-
 async def call_api(url: str):
-    global next_idx
-    length = len(scrap_endpoints)
-    if length == 0:
+    try:
+        stats = g_balancer.pick()
+    except Exception:
         raise UnicornException(code=-20003, status=500, message="No Scrap Server exist")
 
-    if next_idx >= length:
-        next_idx = 0
-
-    endpoint = scrap_endpoints[next_idx]
-    next_idx += 1
+    endpoint = stats.endpoint
     encoded_url = urllib.parse.quote(url)
     url = f"http://{endpoint}/api/v1/scrap?url={encoded_url}"
-    r = await client.get(url)
+    try:
+        with stats.track():
+            r = await client.get(url)
+            # a server answering 5xx is failing, as for the health checks
+            if r.status_code >= 500:
+                raise Exception(f"status {r.status_code}")
+    except Exception as e:
+        raise UnicornException(code=-20004, status=502, message=f"{endpoint}: {str(e)}")
     return endpoint, r.text
     
 
@@ -78,6 +101,10 @@ async def get_post(url: str):
 
 @app.get("/list")
 async def list():
-    global scrap_endpoints
-    return scrap_endpoints
+    return g_balancer.endpoints()
+
+
+@app.get("/list/metadata")
+async def list_metadata():
+    return {endpoint: vars(g_metadata.get(endpoint)) for endpoint in g_balancer.endpoints()}
 
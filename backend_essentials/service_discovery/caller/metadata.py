@@ -0,0 +1,72 @@
+import json
+from typing import Dict, Optional
+
+
+class Metadata:
+    """What a scrap server publishes in its znode. Servers registered without data get the defaults."""
+    def __init__(self, weight: float = 1.0, zone: Optional[str] = None, capacity: Optional[int] = None,
+                 version: Optional[str] = None):
+        self.weight = weight if weight and weight > 0 else 1.0
+        self.zone = zone
+        self.capacity = capacity
+        self.version = version
+
+    @classmethod
+    def parse(cls, data: Optional[bytes]) -> "Metadata":
+        if not data:
+            return cls()
+        try:
+            meta = json.loads(data.decode('utf-8'))
+            return cls(float(meta.get("weight") or 1), meta.get("zone"), meta.get("capacity"), meta.get("version"))
+        except Exception as e:
+            print("Invalid metadata: ", str(e))
+            return cls()
+
+
+class MetadataCache:
+    """
+    The metadata of every scrap server, kept up to date by one DataWatch per znode.
+
+    `watch` is called with the children of every ChildrenWatch event. A DataWatch keeps watching through a deletion
+    of its znode, so a server which leaves and registers again keeps the DataWatch it had, and one is only created
+    for a child without any. A DataWatch stops once its znode is deleted while the child is not in the children
+    anymore.
+    """
+    def __init__(self, path: str, on_change):
+        self.path = path
+        self.on_change = on_change
+        self.metadata: Dict[str, Metadata] = {}
+        self.watched = set()
+        # children with a DataWatch, which may have left
+        self.watches = set()
+
+    def get(self, endpoint: str) -> Metadata:
+        return self.metadata.get(endpoint) or Metadata()
+
+    def watch(self, zk, children):
+        joined = set(children) - self.watched
+        self.watched = set(children)
+
+        for child in joined:
+            if child not in self.watches:
+                self.watches.add(child)
+                self.watch_node(zk, child)
+            elif child in self.metadata:
+                # its znode came back before the children did
+                self.on_change(child, self.metadata[child])
+
+    def watch_node(self, zk, child):
+        @zk.DataWatch(f"{self.path}/{child}")
+        def watch_data(data, stat):
+            if stat is None:
+                self.metadata.pop(child, None)
+                if child not in self.watched:
+                    self.watches.discard(child)
+                    return False
+                # deleted, it may come back
+                return
+
+            meta = Metadata.parse(data)
+            self.metadata[child] = meta
+            if child in self.watched:
+                self.on_change(child, meta)
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+
+from instrumentator import EJECTIONS, EJECTIONS_SKIPPED, ENDPOINTS, ENDPOINTS_EJECTED, HEALTH_CHECKS
+
+
+class OutlierDetector:
+    """
+    Takes endpoints out of the balancer while they fail, even though their znode still exists.
+
+    An endpoint is ejected after `consecutive_failures` failed requests or health checks in a row, for
+    `base_ejection_seconds` times 2 to the number of its previous ejections, up to `max_ejection_seconds`. The
+    count goes down by one every health check interval where it is healthy. At most `max_ejection_percent` of the
+    endpoints are ejected at once and never the last one, so the pool is never empty.
+
+    The health checks request `health_path` on every endpoint concurrently, so a hung process is ejected even
+    when no request is sent to it.
+    """
+    def __init__(self, conf):
+        self.consecutive_failures = conf.getint("consecutive_failures", fallback=5)
+        self.base_ejection_seconds = conf.getfloat("base_ejection_seconds", fallback=30)
+        self.max_ejection_seconds = conf.getfloat("max_ejection_seconds", fallback=300)
+        self.max_ejection_percent = conf.getfloat("max_ejection_percent", fallback=50)
+        self.health_interval_seconds = conf.getfloat("health_interval_seconds", fallback=5)
+        self.health_timeout_seconds = conf.getfloat("health_timeout_seconds", fallback=1)
+        self.health_path = conf.get("health_path", fallback="/health")
+
+        self.balancer = None
+        self.task = None
+
+    def pool(self):
+        return self.balancer.state[0] if self.balancer else []
+
+    def available(self, candidates) -> List:
+        now = time.monotonic()
+        healthy = [s for s in candidates if not s.ejected(now)]
+        return healthy if healthy else candidates
+
+    def max_ejected(self, size: int) -> int:
+        if size <= 1:
+            return 0
+        return min(size - 1, max(1, int(size * self.max_ejection_percent / 100)))
+
+    def report(self, stats, error: Optional[BaseException], reason: Optional[str] = None):
+        if error is None:
+            stats.consecutive_failures = 0
+            return
+
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self.consecutive_failures and not stats.ejected(time.monotonic()):
+            if reason is None:
+                reason = "timeout" if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)) else "failure"
+            self.eject(stats, reason)
+
+    def eject(self, stats, reason: str):
+        now = time.monotonic()
+        pool = self.pool()
+        ejected = sum(1 for s in pool if s.ejected(now))
+        if ejected >= self.max_ejected(len(pool)):
+            print(f"Not ejecting {stats.endpoint}, {ejected} of {len(pool)} endpoints are ejected already")
+            EJECTIONS_SKIPPED.inc()
+            return
+
+        duration = min(self.base_ejection_seconds * 2 ** stats.ejections, self.max_ejection_seconds)
+        stats.ejections += 1
+        stats.ejected_until = now + duration
+        stats.consecutive_failures = 0
+        print(f"Ejected {stats.endpoint} for {duration}s: {reason}")
+        EJECTIONS.labels(stats.endpoint, reason).inc()
+        self.update_gauges()
+
+    def update_gauges(self):
+        now = time.monotonic()
+        pool = self.pool()
+        ENDPOINTS.set(len(pool))
+        ENDPOINTS_EJECTED.set(sum(1 for s in pool if s.ejected(now)))
+
+    async def check(self, client, stats):
+        try:
+            r = await client.get(f"http://{stats.endpoint}{self.health_path}")
+            if r.status_code >= 500:
+                raise Exception(f"status {r.status_code}")
+        except Exception as e:
+            HEALTH_CHECKS.labels(stats.endpoint, "failure").inc()
+            self.report(stats, e, "health_check")
+            return
+
+        HEALTH_CHECKS.labels(stats.endpoint, "success").inc()
+        self.report(stats, None)
+        if stats.ejections and not stats.ejected(time.monotonic()):
+            stats.ejections -= 1
+
+    async def run(self):
+        async with httpx.AsyncClient(timeout=self.health_timeout_seconds) as client:
+            while True:
+                try:
+                    await asyncio.gather(*[self.check(client, stats) for stats in self.pool()])
+                    self.update_gauges()
+                except Exception as e:
+                    print("Health check failed: ", str(e))
+                await asyncio.sleep(self.health_interval_seconds)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
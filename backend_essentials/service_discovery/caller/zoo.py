@@ -30,3 +30,6 @@ def init_kazoo(hosts, data_path, callback, children=True):
                     _callback(data, stat)
 
     return _zk
+
+def get_kazoo():
+    return _zk
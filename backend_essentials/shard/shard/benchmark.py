@@ -0,0 +1,79 @@
+"""
+Latency of PostService.list before (ZREVRANGEBYSCORE, HMGET and DELETE round trips) and after (one Lua script)
+against a local Redis.
+
+    python benchmark.py [redis host:port] [iterations]
+"""
+import sys
+import time
+
+import redis
+
+from post import PostService
+
+
+def list_legacy(conn, user_id, limit=10, last=-1):
+    if last == -1:
+        last = "+inf"
+
+    key = f"key:{user_id}"
+    values = conn.zrevrangebyscore(key, last, "-inf", start=0, num=limit+1)
+
+    next_id = None
+    if len(values) == limit+1:
+        next_id = values[-1].decode('utf-8')
+
+    results = [v.decode('utf-8') for v in values[:limit]]
+    post_key = f"p:{user_id}"
+    posts_raw = conn.hmget(post_key, results)
+
+    unexisted_keys = []
+    posts = []
+    for data in zip(results, posts_raw):
+        if data[1]:
+            posts.append({"post_id": data[0], "contents": data[1]})
+        else:
+            unexisted_keys.append(data[0])
+
+    if len(unexisted_keys) > 0:
+        conn.zrem(key, *unexisted_keys)
+
+    return (posts, next_id)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(name, fn, iterations):
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    print(f"{name:<8} p50={percentile(latencies, 0.5):8.1f}us p99={percentile(latencies, 0.99):8.1f}us")
+
+
+def main():
+    host = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1:6379"
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    conn = redis.StrictRedis(connection_pool=redis.ConnectionPool.from_url(f"redis://{host}"))
+    service = PostService()
+
+    users = 100
+    for user_id in range(users):
+        for post_id in range(1, 101):
+            service.write(conn, f"bench{user_id}", post_id, f"post {post_id} of {user_id}")
+
+    measure("legacy", lambda i: list_legacy(conn, f"bench{i % users}", 10, 100 - i % 90), iterations)
+    measure("script", lambda i: service.list(conn, f"bench{i % users}", 10, 100 - i % 90), iterations)
+
+    for user_id in range(users):
+        conn.delete(f"key:bench{user_id}", f"p:bench{user_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import heapq
+import asyncio
+
+
+MAX_LIMIT = 100
+
+
+def encode_cursor(score, user_id):
+    return f"{score}:{user_id}"
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+
+    score, user_id = cursor.split(':')
+    return int(score), int(user_id)
+
+
+def before_cursor(item, cursor):
+    # items are ordered by (score, user_id) descending
+    return cursor is None or (item[0], item[1]) < cursor
+
+
+class FeedService:
+    """
+    Scatter-gather reads of many users' posts over the range shards.
+
+    User ids are grouped by shard, every shard reads all of its users with one pipelined round trip for the post ids
+    and one for the contents, shards are read concurrently with a per-shard timeout, and the per-user lists
+    (already sorted by score) are combined with a k-way heap merge.
+    """
+    def __init__(self, shard_timeout=0.5):
+        self.shard_timeout = shard_timeout
+
+    @staticmethod
+    def max_score(user_id, cursor):
+        if cursor is None:
+            return "+inf"
+        # the posts of the cursor's score only come after it for the users ordered below its user
+        return cursor[0] if user_id < cursor[1] else f"({cursor[0]}"
+
+    async def read_shard(self, conn, user_ids, limit, cursor):
+        # limit + 1 per user, so the merge sees whether there is a next page even when one user fills it
+        async with conn.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrevrangebyscore(f"key:{user_id}", self.max_score(user_id, cursor), "-inf",
+                                      start=0, num=limit+1, withscores=True)
+            ranges = await pipe.execute()
+
+        lists = []
+        async with conn.pipeline(transaction=False) as pipe:
+            for user_id, values in zip(user_ids, ranges):
+                items = [(int(score), user_id, v.decode('utf-8')) for v, score in values]
+                items = [item for item in items if before_cursor(item, cursor)][:limit+1]
+                lists.append(items)
+                pipe.hmget(f"p:{user_id}", [item[2] for item in items] or ["-"])
+            contents = await pipe.execute()
+
+        results = []
+        for items, posts_raw in zip(lists, contents):
+            results.append([(score, user_id, post_id, raw.decode('utf-8'))
+                            for (score, user_id, post_id), raw in zip(items, posts_raw) if raw])
+
+        return results
+
+    async def read_shard_with_timeout(self, manager, host, user_ids, limit, cursor):
+        try:
+            conn = manager.get_async_conn_by_host(host)
+            return host, await asyncio.wait_for(self.read_shard(conn, user_ids, limit, cursor), self.shard_timeout)
+        except Exception as e:
+            print(f"Feed read from {host} failed: {type(e).__name__} {e}")
+            return host, None
+
+    async def feed(self, manager, user_ids, limit=10, cursor=None):
+        """
+        Returns (posts, next_cursor, partial_hosts). Posts of shards that timed out or failed are missing
+        from the page and their hosts are listed in partial_hosts.
+        """
+        if limit < 1 or limit > MAX_LIMIT:
+            raise Exception(f"limit should be between 1 and {MAX_LIMIT}")
+
+        cursor = decode_cursor(cursor)
+        shards = manager.get_shards_for(list(dict.fromkeys(user_ids)))
+        shards.pop(None, None)
+
+        tasks = [self.read_shard_with_timeout(manager, host, ids, limit, cursor) for host, ids in shards.items()]
+
+        lists = []
+        partial = []
+        for host, results in await asyncio.gather(*tasks):
+            if results is None:
+                partial.append(host)
+            else:
+                lists.extend(results)
+
+        merged = heapq.merge(*lists, key=lambda item: (item[0], item[1]), reverse=True)
+        page = []
+        for item in merged:
+            page.append(item)
+            if len(page) == limit + 1:
+                break
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1][0], page[-1][1])
+
+        posts = [{"user_id": user_id, "post_id": post_id, "contents": contents}
+                 for score, user_id, post_id, contents in page]
+        return posts, next_cursor, partial
@@ -1,5 +1,5 @@
-from typing import Optional
-from fastapi import FastAPI, Request
+from typing import Optional, List
+from fastapi import FastAPI, Request, Query
 from fastapi.responses import JSONResponse
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -9,7 +9,8 @@ from exceptions import UnicornException
 from model import Post
 from shard import RangeShardPolicy, RangeShardManager
 from utils import range_config_to_range_infos
-from post import PostService
+from post import PostService, StaleSweeper
+from feed import FeedService, MAX_LIMIT
 
 from log import init_log
 from cors import init_cors
@@ -31,6 +32,7 @@ def refresh_shard_range(data, stat):
         print("There is no data")
         return
 
+    # the range index is validated and built here on the kazoo watcher thread, never on the request path
     try:
         infos = range_config_to_range_infos(data)
         policy = RangeShardPolicy(infos)
@@ -47,11 +49,12 @@ def refresh_shard_range(data, stat):
 app = FastAPI()
 
 
-g_post_service = PostService()
+g_post_service = PostService(StaleSweeper().start())
 
 my_settings = Settings()
 
 conf = Config(my_settings.CONFIG_PATH)
+g_feed_service = FeedService(float(conf.section("feed")["shard_timeout"]))
 init_log(app, conf.section("log")["path"])
 init_cors(app)
 init_instrumentator(app)
@@ -79,6 +82,20 @@ async def lists(user_id: int, last: int = -1, limit: int = 10):
     return {"data": values, "next": next_id}
 
 
+@app.get("/api/v1/feed/")
+async def feed(user_id: List[int] = Query([]), limit: int = 10, cursor: Optional[str] = None):
+    if limit < 1:
+        raise UnicornException(400, -10004, "limit should be at least 1")
+    limit = min(limit, MAX_LIMIT)
+
+    try:
+        values, next_cursor, partial = await g_feed_service.feed(g_shardmanager, user_id, limit, cursor)
+        return {"data": values, "next": next_cursor, "partial": partial}
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        raise UnicornException(400, -10003, str(e))
+
+
 @app.get("/api/v1/posts/{user_id}/{post_id}")
 async def get_post(user_id: int, post_id: int):
     conn = get_conn_from_shard(user_id)
@@ -1,4 +1,106 @@
+import hashlib
+import queue
+import threading
+
+from redis.exceptions import NoScriptError
+
+
+# KEYS: key:{user_id}, p:{user_id}  ARGV: max score, count
+LIST_SCRIPT = """
+local ids = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[1], '-inf', 'LIMIT', 0, ARGV[2])
+if #ids == 0 then
+    return {ids, {}}
+end
+return {ids, redis.call('HMGET', KEYS[2], unpack(ids))}
+"""
+
+# KEYS: key:{user_id}, p:{user_id}  ARGV: post ids
+# an id is only removed if its post is still missing, a concurrent write may have added it meanwhile
+SWEEP_SCRIPT = """
+local removed = 0
+for i, id in ipairs(ARGV) do
+    if redis.call('HEXISTS', KEYS[2], id) == 0 then
+        removed = removed + redis.call('ZREM', KEYS[1], id)
+    end
+end
+return removed
+"""
+
+# unpack() in LIST_SCRIPT puts every id on the Lua stack, which holds about 8000 values
+MAX_PAGE_SIZE = 1000
+
+LIST_SCRIPT_SHA = hashlib.sha1(LIST_SCRIPT.encode('utf-8')).hexdigest()
+
+
+def run_script(conn, script, sha, keys, args):
+    try:
+        return conn.evalsha(sha, len(keys), *keys, *args)
+    except NoScriptError:
+        return conn.eval(script, len(keys), *keys, *args)
+
+
+class StaleSweeper:
+    """
+    Removes post ids whose contents are gone from the users' ZSETs, off the request path.
+    Reported ids are batched and swept every `interval` seconds with one pipeline per connection pool.
+    """
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def report(self, conn, user_id, post_ids):
+        self.queue.put((conn, user_id, post_ids))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="stale-sweeper", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print("Sweep failed: ", str(e))
+
+    def sweep(self):
+        batches = {}
+        while True:
+            try:
+                conn, user_id, post_ids = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            pool = conn.connection_pool
+            conn, users = batches.setdefault(id(pool), (conn, {}))
+            users.setdefault(user_id, set()).update(post_ids)
+
+        removed = 0
+        for conn, users in batches.values():
+            # a failing shard does not lose the batches of the others, and its own is swept next time
+            try:
+                script = conn.register_script(SWEEP_SCRIPT)
+                pipe = conn.pipeline(transaction=False)
+                for user_id, post_ids in users.items():
+                    script(keys=[f"key:{user_id}", f"p:{user_id}"], args=list(post_ids), client=pipe)
+                removed += sum(pipe.execute())
+            except Exception as e:
+                print("Sweep failed: ", str(e))
+                for user_id, post_ids in users.items():
+                    self.report(conn, user_id, post_ids)
+
+        return removed
+
+
 class PostService:
+    def __init__(self, sweeper=None):
+        self.sweeper = sweeper
+
     def write(self, conn, user_id, post_id, value):
         user_key = f"key:{user_id}"
         post_key = f"p:{user_id}"
@@ -15,33 +117,30 @@ class PostService:
         return {"post_id": post_id, "contents": post_raw.decode('utf-8')}
 
     def list(self, conn, user_id, limit=10, last=-1):
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
         if last == -1:
             last = "+inf"
 
         key = f"key:{user_id}"
-        print(key, last, limit)
-        values = conn.zrevrangebyscore(key, last, "-inf", start=0, num=limit+1) 
+        post_key = f"p:{user_id}"
+        # ids and contents in one round trip
+        values, posts_raw = run_script(conn, LIST_SCRIPT, LIST_SCRIPT_SHA, [key, post_key], [last, limit+1])
 
         next_id = None
-        length = len(values)
         if len(values) == limit+1:
             next_id = values[-1].decode('utf-8')
 
         results = [v.decode('utf-8') for v in values[:limit]]
-        post_key = f"p:{user_id}"
-        print(results)
-        posts_raw = conn.hmget(post_key, results)
-
         datas = zip(results, posts_raw)
         unexisted_keys = []
         posts = []
         for data in datas:
             if data[1]:
-                posts.append({"post_id": data[0], "contents": data[1]}) 
+                posts.append({"post_id": data[0], "contents": data[1]})
             else:
                 unexisted_keys.append(data[0])
-            
-        if len(unexisted_keys) > 0:
-            conn.delete(post_key, unexisted_keys)
- 
+
+        if len(unexisted_keys) > 0 and self.sweeper:
+            self.sweeper.report(conn, user_id, unexisted_keys)
+
         return (posts, next_id)
@@ -1,9 +1,14 @@
 import redis
+import redis.asyncio
 
 
 class RedisConnection:
     def __init__(self, host):
         self.pool = redis.ConnectionPool.from_url(f"redis://{host}")
+        self.async_pool = redis.asyncio.ConnectionPool.from_url(f"redis://{host}")
 
     def get_conn(self):
         return redis.StrictRedis(connection_pool=self.pool)
+
+    def get_async_conn(self):
+        return redis.asyncio.StrictRedis(connection_pool=self.async_pool)
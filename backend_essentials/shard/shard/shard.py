@@ -1,5 +1,7 @@
 import typing
 
+from bisect import bisect_right
+
 from redis_conn import RedisConnection
 
 
@@ -55,15 +57,37 @@ class RangeShardPolicy(ShardPolicy):
 
         self.infos = infos
 
+        # ranges are contiguous, so the start boundaries are sorted and the end of the last range bounds them all
+        self.starts = [info.start for info in infos]
+        self.hosts = [info.get() for info in infos]
+        self.last_end = infos[-1].end
+
+    def find_index(self, key: int) -> int:
+        idx = bisect_right(self.starts, key) - 1
+        if idx < 0:
+            return -1
+
+        if idx == len(self.starts) - 1 and self.last_end != INFINITE and key >= self.last_end:
+            return -1
+
+        return idx
+
     def getShardInfo(self, key: int) -> str:
-        for info in self.infos:
-            if info.end == INFINITE:
-                return info.get()
+        idx = self.find_index(key)
+        if idx < 0:
+            return None
+
+        return self.hosts[idx]
 
-            if info.start <= key < info.end:
-                return info.get()
+    def get_shards_for(self, keys) -> typing.Dict[str, typing.List[int]]:
+        """
+        Groups keys by the host of their shard. Keys outside of every range are grouped under None.
+        """
+        shards = {}
+        for key in keys:
+            shards.setdefault(self.getShardInfo(key), []).append(key)
 
-        return None
+        return shards
 
 
 class RangeShardManager:
@@ -86,6 +110,12 @@ class RangeShardManager:
     def get_conn_by_host(self, host: str):
         return self.connections[host].get_conn()
 
+    def get_async_conn_by_host(self, host: str):
+        return self.connections[host].get_async_conn()
+
     def get_conn(self, key: int):
         host = self.policy.getShardInfo(key)
         return self.connections[host].get_conn()
+
+    def get_shards_for(self, keys):
+        return self.policy.get_shards_for(keys)
@@ -0,0 +1,48 @@
+from shard import RangeShardPolicy, RangeInfo
+
+import pytest
+
+
+def make_policy(last_end=-1):
+    infos = [
+        RangeInfo(0, 100, "host1"),
+        RangeInfo(100, 200, "host2"),
+        RangeInfo(200, 300, "host3"),
+        RangeInfo(300, last_end, "host4"),
+    ]
+    return RangeShardPolicy(infos)
+
+def test_range_shard_policy_boundaries():
+    policy = make_policy()
+    assert policy.getShardInfo(0) == "host1"
+    assert policy.getShardInfo(99) == "host1"
+    assert policy.getShardInfo(100) == "host2"
+    assert policy.getShardInfo(299) == "host3"
+    assert policy.getShardInfo(300) == "host4"
+    assert policy.getShardInfo(10**12) == "host4"
+
+def test_range_shard_policy_out_of_range():
+    policy = make_policy(400)
+    assert policy.getShardInfo(-1) == None
+    assert policy.getShardInfo(399) == "host4"
+    assert policy.getShardInfo(400) == None
+
+def test_range_shard_policy_invalid_gap():
+    infos = [
+        RangeInfo(0, 100, "host1"),
+        RangeInfo(150, 200, "host2"),
+    ]
+
+    with pytest.raises(Exception):
+        policy = RangeShardPolicy(infos)
+
+def test_get_shards_for():
+    policy = make_policy(400)
+    shards = policy.get_shards_for([1, 150, 99, 350, 250, 100, 1000])
+    assert shards == {
+        "host1": [1, 99],
+        "host2": [150, 100],
+        "host3": [250],
+        "host4": [350],
+        None: [1000],
+    }
@@ -0,0 +1,94 @@
+"""
+Wait time and Redis load of concurrent requests for one key against a local Redis.
+
+    python benchmark.py [requests] [processes] [task seconds] [keys]
+
+Requests are spread over several processes, so waiters are woken both by the in-process future
+and by the pub/sub notification of the process that ran the task. Every execution of the task is counted
+in Redis to measure how often a key was computed more than once.
+"""
+import sys
+import time
+import asyncio
+import multiprocessing
+
+import aioredis
+
+import main
+
+
+async def run_requests(prefix, keys, count, task_seconds):
+    async def expensive_operation(key):
+        await main.redis.incr(f"executions:{prefix}")
+        await asyncio.sleep(task_seconds)
+        return f"Processed result for {key}"
+
+    main.expensive_operation = expensive_operation
+    main.redis = await aioredis.from_url(main.REDIS_URL)
+
+    async def request(i):
+        start = time.perf_counter()
+        await main.get_or_run_task(f"{prefix}:{i % keys}")
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*[request(i) for i in range(count)])
+    await main.redis.close()
+    return latencies
+
+
+def worker(prefix, keys, count, task_seconds, barrier, out):
+    barrier.wait()
+    out.put(asyncio.run(run_requests(prefix, keys, count, task_seconds)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def commands_processed():
+    conn = await aioredis.from_url(main.REDIS_URL)
+    stats = await conn.info("stats")
+    await conn.close()
+    return stats["total_commands_processed"]
+
+
+async def executions(prefix):
+    conn = await aioredis.from_url(main.REDIS_URL)
+    count = int(await conn.get(f"executions:{prefix}") or 0)
+    await conn.close()
+    return count
+
+
+def main_bench():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    task_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    keys = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+
+    prefix = f"bench:{time.time()}"
+    before = asyncio.run(commands_processed())
+
+    barrier = multiprocessing.Barrier(processes)
+    out = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(prefix, keys, requests // processes, task_seconds, barrier, out))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+
+    latencies = [l for _ in procs for l in out.get()]
+    for p in procs:
+        p.join()
+
+    executed = asyncio.run(executions(prefix))
+    # the INFO and GET calls of this script and the INCR of every execution are not requests' load
+    ops = asyncio.run(commands_processed()) - before - 2 - executed
+    extra = [l - task_seconds for l in latencies]
+    print(f"requests={len(latencies)} processes={processes} keys={keys} task={task_seconds}s")
+    print(f"executions={executed} duplicated={executed - keys} ({(executed - keys) / keys:.1%} of keys)")
+    print(f"wait beyond the task p50={percentile(extra, 0.5) * 1000:.1f}ms p99={percentile(extra, 0.99) * 1000:.1f}ms")
+    print(f"redis commands={ops} per request={ops / len(latencies):.3f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+from typing import Optional
+
+# KEYS[1] lease  ARGV[1] token  ARGV[2] ttl in ms
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1] lease  ARGV[1] token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] lease  KEYS[2] key  ARGV[1] token  ARGV[2] value  ARGV[3] ttl in seconds
+GUARDED_SET_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class Lease:
+    """
+    A distributed single-flight lock.
+
+    It is taken with SET NX PX and its value is a random token, so every holder has a different one. While held,
+    a heartbeat extends it every ttl/3, and writes guarded by the token are rejected once it expired and somebody
+    else took it. It is released with a compare-and-delete.
+    """
+    def __init__(self, redis, name: str, token: str, ttl_ms: int):
+        self.redis = redis
+        self.name = name
+        self.token = token
+        self.ttl_ms = ttl_ms
+        self.lost = False
+        self.heartbeat_task = None
+
+    @classmethod
+    async def acquire(cls, redis, name: str, ttl_ms: int) -> Optional["Lease"]:
+        token = uuid.uuid4().hex
+        if not await redis.set(name, token, nx=True, px=ttl_ms):
+            return None
+        return cls(redis, name, token, ttl_ms)
+
+    async def extend(self) -> bool:
+        ok = await self.redis.eval(EXTEND_SCRIPT, 1, self.name, self.token, self.ttl_ms)
+        if not ok:
+            self.lost = True
+        return bool(ok)
+
+    async def release(self) -> bool:
+        return bool(await self.redis.eval(RELEASE_SCRIPT, 1, self.name, self.token))
+
+    async def guarded_set(self, key: str, value: str, ex: int) -> bool:
+        """Writes key only if this lease is still held."""
+        return bool(await self.redis.eval(GUARDED_SET_SCRIPT, 2, self.name, key, self.token, value, ex))
+
+    async def heartbeat(self):
+        interval = self.ttl_ms / 3 / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.extend():
+                    print(f"Lease {self.name} lost")
+                    return
+            except Exception as e:
+                print(f"Lease {self.name} heartbeat failed: {e}")
+
+    async def __aenter__(self):
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.heartbeat_task.cancel()
+        await self.release()
@@ -1,7 +1,13 @@
 import asyncio
 import aioredis
+import json
+import math
+import random
+import time
 from fastapi import FastAPI, HTTPException
-from typing import Optional
+from typing import Dict, Optional
+
+from lease import Lease
 
 app = FastAPI()
 redis = None
@@ -9,46 +15,174 @@ redis = None
 REDIS_URL = "redis://localhost:6379"
 TASK_TIMEOUT = 10  # seconds
 EXPENSIVE_TASK_RESULT_TTL = 60  # seconds
+POLL_INTERVAL = 1  # seconds, fallback when a notification is missed
+FAILED = "__failed__"
+LEASE_TTL_MS = TASK_TIMEOUT * 1000  # extended by heartbeats while the task runs
+
+# stale-while-revalidate: a result is kept STALE_TTL seconds past its expiry and served while one refresh runs,
+# and the refresh starts early with a probability growing towards the expiry (XFetch)
+STALE_WHILE_REVALIDATE = True
+STALE_TTL = 60  # seconds
+XFETCH_BETA = 1.0
+
+# one task per key shared by every waiter of this process
+inflight: Dict[str, asyncio.Task] = {}
+# keys whose background refresh runs in this process
+refreshing: Dict[str, asyncio.Task] = {}
+
+
+def done_channel(key: str) -> str:
+    return f"done:{key}"
+
+
+def lease_key(key: str) -> str:
+    return f"lease:{key}"
+
+
+def result_ttl() -> int:
+    if STALE_WHILE_REVALIDATE:
+        return EXPENSIVE_TASK_RESULT_TTL + STALE_TTL
+    return EXPENSIVE_TASK_RESULT_TTL
+
+
+def pack_entry(value: str, delta: float) -> str:
+    """A cached result keeps how long it took to compute and when it logically expires."""
+    return json.dumps({"value": value, "delta": delta, "expiry": time.time() + EXPENSIVE_TASK_RESULT_TTL})
+
+
+def should_refresh(entry: dict) -> bool:
+    """XFetch: true once expired, and with a probability growing with delta as the expiry gets close."""
+    if not STALE_WHILE_REVALIDATE:
+        return False
+    return time.time() - entry["delta"] * XFETCH_BETA * math.log(1.0 - random.random()) >= entry["expiry"]
+
 
 async def expensive_operation(key: str) -> str:
     """Simulates a time-consuming operation."""
     await asyncio.sleep(5)  # Simulate delay
     return f"Processed result for {key}"
 
-async def get_or_run_task(key: str) -> str:
+
+async def wait_for_result(key: str) -> Optional[str]:
+    """
+    Waits for the lease holder to finish the task, woken up by pub/sub and polling only as a fallback.
+    Returns None when the lease is gone without a result, so the caller may take it over.
+    """
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(done_channel(key))
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TASK_TIMEOUT
+        next_poll = loop.time()
+        while True:
+            if loop.time() >= next_poll:
+                # also covers a result written before the subscription was made
+                task_status = await redis.get(key)
+                if task_status:
+                    return json.loads(task_status)["value"]
+                if not await redis.exists(lease_key(key)):
+                    return None
+                next_poll = loop.time() + POLL_INTERVAL
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise HTTPException(status_code=500, detail="Task timeout")
+
+            # returns early on subscription confirmations as well, the poll above is rate limited
+            message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                               timeout=min(remaining, next_poll - loop.time()))
+            if message:
+                result = message["data"].decode("utf-8")
+                if result == FAILED:
+                    raise HTTPException(status_code=500, detail="Task failed")
+                return result
+    finally:
+        await pubsub.unsubscribe(done_channel(key))
+        await pubsub.close()
+
+
+async def compute_entry(key: str, lease: Lease) -> str:
+    """Runs the expensive task and caches its result with the time it took, if the lease is still held."""
+    start = time.monotonic()
+    result = await expensive_operation(key)
+    if not await lease.guarded_set(key, pack_entry(result, time.monotonic() - start), result_ttl()):
+        print(f"Lease of {key} was lost, result is not cached")
+    return result
+
+
+async def refresh(key: str):
+    """Recomputes a cached result in the background, once across every process."""
+    lease = await Lease.acquire(redis, lease_key(key), LEASE_TTL_MS)
+    if not lease:
+        return
+
+    async with lease:
+        try:
+            await compute_entry(key, lease)
+        except Exception as e:
+            print(f"Refresh of {key} failed: {e}")
+
+
+def schedule_refresh(key: str):
+    if key in refreshing:
+        return
+
+    task = asyncio.ensure_future(refresh(key))
+    refreshing[key] = task
+    task.add_done_callback(lambda t: refreshing.pop(key, None))
+
+
+async def run_task(key: str) -> str:
     """Manages task execution with Redis to avoid thundering herd."""
     global redis
 
-    # Check if the task is already running or completed
-    task_status = await redis.get(key)
-    if task_status:
-        if task_status.decode("utf-8") == "processing":
-            # Wait for the existing task to finish
-            for _ in range(TASK_TIMEOUT):
-                await asyncio.sleep(1)
-                task_status = await redis.get(key)
-                if task_status and task_status.decode("utf-8") != "processing":
-                    return task_status.decode("utf-8")
-            raise HTTPException(status_code=500, detail="Task timeout")
+    while True:
+        # Check if the task is already completed
+        task_status = await redis.get(key)
+        if task_status:
+            # If result exists in cache, return it, stale or not, and refresh it in the background when due
+            entry = json.loads(task_status)
+            if should_refresh(entry):
+                schedule_refresh(key)
+            return entry["value"]
 
-        # If result exists in cache, return it
-        return task_status.decode("utf-8")
+        lease = await Lease.acquire(redis, lease_key(key), LEASE_TTL_MS)
+        if lease:
+            break
 
-    try:
-        # Mark task as processing in Redis
-        await redis.set(key, "processing", ex=TASK_TIMEOUT)
+        # Wait for the lease holder to finish, or take over when its lease expired without a result
+        result = await wait_for_result(key)
+        if result is not None:
+            return result
 
-        # Run the expensive task
-        result = await expensive_operation(key)
+    async with lease:
+        # the result may have been written between the GET and the lease
+        task_status = await redis.get(key)
+        if task_status:
+            return json.loads(task_status)["value"]
 
-        # Cache the result in Redis
-        await redis.set(key, result, ex=EXPENSIVE_TASK_RESULT_TTL)
+        try:
+            # Run the expensive task and cache the result in Redis
+            result = await compute_entry(key, lease)
+        except BaseException:
+            await redis.publish(done_channel(key), FAILED)
+            raise
+
+        # Wake up the waiters of other processes
+        await redis.publish(done_channel(key), result)
         return result
-    finally:
-        # Clean up processing marker if the task fails
-        current_status = await redis.get(key)
-        if current_status and current_status.decode("utf-8") == "processing":
-            await redis.delete(key)
+
+
+async def get_or_run_task(key: str) -> str:
+    """Single-flight per process: concurrent requests for a key share one task."""
+    task = inflight.get(key)
+    if not task:
+        # a separate task, so a cancelled request does not cancel the work the others wait for
+        task = asyncio.ensure_future(run_task(key))
+        inflight[key] = task
+        task.add_done_callback(lambda t: inflight.pop(key, None))
+
+    return await asyncio.shield(task)
 
 @app.on_event("startup")
 async def startup():
@@ -68,4 +202,3 @@ async def compute(key: str):
     """Endpoint that computes or fetches the result."""
     result = await get_or_run_task(key)
     return {"key": key, "result": result}
-